@@ -0,0 +1,308 @@
+""" Measure time vdist itself spends building packages.
+
+Build machines are replaced by in-process fakes, so docker and compilation
+times are left out and what remains is vdist overhead: loading profiles,
+rendering templates, populating build folders, parsing configuration files
+and dispatching batch builds. Results are written as JSON, and can be
+compared with those of another commit:
+
+    python -m benchmarks.run_benchmarks -o after.json --compare before.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+import benchmarks.fake_machine as fake_machine
+import vdist.builder as builder
+import vdist.buildmachine as buildmachine
+import vdist.configuration as configuration
+import vdist.defaults as defaults
+import vdist.engine as engine
+import vdist.scheduler as scheduler
+import vdist.vdist_launcher as vdist_launcher
+
+CONFIGURATION_COUNTS = [1, 10, 100, 1000]
+SOURCE_SIZES = [10, 100, 1000]
+REPETITIONS = 3
+SOURCE_FILE_SIZE = 4096
+SOURCE_FILES_PER_FOLDER = 50
+
+
+@contextlib.contextmanager
+def fake_environment(user_dir: str) -> Iterator[None]:
+    """ Replace build machines by fakes and vdist user folder by another one.
+
+    :param user_dir: Folder to use instead of ~/.vdist.
+    """
+    patches = [(defaults, name, value.replace(defaults.VDIST_USERDIR,
+                                              user_dir, 1))
+               for name, value in vars(defaults).items()
+               if isinstance(value, str) and
+               value.startswith(defaults.VDIST_USERDIR)]
+    patches.extend([(buildmachine, "BuildMachine",
+                     fake_machine.FakeBuildMachine),
+                    (buildmachine, "kill_containers",
+                     fake_machine.kill_containers),
+                    (engine, "BuildEngine", fake_machine.FakeBuildEngine)])
+    originals = [(module, name, getattr(module, name))
+                 for module, name, _ in patches]
+    for module, name, value in patches:
+        setattr(module, name, value)
+    # Thousands of builds would log far more than we want to read.
+    logging.disable(logging.INFO)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+        for module, name, value in originals:
+            setattr(module, name, value)
+
+
+def write_source_tree(path: str, files: int) -> str:
+    for index in range(files):
+        folder = os.path.join(path, "app", f"module{index // SOURCE_FILES_PER_FOLDER}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"file{index}.py"), "w") as f:
+            f.write("#" * SOURCE_FILE_SIZE)
+    with open(os.path.join(path, "requirements.txt"), "w") as f:
+        f.write("")
+    return path
+
+
+def write_configuration_file(path: str, configurations: int,
+                             source_dir: str, output_folder: str) -> str:
+    lines = ["[DEFAULT]",
+             "version = 1.0",
+             "profile = ubuntu-lts",
+             f"source_directory = {source_dir}",
+             f"output_folder = {output_folder}",
+             "fpm_args = --maintainer vdist@vdist -a native --description "
+             "\"Benchmark application\" --license MIT",
+             "runtime_deps = libssl1.0.0, libffi6",
+             ""]
+    for index in range(configurations):
+        lines.extend([f"[app{index}]", f"app = app{index}", ""])
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+    return path
+
+
+def measure(function: Callable[[], object], repetitions: int,
+            teardown: Callable[[object], None]=None) -> Dict[str, float]:
+    """ Time a function.
+
+    :param function: Function to time.
+    :param repetitions: How many times to run it.
+    :param teardown: Function called, untimed, with every function result.
+    :return: Dict with number of runs and minimum, median and mean seconds
+        they took.
+    """
+    durations = []
+    for _ in range(repetitions):
+        started_at = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - started_at)
+        if teardown is not None:
+            teardown(result)
+    return {"runs": repetitions,
+            "min": min(durations),
+            "median": statistics.median(durations),
+            "mean": statistics.mean(durations)}
+
+
+def benchmark_prepare_build(workdir: str, source_sizes: List[int],
+                            repetitions: int) -> List[dict]:
+    results = []
+    for files in source_sizes:
+        source_dir = write_source_tree(
+            os.path.join(workdir, f"prepare_source_{files}"), files)
+        _configuration = configuration.Configuration(
+            {"app": "app", "version": "1.0", "profile": "ubuntu-lts",
+             "source_directory": source_dir,
+             "output_folder": os.path.join(workdir, "output")})
+        result = measure(
+            lambda: builder._prepare_build(_configuration), repetitions,
+            teardown=lambda _builder: _builder.discard_build_folder_tree())
+        results.append(dict(result, name="prepare_build",
+                            parameters={"source_files": files}))
+    return results
+
+
+def benchmark_configuration_parsing(workdir: str, counts: List[int],
+                                    repetitions: int) -> List[dict]:
+    results = []
+    for count in counts:
+        configuration_file = write_configuration_file(
+            os.path.join(workdir, f"parse_{count}.cfg"), count,
+            os.path.join(workdir, "source"), os.path.join(workdir, "output"))
+        result = measure(lambda: configuration.read(configuration_file),
+                         repetitions)
+        results.append(dict(result, name="configuration_read",
+                            parameters={"configurations": count}))
+    return results
+
+
+def benchmark_run_builds(workdir: str, counts: List[int], source_files: int,
+                         repetitions: int) -> List[dict]:
+    results = []
+    source_dir = write_source_tree(os.path.join(workdir, "builds_source"),
+                                   source_files)
+    for count in counts:
+        configuration_file = write_configuration_file(
+            os.path.join(workdir, f"builds_{count}.cfg"), count, source_dir,
+            os.path.join(workdir, f"builds_output_{count}"))
+        configurations = configuration.read(configuration_file)
+
+        output = io.StringIO()
+
+        def run_builds() -> List[builder.BuildResult]:
+            # Every run bakes base images of its batch groups again.
+            fake_machine.FakeBuildMachine.images.clear()
+            output.seek(0)
+            output.truncate()
+            # Resources are plenty, so we measure dispatch and not waits.
+            build_scheduler = scheduler.BuildScheduler(
+                max_cpus=multiprocessing.cpu_count() * count,
+                max_memory=defaults.COMPILE_JOB_MEMORY * count,
+                max_compiles=count,
+                cost_model=scheduler.BuildCostModel(
+                    history_file=defaults.BUILD_TIMES_FILE))
+            with contextlib.redirect_stdout(output):
+                return vdist_launcher.run_builds(
+                    configurations, pool_size=0,
+                    build_scheduler=build_scheduler, force=True,
+                    engine_type="asyncio")
+
+        def check_results(build_results: List[builder.BuildResult]) -> None:
+            failed = [result for result in build_results
+                      if not result.succeeded]
+            if failed:
+                raise RuntimeError(f"Benchmark builds failed: {failed[0]}")
+            # Failed bakes would leave builds on a fallback path instead.
+            for line in output.getvalue().splitlines():
+                if line.startswith("Could not bake"):
+                    raise RuntimeError(f"Benchmark bake failed: {line}")
+
+        result = measure(run_builds, repetitions, teardown=check_results)
+        results.append(dict(result, name="run_builds",
+                            parameters={"configurations": count,
+                                        "source_files": source_files}))
+    return results
+
+
+def _get_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode("utf8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(counts: List[int]=None, source_sizes: List[int]=None,
+                   repetitions: int=REPETITIONS) -> dict:
+    """ Run every benchmark.
+
+    :param counts: Numbers of configurations to parse and build.
+    :param source_sizes: Numbers of files of sources to prepare builds for.
+    :param repetitions: Times every benchmark is run.
+    :return: Benchmark results, along with what they were measured on.
+    """
+    counts = counts or CONFIGURATION_COUNTS
+    source_sizes = source_sizes or SOURCE_SIZES
+    started_at = time.time()
+    with tempfile.TemporaryDirectory(prefix="vdistbenchmark") as workdir, \
+            fake_environment(os.path.join(workdir, "vdist")):
+        results = benchmark_prepare_build(workdir, source_sizes, repetitions)
+        results.extend(benchmark_configuration_parsing(workdir, counts,
+                                                       repetitions))
+        results.extend(benchmark_run_builds(workdir, counts,
+                                            min(source_sizes), repetitions))
+    return {"commit": _get_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": multiprocessing.cpu_count(),
+            "started_at": started_at,
+            "duration": time.time() - started_at,
+            "benchmarks": results}
+
+
+def _get_benchmark_key(result: dict) -> str:
+    parameters = ", ".join(f"{name}={value}" for name, value
+                           in sorted(result["parameters"].items()))
+    return f"{result['name']}[{parameters}]"
+
+
+def compare(baseline: dict, results: dict) -> List[str]:
+    """ Tell how medians changed from a baseline to results.
+
+    :param baseline: Results of a former run_benchmarks.
+    :param results: Results of a later run_benchmarks.
+    :return: A line for every benchmark found in both.
+    """
+    baseline_medians = {_get_benchmark_key(result): result["median"]
+                        for result in baseline["benchmarks"]}
+    lines = []
+    for result in results["benchmarks"]:
+        key = _get_benchmark_key(result)
+        if key not in baseline_medians:
+            continue
+        change = (result["median"] - baseline_medians[key]) / \
+            baseline_medians[key] * 100
+        lines.append(f"{key}: {baseline_medians[key]:.4f}s -> "
+                     f"{result['median']:.4f}s ({change:+.1f}%)")
+    return lines
+
+
+def _parse_arguments(args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measure vdist overhead "
+                                                 "with fake build machines.")
+    parser.add_argument("-o", "--output", default="benchmark_results.json",
+                        help="JSON file to write results to.",
+                        metavar="OUTPUT_FILE")
+    parser.add_argument("--compare",
+                        help="JSON results of a former run to compare with.",
+                        metavar="BASELINE_FILE")
+    parser.add_argument("--counts", type=int, nargs="+",
+                        default=CONFIGURATION_COUNTS,
+                        help="Numbers of configurations to parse and build.",
+                        metavar="COUNT")
+    parser.add_argument("--source_sizes", type=int, nargs="+",
+                        default=SOURCE_SIZES,
+                        help="Numbers of files of sources to prepare.",
+                        metavar="FILES")
+    parser.add_argument("--repetitions", type=int, default=REPETITIONS,
+                        help="Times every benchmark is run.",
+                        metavar="TIMES")
+    return parser.parse_args(args)
+
+
+def main(args: List[str]=None) -> None:
+    arguments = _parse_arguments(sys.argv[1:] if args is None else args)
+    results = run_benchmarks(arguments.counts, arguments.source_sizes,
+                             arguments.repetitions)
+    with open(arguments.output, "w") as f:
+        f.write(json.dumps(results, indent=4, sort_keys=True))
+    for result in results["benchmarks"]:
+        print(f"{_get_benchmark_key(result)}: {result['median']:.4f}s")
+    if arguments.compare is not None:
+        with open(arguments.compare) as f:
+            baseline = json.loads(f.read())
+        print(f"Compared with {baseline.get('commit')}:")
+        for line in compare(baseline, results):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
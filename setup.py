@@ -76,7 +76,8 @@ setup(
     url='https://github.com/dante-signal31/vdist',
     data_files=find_man_pages(),
     packages=find_packages(exclude=["tests", "integration-tests",
-                                    "ci_scripts", "examples", "docs"]),
+                                    "ci_scripts", "examples", "docs",
+                                    "benchmarks"]),
     install_requires=['jinja2==2.10.1', 'docker==3.2.1'],
     entry_points={'console_scripts': ['vdist=vdist.vdist_launcher:main', ], },
     package_data={'': ['internal_profiles.json', '*.sh']},
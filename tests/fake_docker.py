@@ -0,0 +1,189 @@
+import http.server
+import itertools
+import json
+import os
+import re
+import socketserver
+import struct
+import tempfile
+import threading
+import urllib.parse
+
+
+def _get_full_image_name(name):
+    if ":" in name.rsplit("/", 1)[-1]:
+        return name
+    return f"{name}:latest"
+
+
+class FakeDockerHandler(http.server.BaseHTTPRequestHandler):
+    # Keep-alive, as docker daemon does.
+    protocol_version = "HTTP/1.1"
+
+    ROUTES = [
+        ("GET", r"/images/(?P<name>.+)/json", "inspect_image"),
+        ("POST", r"/images/create", "pull_image"),
+        ("POST", r"/containers/create", "create_container"),
+        ("POST", r"/containers/(?P<id>[^/]+)/start", "no_content"),
+        ("POST", r"/containers/(?P<id>[^/]+)/update", "update_container"),
+        ("POST", r"/containers/(?P<id>[^/]+)/exec", "create_exec"),
+        ("POST", r"/containers/(?P<id>[^/]+)/kill", "kill_container"),
+        ("POST", r"/containers/(?P<id>[^/]+)/stop", "no_content"),
+        ("DELETE", r"/containers/(?P<id>[^/]+)", "remove_container"),
+        ("POST", r"/exec/(?P<id>[^/]+)/start", "start_exec"),
+        ("GET", r"/exec/(?P<id>[^/]+)/json", "inspect_exec"),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method):
+        length = int(self.headers.get("Content-Length", 0))
+        self.body = json.loads(self.rfile.read(length).decode("utf8")) \
+            if length else None
+        path = re.sub(r"^/v[0-9.]+", "", self.path.split("?")[0])
+        self.server.requests.append((method, path))
+        for route_method, pattern, handler in self.ROUTES:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                getattr(self, handler)(**match.groupdict())
+                return
+        self._send_json(404, {"message": f"no route for {method} {path}"})
+
+    def _send_json(self, status, document):
+        content = json.dumps(document).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def no_content(self, id=None):
+        self.send_response(204)
+        self.end_headers()
+
+    def inspect_image(self, name):
+        name = _get_full_image_name(name)
+        if name not in self.server.images:
+            self._send_json(404, {"message": f"No such image: {name}"})
+            return
+        self._send_json(200, {"Id": self.server.images[name]})
+
+    def pull_image(self):
+        query = dict(urllib.parse.parse_qsl(self.path.split("?")[1]))
+        image = f"{query['fromImage']}:{query['tag']}"
+        self.server.images[image] = f"sha256:{len(self.server.images)}"
+        self.send_response(200)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for message in ({"status": "Pulling"}, {"status": "Downloaded"}):
+            line = json.dumps(message).encode("utf8") + b"\r\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def create_container(self):
+        if _get_full_image_name(self.body["Image"]) not in self.server.images:
+            self._send_json(404,
+                            {"message": f"No such image: {self.body['Image']}"})
+            return
+        container_id = f"container{next(self.server.ids)}"
+        self.server.containers[container_id] = {
+            "config": self.body, "killed": threading.Event(), "updates": []}
+        self._send_json(201, {"Id": container_id})
+
+    def update_container(self, id):
+        self.server.containers[id]["updates"].append(self.body)
+        self._send_json(200, {"Warnings": []})
+
+    def create_exec(self, id):
+        exec_id = f"exec{next(self.server.ids)}"
+        self.server.execs[exec_id] = {"container": id, "config": self.body,
+                                      "exit_code": None}
+        self._send_json(201, {"Id": exec_id})
+
+    def start_exec(self, id):
+        _exec = self.server.execs[id]
+        container = self.server.containers[_exec["container"]]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+        self.end_headers()
+        # Raw streams are hijacked: they end when connection is closed.
+        self.close_connection = True
+        script = self.server.script
+        for stream, text in script["output"]:
+            data = text.encode("utf8")
+            self.wfile.write(struct.pack(">BxxxL", stream, len(data)) + data)
+            self.wfile.flush()
+        if script.get("hang") and \
+                _exec["config"]["Cmd"][0] != "bash":
+            container["killed"].wait(timeout=30)
+            return
+        _exec["exit_code"] = script["exit_code"]
+
+    def inspect_exec(self, id):
+        self._send_json(200, {"ExitCode": self.server.execs[id]["exit_code"]})
+
+    def kill_container(self, id):
+        self.server.containers[id]["killed"].set()
+        self.server.killed.append(id)
+        self.no_content()
+
+    def remove_container(self, id):
+        self.server.containers.pop(id)
+        self.no_content()
+
+
+class FakeDockerServer(socketserver.ThreadingMixIn,
+                       socketserver.UnixStreamServer):
+    """ Docker Engine API look-alike, listening on a unix socket.
+
+    Every command run in its containers prints script output, given as
+    (stream, text) tuples, and exits with script exit code. Hanging scripts
+    do not end until their container is killed.
+    """
+    daemon_threads = True
+
+    def __init__(self, images=None, output=None, exit_code=0, hang=False):
+        self.socket_dir = tempfile.mkdtemp(prefix="vdistdocker")
+        self.socket_path = os.path.join(self.socket_dir, "docker.sock")
+        super().__init__(self.socket_path, FakeDockerHandler)
+        self.lock = threading.Lock()
+        self.images = dict(images or {})
+        self.script = {"output": output or [], "exit_code": exit_code,
+                       "hang": hang}
+        self.ids = itertools.count()
+        self.containers = {}
+        self.execs = {}
+        self.killed = []
+        self.requests = []
+        self.connections = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"unix://{self.socket_path}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        self.server_close()
+        os.remove(self.socket_path)
+        os.rmdir(self.socket_dir)
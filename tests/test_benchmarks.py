@@ -0,0 +1,14 @@
+import benchmarks.run_benchmarks as run_benchmarks
+
+
+def test_benchmarks_measure_every_step():
+    results = run_benchmarks.run_benchmarks(counts=[2], source_sizes=[3],
+                                            repetitions=1)
+    names = [result["name"] for result in results["benchmarks"]]
+    assert names == ["prepare_build", "configuration_read", "run_builds"]
+    assert all(result["runs"] == 1 and result["median"] > 0
+               for result in results["benchmarks"])
+    lines = run_benchmarks.compare(results, results)
+    assert lines[-1] == "run_builds[configurations=2, source_files=3]: " \
+                        f"{results['benchmarks'][-1]['median']:.4f}s -> " \
+                        f"{results['benchmarks'][-1]['median']:.4f}s (+0.0%)"
@@ -1,4 +1,6 @@
-from vdist.builder import Build
+import pytest
+
+from vdist.builder import Build, Builder
 from vdist.source import git, directory, git_directory
 
 
@@ -80,3 +82,164 @@ def test_build_get_safe_dirname():
         profile='ubuntu-trusty'
     )
     assert build.get_safe_dirname() == 'myapp-foo______-1.0-ubuntu-trusty'
+
+
+def test_build_source_ignore_keeps_git_for_git_directory():
+    build = Build(
+        name='my build',
+        app='myapp',
+        version='1.0',
+        source=git_directory(
+            path='/var/tmp/vdist',
+            branch='release-1.0'
+        ),
+        profile='ubuntu-trusty'
+    )
+    assert '.git' not in build.get_source_ignore()
+    assert 'node_modules' in build.get_source_ignore()
+
+
+def test_build_package_formats_render_concurrent_fpm_calls():
+    build = Build(
+        name='my build',
+        app='myapp',
+        version='1.0',
+        source=directory(path='/var/tmp/vdist'),
+        profile='ubuntu-lts',
+        package_formats=['deb', 'rpm', 'tar']
+    )
+    script = Builder()._render_template(build, shared_dir='/opt/vdist')
+    assert 'for package_format in deb rpm tar; do' in script
+    assert 'fpm_package_formats $PYTHON_BASEDIR' in script
+    assert '*deb' not in script
+    with pytest.raises(ValueError):
+        Build(app='myapp', version='1.0',
+              source=directory(path='/var/tmp/vdist'), profile='ubuntu-lts',
+              package_formats=['deb', 'msi'])
+    with pytest.raises(ValueError):
+        Build(app='myapp', version='1.0',
+              source=directory(path='/var/tmp/vdist'), profile='ubuntu-lts',
+              custom_filename='myapp.pkg', package_formats=['deb', 'rpm'])
+
+
+def test_build_compile_stage_renders_parallel_ccache_compilation():
+    build = Build(app='myapp', version='1.0',
+                  source=directory(path='/var/tmp/vdist'),
+                  profile='ubuntu-lts', compile_jobs='3')
+    script = Builder()._render_template(build, shared_dir='/opt/vdist')
+    assert 'local jobs="3"' in script
+    assert 'make -j$(compile_jobs) && make install\n    report_ccache' in script
+    assert 'setup_ccache apt-get install -y ccache' in script
+    assert 'export CCACHE_DIR="/vdist_cache/ccache/ubuntu-lts"' in script
+    build = Build(app='myapp', version='1.0',
+                  source=directory(path='/var/tmp/vdist'),
+                  profile='ubuntu-lts', use_ccache=False)
+    script = Builder()._render_template(build, shared_dir='/opt/vdist')
+    assert 'local jobs=""' in script
+    assert 'export CCACHE_DIR' not in script
+    build = Build(app='myapp', version='1.0',
+                  source=directory(path='/var/tmp/vdist'),
+                  profile='ubuntu-lts', build_deps=['libssl-dev'])
+    script = Builder(executor='local')._render_template(build,
+                                                        shared_dir='/opt/vdist')
+    assert 'apt-get' not in script
+    assert '    setup_ccache\n' in script
+    with pytest.raises(ValueError):
+        Build(app='myapp', version='1.0',
+              source=directory(path='/var/tmp/vdist'), profile='ubuntu-lts',
+              compile_jobs=-2)
+
+
+def test_build_shared_runtime_renders_runtime_package_and_dependency():
+    build = Build(app='myapp', version='1.0',
+                  source=directory(path='/var/tmp/vdist'),
+                  profile='ubuntu-lts', python_version='3.7.5',
+                  runtime_deps=['libssl1.0.0'], shared_runtime=True)
+    assert build.runtime_name == 'vdist-python3.7-ubuntu-lts'
+    assert build.runtime_basedir == '/opt/vdist-python3.7'
+    script = Builder()._render_template(build, shared_dir='/opt/vdist')
+    assert 'relocate_python $RUNTIME_BASEDIR\n' in script
+    assert 'create_app_environment\nvdist_phase runtime_package\n' \
+        'package_runtime deb' in script
+    assert "--depends 'vdist-python3.7-ubuntu-lts >= 3.7.5'" in script
+    assert "--depends 'libssl1.0.0'" in script
+    # Runtimes holding other trees get other names.
+    optimized_build = Build(app='myapp', version='1.0',
+                            source=directory(path='/var/tmp/vdist'),
+                            profile='ubuntu-lts', python_version='3.7.5',
+                            shared_runtime=True, prune='standard')
+    assert optimized_build.runtime_name.startswith('vdist-python3.7-')
+    assert optimized_build.runtime_name != build.runtime_name
+    assert optimized_build.runtime_basedir != build.runtime_basedir
+    with pytest.raises(ValueError):
+        Build(app='myapp', version='1.0',
+              source=directory(path='/var/tmp/vdist'), profile='ubuntu-lts',
+              python_version='2.7.15', shared_runtime=True)
+    with pytest.raises(ValueError):
+        Build(app='myapp', version='1.0',
+              source=directory(path='/var/tmp/vdist'), profile='ubuntu-lts',
+              compile_python=False, shared_runtime=True)
+
+
+def test_build_prune_renders_prune_stage():
+    build = Build(app='myapp', version='1.0',
+                  source=directory(path='/var/tmp/vdist'),
+                  profile='ubuntu-lts', prune='aggressive')
+    script = Builder()._render_template(build, shared_dir='/opt/vdist')
+    assert 'vdist_phase prune\nprune_package_tree python $PYTHON_BASEDIR' \
+        in script
+    assert "find $folder -depth -name '__pycache__'" in script
+    build = Build(app='myapp', version='1.0',
+                  source=directory(path='/var/tmp/vdist'),
+                  profile='ubuntu-lts')
+    script = Builder()._render_template(build, shared_dir='/opt/vdist')
+    assert 'prune_package_tree' not in script
+    with pytest.raises(ValueError):
+        Build(app='myapp', version='1.0',
+              source=directory(path='/var/tmp/vdist'), profile='ubuntu-lts',
+              prune='everything')
+
+
+def test_build_python_optimization_renders_configure_flags_and_benchmark():
+    build = Build(app='myapp', version='1.0',
+                  source=directory(path='/var/tmp/vdist'),
+                  profile='ubuntu-lts', python_optimization='pgo+lto',
+                  configure_args='--without-doc-strings ')
+    assert build.get_python_configure_flags() == \
+        '--enable-optimizations --with-lto --without-doc-strings'
+    script = Builder()._render_template(build, shared_dir='/opt/vdist')
+    assert '--with-ensurepip=install --enable-optimizations --with-lto ' \
+        '--without-doc-strings\n' in script
+    # Only freshly compiled interpreters are benchmarked.
+    assert '    store_cached_python\n\n' \
+        '    # Interpreters restored from cache were benchmarked when ' \
+        'compiled.\n' \
+        '    vdist_phase python_benchmark\n    benchmark_python ' in script
+    build = Build(app='myapp', version='1.0',
+                  source=directory(path='/var/tmp/vdist'),
+                  profile='ubuntu-lts')
+    script = Builder()._render_template(build, shared_dir='/opt/vdist')
+    assert 'benchmark_python' not in script
+    with pytest.raises(ValueError):
+        Build(app='myapp', version='1.0',
+              source=directory(path='/var/tmp/vdist'), profile='ubuntu-lts',
+              python_optimization='o3')
+
+
+def test_build_wheelhouse_gets_only_pip_wheel_options():
+    build = Build(app='myapp', version='1.0',
+                  source=directory(path='/var/tmp/vdist'),
+                  profile='ubuntu-lts',
+                  pip_args='--user --index-url http://pypi/simple '
+                           '--target /opt/app --no-binary=:all: '
+                           '--upgrade-strategy eager --trusted-host pypi -q')
+    assert build.get_wheel_pip_args() == \
+        '--index-url http://pypi/simple --no-binary=:all: ' \
+        '--trusted-host pypi -q'
+    script = Builder()._render_template(build, shared_dir='/opt/vdist')
+    assert '$PIP_BIN wheel --index-url http://pypi/simple ' \
+        '--no-binary=:all: --trusted-host pypi -q --find-links' in script
+    # Packaging tools are not pinned to the ones wheelhouse has.
+    assert '$PIP_BIN install --user --index-url http://pypi/simple ' \
+        '--target /opt/app --no-binary=:all: --upgrade-strategy eager ' \
+        '--trusted-host pypi -q -U pip setuptools wheel' in script
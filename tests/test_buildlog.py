@@ -0,0 +1,57 @@
+import gzip
+import os
+
+import pytest
+
+import tests.testing_tools as testing_tools
+import vdist.buildlog as buildlog
+
+temporary_directory = testing_tools.get_temporary_directory_context_manager()
+
+
+def test_line_decoder_joins_split_characters_and_lines():
+    decoder = buildlog.LineDecoder()
+    encoded_text = "Building ñandú\r\nDone".encode("utf8")
+    # Split inside "ñ", which takes two bytes.
+    split_point = encoded_text.index("ñ".encode("utf8")) + 1
+    assert decoder.feed(encoded_text[:split_point]) == []
+    assert decoder.feed(encoded_text[split_point:]) == ["Building ñandú"]
+    assert decoder.flush() == ["Done"]
+
+
+def test_build_log_keeps_raw_output_compressed():
+    with temporary_directory() as tempdir:
+        log_path = buildlog.get_log_path(os.path.join(tempdir, "logs"),
+                                         "app-1.0-ubuntu-lts")
+        chunks = [b"Collecting jinja2\n", b"Successfully ", b"installed\n"]
+        with buildlog.BuildLog(log_path, "app") as build_log:
+            for chunk in chunks:
+                build_log.feed(chunk)
+        with gzip.open(log_path, "rb") as f:
+            assert f.read() == b"".join(chunks)
+        assert build_log.lines == 2
+        assert list(build_log.tail) == ["Collecting jinja2",
+                                        "Successfully installed"]
+
+
+def test_build_log_times_phases_marked_by_script():
+    with buildlog.BuildLog(None, "app") as build_log:
+        build_log.feed(b"+ vdist_phase pip_install\n+ echo '@@vdist-phase")
+        build_log.feed(b" pip_install'\n@@vdist-phase pip_install\n")
+        build_log.feed(b"Collecting jinja2\n@@vdist-phase fpm\nCreated package\n")
+    phases = build_log.get_phases()
+    assert [phase["name"] for phase in phases] == ["pip_install", "fpm"]
+    assert phases[0]["started_at"] + phases[0]["duration"] == \
+        pytest.approx(phases[1]["started_at"])
+    assert phases[1]["started_at"] + phases[1]["duration"] == \
+        pytest.approx(build_log.closed_at)
+
+
+def test_build_log_keeps_measures_reported_by_script():
+    with buildlog.BuildLog(None, "app") as build_log:
+        build_log.feed(b"+ echo '@@vdist-size python_before 2048'\n")
+        build_log.feed(b"@@vdist-size python_before 2048\n@@vdist-size pyth")
+        build_log.feed(b"on_after 1024\n@@vdist-size broken\n")
+        build_log.feed(b"@@vdist-benchmark nbody 0.250000\n")
+    assert build_log.sizes == {"python_before": 2048, "python_after": 1024}
+    assert build_log.benchmarks == {"nbody": 0.25}
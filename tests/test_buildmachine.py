@@ -0,0 +1,85 @@
+import collections
+
+import pytest
+
+import vdist.buildmachine as buildmachine
+import vdist.leftovers as leftovers
+
+ExecResult = collections.namedtuple("ExecResult", ["exit_code", "output"])
+
+
+class FakeContainer(object):
+    id = "container"
+
+    def __init__(self, exit_code=0):
+        self.exit_code = exit_code
+        self.commands = []
+
+    def exec_run(self, command):
+        self.commands.append(command)
+        return ExecResult(self.exit_code, b"rm: cannot remove\n")
+
+
+class FakeAPIClient(object):
+
+    def __init__(self, output, exit_code):
+        self.output = output
+        self.exit_code = exit_code
+
+    def exec_create(self, container_id, command, environment=None):
+        return {"Id": f"{container_id}-exec"}
+
+    def exec_start(self, exec_id, stream=False):
+        return iter(self.output)
+
+    def exec_inspect(self, exec_id):
+        return {"ExitCode": self.exit_code}
+
+
+class FakeDockerClient(object):
+
+    def __init__(self, api):
+        self.api = api
+
+
+def test_build_machine_reports_script_exit_code(monkeypatch):
+    api = FakeAPIClient([b"Collecting jinja2\n", b"error: no space left\n"], 2)
+    monkeypatch.setattr(buildmachine.docker, "from_env",
+                        lambda version=None: FakeDockerClient(api))
+    build_machine = buildmachine.BuildMachine(image="debian")
+    build_machine.container = FakeContainer()
+    assert build_machine.run_script("/opt/vdist") == 2
+    # Killed containers leave no exit code behind.
+    api.exit_code = None
+    assert build_machine.run_script("/opt/vdist") == -1
+
+
+def _get_build_machine(monkeypatch):
+    monkeypatch.setattr(buildmachine.docker, "from_env",
+                        lambda version=None: FakeDockerClient(None))
+    return buildmachine.BuildMachine(image="debian")
+
+
+def test_build_machine_reset_quotes_paths(monkeypatch):
+    build_machine = _get_build_machine(monkeypatch)
+    build_machine.container = FakeContainer()
+    build_machine.reset(["/tmp/*", "/opt/my app", "/var/tmp/Python-*"])
+    assert build_machine.container.commands == [
+        ["bash", "-c", "rm -rf /tmp/* '/opt/my app' /var/tmp/Python-*"]]
+
+
+@pytest.mark.parametrize("path", ["/*", "/", "", "tmp/*", "/usr", "/usr/*",
+                                  "//*", "/tmp/../*", "/usr/./*"])
+def test_build_machine_reset_refuses_dangerous_paths(monkeypatch, path):
+    build_machine = _get_build_machine(monkeypatch)
+    build_machine.container = FakeContainer()
+    with pytest.raises(ValueError):
+        build_machine.reset(["/opt/app", path])
+    assert build_machine.container.commands == []
+
+
+def test_build_machine_reset_fails_on_exit_code(monkeypatch):
+    build_machine = _get_build_machine(monkeypatch)
+    build_machine.container = FakeContainer(exit_code=1)
+    with pytest.raises(leftovers.MachineResetException):
+        build_machine.reset(["/opt/app"])
@@ -42,3 +42,19 @@ def test_buildprofile_invalid_arg():
             script='foo.sh',
             some_garbage='blah'
         )
+
+
+def test_buildprofile_local_executor_needs_no_image():
+    m = BuildProfile(
+        profile_id='some_profile_id',
+        script='foo.sh',
+        executor='local'
+    )
+    assert m.validate() and m.docker_image is None
+    with pytest.raises(AttributeError):
+        BuildProfile(
+            profile_id='some_profile_id',
+            docker_image='some_docker_image',
+            script='foo.sh',
+            executor='chroot'
+        )
@@ -0,0 +1,80 @@
+import os
+import time
+
+import tests.testing_tools as testing_tools
+import vdist.cache as cache
+import vdist.console_parser as console_parser
+
+temporary_directory = testing_tools.get_temporary_directory_context_manager()
+
+
+def _create_entry(root, key, size, last_used):
+    entry_path = os.path.join(root, key)
+    os.makedirs(os.path.join(entry_path, cache.ENTRY_TREE))
+    with open(os.path.join(entry_path, cache.ENTRY_TREE, "python"), "wb") as f:
+        f.write(b"x" * size)
+    marker = os.path.join(entry_path, cache.ENTRY_COMPLETE_MARKER)
+    open(marker, "w").close()
+    os.utime(marker, (last_used, last_used))
+
+
+def test_python_cache_key_is_deterministic():
+    key = cache.python_cache_key("sha256:abc", "3.7.5", "recipe")
+    assert key == cache.python_cache_key("sha256:abc", "3.7.5", "recipe")
+    assert key != cache.python_cache_key("sha256:abc", "3.7.6", "recipe")
+    assert key != cache.python_cache_key("sha256:abc", "3.7.5", "recipe",
+                                         "--with-lto")
+
+
+def test_cache_ignores_incomplete_entries():
+    with temporary_directory() as tempdir:
+        _create_entry(tempdir, "complete_entry", 10, time.time())
+        os.makedirs(os.path.join(tempdir, "incomplete_entry"))
+        os.makedirs(os.path.join(tempdir, "complete_entry.tmp.host"))
+        python_cache = cache.Cache(tempdir)
+        assert [entry.key for entry in python_cache.entries()] == \
+            ["complete_entry"]
+        assert python_cache.get("incomplete_entry") is None
+
+
+def test_cache_prune_evicts_least_recently_used():
+    with temporary_directory() as tempdir:
+        now = time.time()
+        _create_entry(tempdir, "old", 100, now - 300)
+        _create_entry(tempdir, "middle", 100, now - 200)
+        _create_entry(tempdir, "new", 100, now - 100)
+        python_cache = cache.Cache(tempdir, max_size=150)
+        evicted = python_cache.prune()
+        assert [entry.key for entry in evicted] == ["old", "middle"]
+        assert [entry.key for entry in python_cache.entries()] == ["new"]
+        python_cache.clear()
+        assert python_cache.entries() == []
+
+
+def test_parse_cache_arguments():
+    parsed_arguments = console_parser.parse_arguments(["cache", "prune",
+                                                       "--max_size", "2G"])
+    assert parsed_arguments["cache_action"] == "prune"
+    assert parsed_arguments["max_size"] == 2 * 1024 ** 3
+    assert not parsed_arguments["all"]
+
+
+def test_wheelhouse_prune_evicts_oldest_wheels():
+    with temporary_directory() as tempdir:
+        now = time.time()
+        abi_path = os.path.join(tempdir, "ubuntu-lts", "cpython-37m-x86_64-linux-gnu")
+        os.makedirs(abi_path)
+        for wheel, age in (("old-1.0-py3-none-any.whl", 300),
+                           ("new-1.0-py3-none-any.whl", 100)):
+            wheel_path = os.path.join(abi_path, wheel)
+            with open(wheel_path, "wb") as f:
+                f.write(b"x" * 100)
+            os.utime(wheel_path, (now - age, now - age))
+        wheelhouse = cache.Wheelhouse(tempdir, max_size=150)
+        entry, = wheelhouse.entries()
+        assert entry.metadata["wheels"] == 2
+        assert entry.size == 200
+        evicted = wheelhouse.prune()
+        assert [wheel.key.split("/")[-1] for wheel in evicted] == \
+            ["old-1.0-py3-none-any.whl"]
+        assert os.listdir(abi_path) == ["new-1.0-py3-none-any.whl"]
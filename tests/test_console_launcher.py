@@ -106,7 +106,8 @@ UBUNTU_ARGPARSED_ARGUMENTS = {
     "output_folder": DUMMY_OUTPUT_FOLDER,
     "after_install": 'packaging/postinst.sh',
     "after_remove": 'packaging/postuninst.sh',
-    "output_script": False
+    "output_script": False,
+    "force": False
 }
 
 
@@ -188,6 +189,19 @@ def test_configuration_file_read():
         assert "Centos7-package" in configurations
 
 
+
+def test_configuration_boolean_arguments():
+    assert configuration.Configuration(
+        {"use_ccache": "no"}).builder_parameters["use_ccache"] is False
+    assert configuration.Configuration(
+        {"use_ccache": "True"}).builder_parameters["use_ccache"] is True
+    assert configuration.Configuration(
+        {"shared_runtime": "yes"}).builder_parameters["shared_runtime"] is True
+    assert "use_ccache" not in configuration.Configuration(
+        {}).builder_parameters
+    with pytest.raises(ValueError):
+        configuration.Configuration({"shared_runtime": "maybe"})
+
 def test_parse_arguments():
     # Batch mode
     parsed_arguments = console_parser.parse_arguments(["batch", "/etc/passwd"])
@@ -209,6 +223,19 @@ def test_parse_arguments():
            and parsed_arguments["output_script"]
 
 
+def test_images_bake_configuration_from_arguments():
+    parsed_arguments = console_parser.parse_arguments(
+        ["images", "bake", "-p", "ubuntu-lts", "-V", "3.6.4"])
+    configurations = vdist_launcher._get_bake_configurations(parsed_arguments)
+    bake_configuration = configurations["ubuntu-lts-3.6.4"]
+    assert bake_configuration.builder_parameters["profile"] == "ubuntu-lts"
+    assert bake_configuration.builder_parameters["python_version"] == "3.6.4"
+    with pytest.raises(ValueError):
+        vdist_launcher._get_bake_configurations(
+            console_parser.parse_arguments(["images", "bake", "-p",
+                                            "ubuntu-lts"]))
+
+
 def test_move_package_to_output_folder():
     temporary_directory = testing_tools.get_temporary_directory_context_manager()
     with temporary_directory() as tempdir:
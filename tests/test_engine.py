@@ -0,0 +1,128 @@
+import concurrent.futures as futures
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import tests.fake_docker as fake_docker
+import tests.testing_tools as testing_tools
+import vdist.buildlog as buildlog
+import vdist.engine as engine
+import vdist.leftovers as leftovers
+import vdist.scheduler as scheduler
+
+STDOUT = 1
+STDERR = 2
+
+temporary_directory = testing_tools.get_temporary_directory_context_manager()
+
+
+def _get_engine(server, build_timeout=None):
+    return engine.BuildEngine(api=engine.DockerAPI(base_url=server.url),
+                              build_timeout=build_timeout)
+
+
+def test_engine_runs_build_scripts_over_shared_connections():
+    output = [(STDOUT, "Collecting jin"), (STDERR, "warning: old pip\n"),
+              (STDOUT, "ja2\nCreated package\n")]
+    with fake_docker.FakeDockerServer(images={"debian:latest": "sha256:1"},
+                                      output=output, exit_code=0) as server, \
+            _get_engine(server) as build_engine:
+        build_logs = [buildlog.BuildLog(None, f"app{index}")
+                      for index in range(3)]
+        build_machines = [build_engine.get_build_machine(
+            image="debian", build_log=build_log,
+            resources=scheduler.BuildResources(2, 1024 ** 3))
+            for build_log in build_logs]
+        with futures.ThreadPoolExecutor() as executor:
+            exit_codes = list(executor.map(
+                lambda build_machine: build_machine.launch("/tmp/build"),
+                build_machines))
+        for build_machine in build_machines:
+            build_machine.shutdown()
+        for build_log in build_logs:
+            build_log.close()
+        assert exit_codes == [0, 0, 0]
+        assert list(build_logs[0].tail) == ["Collecting jinwarning: old pip",
+                                            "ja2", "Created package"]
+        assert build_machines[0].machine.image == "debian"
+        assert "script" in build_machines[0].timings
+        assert server.containers == {}
+        # Only output streams need connections of their own.
+        assert server.connections < len(server.requests)
+
+
+def test_engine_pulls_missing_images():
+    with fake_docker.FakeDockerServer(exit_code=3) as server, \
+            _get_engine(server) as build_engine:
+        build_machine = build_engine.get_build_machine(image="vdist/centos:7")
+        assert build_machine.get_image_id() == "sha256:0"
+        assert build_machine.launch("/tmp/build") == 3
+        build_machine.shutdown()
+        assert ("POST", "/images/create") in server.requests
+
+
+def test_engine_kills_scripts_that_time_out():
+    with fake_docker.FakeDockerServer(images={"debian:latest": "sha256:1"},
+                                      hang=True) as server, \
+            _get_engine(server, build_timeout=0.5) as build_engine:
+        build_machine = build_engine.get_build_machine(image="debian")
+        with pytest.raises(engine.BuildTimeoutException):
+            build_machine.launch("/tmp/build")
+        assert server.killed == [build_machine.container]
+        build_machine.shutdown()
+        assert server.containers == {}
+
+
+def test_engine_cancels_running_scripts():
+    with fake_docker.FakeDockerServer(images={"debian:latest": "sha256:1"},
+                                      hang=True) as server, \
+            _get_engine(server) as build_engine:
+        build_machine = build_engine.get_build_machine(image="debian")
+        canceller = threading.Timer(0.5, build_engine.cancel)
+        canceller.start()
+        started_at = time.time()
+        with pytest.raises(futures.CancelledError):
+            build_machine.launch("/tmp/build")
+        assert time.time() - started_at < 10
+        assert server.killed == [build_machine.container]
+        # Nothing else starts once engine is cancelled.
+        with pytest.raises(futures.CancelledError):
+            build_engine.get_build_machine(image="debian").launch("/tmp/build")
+        build_machine.shutdown()
+        assert server.containers == {}
+
+
+def test_engine_fails_machines_not_reset():
+    with fake_docker.FakeDockerServer(images={"debian:latest": "sha256:1"},
+                                      exit_code=1) as server, \
+            _get_engine(server) as build_engine:
+        build_machine = build_engine.get_build_machine(image="debian")
+        assert build_machine.launch("/tmp/build") == 1
+        with pytest.raises(leftovers.MachineResetException):
+            build_machine.reset(["/tmp/*", "/opt/my app"])
+        assert ["bash", "-c", "rm -rf /tmp/* '/opt/my app'"] in \
+            [_exec["config"]["Cmd"] for _exec in server.execs.values()]
+        build_machine.shutdown()
+
+
+def test_engine_tells_unsupported_docker_setups(monkeypatch):
+    with temporary_directory() as tempdir:
+        monkeypatch.setenv("DOCKER_CONFIG", tempdir)
+        for variable in ("DOCKER_HOST", "DOCKER_TLS_VERIFY", "DOCKER_CERT_PATH"):
+            monkeypatch.delenv(variable, raising=False)
+        assert engine.get_unsupported_setup() is None
+        monkeypatch.setenv("DOCKER_HOST", "tcp://127.0.0.1:2376")
+        assert engine.get_unsupported_setup() is None
+        monkeypatch.setenv("DOCKER_TLS_VERIFY", "1")
+        assert "TLS" in engine.get_unsupported_setup()
+        monkeypatch.delenv("DOCKER_TLS_VERIFY")
+        monkeypatch.setenv("DOCKER_HOST", "ssh://builder@buildhost")
+        assert "ssh://builder@buildhost" in engine.get_unsupported_setup()
+        monkeypatch.delenv("DOCKER_HOST")
+        with open(os.path.join(tempdir, "config.json"), "w") as config_file:
+            json.dump({"auths": {"registry.example.com": {"auth": "dmRpc3Q6"}}},
+                      config_file)
+        assert "credentials" in engine.get_unsupported_setup()
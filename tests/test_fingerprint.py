@@ -0,0 +1,86 @@
+import os
+import subprocess
+
+import tests.testing_tools as testing_tools
+import vdist.builder as builder
+import vdist.configuration as configuration
+import vdist.defaults as defaults
+import vdist.fingerprint as fingerprint
+
+temporary_directory = testing_tools.get_temporary_directory_context_manager()
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_directory_digest_follows_contents():
+    with temporary_directory() as tempdir:
+        _write(os.path.join(tempdir, "app", "setup.py"), "setup()")
+        _write(os.path.join(tempdir, "app", "requirements.txt"), "jinja2")
+        digest = fingerprint.get_directory_digest(os.path.join(tempdir, "app"))
+        assert digest == fingerprint.get_directory_digest(
+            os.path.join(tempdir, "app"))
+        _write(os.path.join(tempdir, "app", "requirements.txt"), "docker")
+        assert digest != fingerprint.get_directory_digest(
+            os.path.join(tempdir, "app"))
+
+
+def test_git_directory_digest_covers_commit_and_copied_files():
+    with temporary_directory() as tempdir:
+        _write(os.path.join(tempdir, "setup.py"), "setup()")
+        _write(os.path.join(tempdir, ".gitignore"), "local.cfg\n")
+        git = ["git", "-C", tempdir, "-c", "user.name=vdist",
+               "-c", "user.email=vdist@vdist"]
+        subprocess.check_call(git + ["init", "-q"])
+        subprocess.check_call(git + ["add", "."])
+        subprocess.check_call(git + ["commit", "-q", "-m", "First"])
+        digest = fingerprint.get_git_directory_digest(tempdir, "HEAD")
+        assert fingerprint.get_git_directory_digest(tempdir, "HEAD") == digest
+        # Ignored files are copied into build too.
+        _write(os.path.join(tempdir, "local.cfg"), "debug = true")
+        ignored_digest = fingerprint.get_git_directory_digest(tempdir, "HEAD")
+        assert ignored_digest != digest
+        subprocess.check_call(git + ["commit", "-q", "--allow-empty",
+                                     "-m", "Second"])
+        assert fingerprint.get_git_directory_digest(tempdir, "HEAD") != \
+            ignored_digest
+
+
+def test_stored_artifacts_are_reused(monkeypatch):
+    with temporary_directory() as tempdir:
+        monkeypatch.setattr(defaults, "ARTIFACT_STORE_DIR",
+                            os.path.join(tempdir, "artifacts"))
+        package = os.path.join(tempdir, "build", "app_1.0_amd64.deb")
+        _write(package, "package contents")
+        _configuration = configuration.Configuration(
+            {"app": "app", "version": "1.0", "profile": "ubuntu-lts",
+             "output_folder": os.path.join(tempdir, "output")})
+        assert builder._reuse_stored_artifacts(_configuration, "1234") == []
+        builder._store_artifacts(_configuration, "1234", [package])
+        reused_files = builder._reuse_stored_artifacts(_configuration, "1234")
+        assert reused_files == [os.path.join(tempdir, "output",
+                                             "app_1.0_amd64.deb")]
+        assert fingerprint.get_file_digest(reused_files[0]) == \
+            fingerprint.get_file_digest(package)
+
+
+def test_populate_tree_links_files_and_skips_ignored():
+    with temporary_directory() as tempdir:
+        source = os.path.join(tempdir, "app")
+        _write(os.path.join(source, "setup.py"), "setup()")
+        _write(os.path.join(source, "node_modules", "left", "index.js"), "")
+        _write(os.path.join(source, "pkg", "__pycache__", "mod.pyc"), "")
+        destination = os.path.join(tempdir, "scratch", "app")
+        builder._populate_tree(source, destination,
+                               mode=builder.POPULATION_HARDLINK,
+                               ignore=defaults.SOURCE_IGNORE)
+        assert sorted(os.listdir(destination)) == ["pkg", "setup.py"]
+        assert os.listdir(os.path.join(destination, "pkg")) == []
+        assert os.path.samefile(os.path.join(source, "setup.py"),
+                                os.path.join(destination, "setup.py"))
+        assert fingerprint.get_directory_digest(
+            source, defaults.SOURCE_IGNORE) == \
+            fingerprint.get_directory_digest(destination)
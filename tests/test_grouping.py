@@ -0,0 +1,93 @@
+import os
+
+import tests.testing_tools as testing_tools
+import vdist.builder as builder
+import vdist.configuration as configuration
+import vdist.defaults as defaults
+import vdist.grouping as grouping
+import vdist.vdist_launcher as vdist_launcher
+
+temporary_directory = testing_tools.get_temporary_directory_context_manager()
+
+
+def _get_configuration(tempdir, app, requirements, **parameters):
+    source_dir = os.path.join(tempdir, app)
+    os.makedirs(source_dir)
+    with open(os.path.join(source_dir, "requirements.txt"), "w") as f:
+        f.write("\n".join(requirements))
+    arguments = {"app": app, "version": "1.0", "profile": "ubuntu-lts",
+                 "source_directory": source_dir,
+                 "python_basedir": f"/opt/{app}"}
+    arguments.update(parameters)
+    return configuration.Configuration(arguments)
+
+
+def test_builds_compiling_same_python_are_grouped():
+    with temporary_directory() as tempdir:
+        configurations = {
+            "app1": _get_configuration(tempdir, "app1",
+                                       ["# Web", "flask==1.0", "requests",
+                                        "-e ."]),
+            "app2": _get_configuration(tempdir, "app2",
+                                       ["requests", "flask==1.0  # Web",
+                                        "jinja2"]),
+            "app3": _get_configuration(tempdir, "app3", ["requests"],
+                                       python_version="3.6.4"),
+            "app4": _get_configuration(tempdir, "app4", ["requests"],
+                                       compile_python=False),
+            "app5": _get_configuration(tempdir, "app5", ["requests"],
+                                       pip_args="--index-url http://pypi"),
+            "app6": _get_configuration(tempdir, "app6", ["requests"],
+                                       build_deps="libpq-dev"),
+            "app7": _get_configuration(tempdir, "app7", ["requests"],
+                                       build_deps="libpq-dev")}
+        groups = grouping.plan_groups(configurations, builder.load_profiles())
+        assert len(groups) == 2
+        assert groups[1].key == ("ubuntu-lts", defaults.PYTHON_VERSION, "",
+                                 False, ("libpq-dev",))
+        assert groups[1].names == ["app6", "app7"]
+        assert groups[0].key == ("ubuntu-lts", defaults.PYTHON_VERSION)
+        assert groups[0].names == ["app1", "app2"]
+        assert groups[0].common_requirements == ["flask==1.0", "requests"]
+
+
+def test_base_images_bake_group_requirements():
+    build = builder.Build(app="app1", version="1.0", profile="ubuntu-lts",
+                          source={"type": "directory", "path": "/tmp/app1"},
+                          base_requirements=["flask==1.0", "requests"])
+    script = builder.Builder()._render_template(build, shared_dir="/opt/vdist",
+                                                bake_only=True)
+    assert "flask==1.0\nrequests\nEOF" in script
+    assert "vdist_phase base_requirements\ninstall_base_requirements" in script
+
+
+def test_only_builds_of_baked_groups_leave_machine_pool(monkeypatch):
+    with temporary_directory() as tempdir:
+        configurations = {
+            "app1": _get_configuration(tempdir, "app1", ["requests"]),
+            "app2": _get_configuration(tempdir, "app2", ["requests"]),
+            "app3": _get_configuration(tempdir, "app3", ["flask"],
+                                       python_version="3.6.4"),
+            "app4": _get_configuration(tempdir, "app4", ["flask"],
+                                       python_version="3.6.4")}
+        baked_requirements = []
+
+        def bake_base_image(_configuration):
+            parameters = _configuration.builder_parameters
+            baked_requirements.append(parameters["base_requirements"])
+            if parameters.get("python_version") == "3.6.4":
+                raise RuntimeError("no space left on device")
+            return "vdist-base:ubuntu-lts"
+
+        monkeypatch.setattr(vdist_launcher.builder, "bake_base_image",
+                            bake_base_image)
+        profiles = builder.load_profiles()
+        vdist_launcher._bake_group_base_images(configurations, profiles)
+        assert sorted(baked_requirements) == [["flask"], ["requests"]]
+        assert configurations["app1"].builder_parameters[
+            "base_requirements"] == ["requests"]
+        assert not vdist_launcher._is_poolable(configurations["app2"],
+                                               profiles)
+        assert "base_requirements" not in \
+            configurations["app3"].builder_parameters
+        assert vdist_launcher._is_poolable(configurations["app4"], profiles)
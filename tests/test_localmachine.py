@@ -0,0 +1,151 @@
+import os
+import shutil
+import subprocess
+import threading
+
+import pytest
+
+import tests.testing_tools as testing_tools
+import vdist.builder as builder
+import vdist.buildlog as buildlog
+import vdist.defaults as defaults
+import vdist.localmachine as localmachine
+import vdist.source as source
+import vdist.watchdog as watchdog
+
+temporary_directory = testing_tools.get_temporary_directory_context_manager()
+
+BUILD_SCRIPT = """#!/bin/bash
+set -e
+echo "Building in $VDIST_TEST_VARIABLE"
+mkdir -p /opt/vdist_test_app
+touch /opt/vdist_test_app/python
+echo "package" > /work/app.deb
+cat /sources/setup.py
+if touch /usr/vdist_test_file 2> /dev/null; then exit 5; fi
+if touch /sources/new_file 2> /dev/null; then exit 6; fi
+exit 3
+"""
+
+# Host has no fpm to rely on, so this one records what it was asked to build.
+FAKE_FPM = """#!/bin/bash
+echo "$@" > /tmp/myapp_1.0_amd64.deb
+"""
+
+
+def _can_unshare():
+    if shutil.which("unshare") is None:
+        return False
+    return subprocess.call(["unshare", "--mount", "--map-root-user", "true"],
+                           stderr=subprocess.DEVNULL) == 0
+
+
+@pytest.mark.skipif(not _can_unshare(),
+                    reason="user namespaces are not available")
+def test_local_build_machine_runs_script_in_isolated_root():
+    with temporary_directory() as tempdir:
+        build_dir = os.path.join(tempdir, "build")
+        scratch_dir = os.path.join(build_dir, defaults.SCRATCH_DIR)
+        os.makedirs(scratch_dir)
+        script_path = os.path.join(scratch_dir,
+                                   defaults.SCRATCH_BUILDSCRIPT_NAME)
+        with open(script_path, "w") as f:
+            f.write(BUILD_SCRIPT)
+        os.chmod(script_path, 0o755)
+        sources_dir = os.path.join(tempdir, "sources")
+        os.makedirs(sources_dir)
+        with open(os.path.join(sources_dir, "setup.py"), "w") as f:
+            f.write("setup()")
+        with buildlog.BuildLog(None, "app") as build_log:
+            build_machine = localmachine.LocalBuildMachine(build_log=build_log)
+            try:
+                exit_code = build_machine.launch(
+                    build_dir,
+                    environment={"VDIST_TEST_VARIABLE": "isolation"},
+                    read_only_binds={sources_dir: "/sources"})
+            finally:
+                build_machine.shutdown()
+        assert exit_code == 3
+        assert list(build_log.tail) == ["Building in isolation", "setup()"]
+        with open(os.path.join(build_dir, "app.deb")) as f:
+            assert f.read() == "package\n"
+        assert not os.path.exists("/opt/vdist_test_app")
+        assert not os.path.exists(build_machine.container)
+        assert "script" in build_machine.timings
+
+
+@pytest.mark.skipif(not _can_unshare(),
+                    reason="user namespaces are not available")
+def test_local_build_machine_runs_rendered_profile():
+    with temporary_directory() as tempdir:
+        project_dir = os.path.join(tempdir, "myapp")
+        os.makedirs(project_dir)
+        with open(os.path.join(project_dir, "run.py"), "w") as f:
+            f.write("print('myapp')")
+        tools_dir = os.path.join(tempdir, "tools")
+        os.makedirs(tools_dir)
+        with open(os.path.join(tools_dir, "fpm"), "w") as f:
+            f.write(FAKE_FPM)
+        os.chmod(os.path.join(tools_dir, "fpm"), 0o755)
+        local_builder = builder.Builder(executor=builder.EXECUTOR_LOCAL)
+        # Package managers can't run on a read-only host userland, so a
+        # profile rendered for a local build must not call them.
+        local_builder.add_build(app="myapp", version="1.0",
+                                source=source.directory(path=project_dir),
+                                profile="ubuntu-lts", compile_python=False,
+                                build_deps=["make"])
+        local_builder.create_build_folder_tree()
+        try:
+            local_builder.populate_build_folder_tree()
+            with buildlog.BuildLog(None, "myapp") as build_log:
+                build_machine = localmachine.LocalBuildMachine(
+                    build_log=build_log)
+                try:
+                    exit_code = build_machine.launch(
+                        local_builder.build.build_tmp_dir,
+                        extra_binds={tools_dir: "/vdist_tools"},
+                        environment={"PATH": "/vdist_tools:/usr/sbin:/usr/bin:"
+                                                 "/sbin:/bin"},
+                        read_only_binds=local_builder.source_binds)
+                finally:
+                    build_machine.shutdown()
+            assert exit_code == 0, "\n".join(build_log.tail)
+            with open(os.path.join(local_builder.build.build_tmp_dir,
+                                   "myapp_1.0_amd64.deb")) as f:
+                fpm_arguments = f.read().split()
+            assert fpm_arguments[:4] == ["-s", "dir", "-t", "deb"]
+            assert "/opt/myapp" in fpm_arguments
+        finally:
+            local_builder.discard_build_folder_tree()
+
+
+def test_local_build_machines_are_killed_by_labels(monkeypatch):
+    with temporary_directory() as tempdir:
+        monkeypatch.setattr(defaults, "LOCAL_MACHINE_DIR", tempdir)
+        with buildlog.BuildLog(None, "app") as build_log:
+            build_machine = localmachine.LocalBuildMachine(
+                build_log=build_log, labels={"vdist.batch": "1"})
+            exit_codes = []
+            script = threading.Thread(target=lambda: exit_codes.append(
+                build_machine._run_command(["sleep", "30"])))
+            script.start()
+            labels_dir = localmachine._get_labels_dir({"vdist.batch": "1"})
+            while not os.path.isdir(labels_dir) or not os.listdir(labels_dir):
+                script.join(0.01)
+            assert localmachine.kill_machines({"vdist.batch": "2"}) == []
+            assert localmachine.kill_machines({"vdist.batch": "1"}) == \
+                [build_machine.process.pid]
+            script.join(10)
+        assert exit_codes == [-9]
+        assert os.listdir(labels_dir) == []
+
+
+def test_local_build_machine_kills_scripts_that_time_out():
+    with buildlog.BuildLog(None, "app") as build_log:
+        build_machine = localmachine.LocalBuildMachine(build_log=build_log,
+                                                       timeout=0.5)
+        with pytest.raises(watchdog.BuildTimeoutException):
+            build_machine._run_command(["sleep", "30"])
+        assert build_machine.process.returncode == -9
+        build_machine.timeout = 5
+        assert build_machine._run_command(["true"]) == 0
@@ -0,0 +1,69 @@
+import os
+import subprocess
+
+import tests.testing_tools as testing_tools
+import vdist.defaults as defaults
+import vdist.mirror as mirror
+import vdist.source as source
+
+temporary_directory = testing_tools.get_temporary_directory_context_manager()
+
+
+def _commit(repository, filename, text):
+    with open(os.path.join(repository, filename), "w") as f:
+        f.write(text)
+    for command in (["add", "."],
+                    ["-c", "user.name=vdist", "-c", "user.email=vdist@vdist",
+                     "commit", "-q", "-m", f"Write {filename}"]):
+        subprocess.check_call(["git", "-C", repository] + command)
+    return subprocess.check_output(["git", "-C", repository, "rev-parse",
+                                    "HEAD"]).decode("utf8").strip()
+
+
+def test_git_source_is_exported_from_mirror(monkeypatch):
+    with temporary_directory() as tempdir:
+        monkeypatch.setattr(defaults, "GIT_MIRROR_DIR",
+                            os.path.join(tempdir, "mirrors"))
+        repository = os.path.join(tempdir, "app")
+        subprocess.check_call(["git", "init", "-q", "-b", "master",
+                               repository])
+        first_commit = _commit(repository, "setup.py", "setup()")
+        git_source = source.git(uri=f"file://{repository}", branch="master")
+        destination = os.path.join(tempdir, "scratch", "app")
+        mirror.export_git_source(git_source, destination)
+        assert git_source["commit"] == first_commit
+        assert sorted(os.listdir(destination)) == [".git", "setup.py"]
+        # Once pinned, a source is not fetched again.
+        second_commit = _commit(repository, "requirements.txt", "jinja2")
+        assert mirror.pin_git_source(git_source) == first_commit
+        # New builds fetch new commits into the same mirror.
+        new_source = source.git(uri=f"file://{repository}", branch="master")
+        assert mirror.pin_git_source(new_source) == second_commit
+        mirror_path = mirror.GitMirror(git_source["uri"]).path
+        assert sorted(os.listdir(defaults.GIT_MIRROR_DIR)) == \
+            [os.path.basename(mirror_path),
+             os.path.basename(mirror_path) + ".lock"]
+
+
+def test_exported_git_source_describes_its_version(monkeypatch):
+    with temporary_directory() as tempdir:
+        monkeypatch.setattr(defaults, "GIT_MIRROR_DIR",
+                            os.path.join(tempdir, "mirrors"))
+        repository = os.path.join(tempdir, "app")
+        subprocess.check_call(["git", "init", "-q", "-b", "master",
+                               repository])
+        released_commit = _commit(repository, "setup.py", "setup()")
+        subprocess.check_call(["git", "-C", repository, "tag", "v1.0"])
+        _commit(repository, "requirements.txt", "jinja2")
+        git_mirror = mirror.GitMirror(f"file://{repository}")
+        git_mirror.update()
+        # Pinned commit is not branch tip anymore.
+        destination = os.path.join(tempdir, "scratch", "app")
+        git_mirror.export(released_commit, destination)
+        assert sorted(os.listdir(destination)) == [".git", "setup.py"]
+        for command, expected_output in ((["rev-parse", "HEAD"],
+                                          released_commit),
+                                         (["describe", "--tags"], "v1.0")):
+            assert subprocess.check_output(
+                ["git", "-C", destination] + command).decode("utf8").strip() \
+                == expected_output
@@ -0,0 +1,125 @@
+import json
+import os
+import sys
+
+import pytest
+
+import tests.testing_tools as testing_tools
+import vdist.buildlog as buildlog
+import vdist.defaults as defaults
+import vdist.podmanmachine as podmanmachine
+import vdist.scheduler as scheduler
+import vdist.watchdog as watchdog
+
+temporary_directory = testing_tools.get_temporary_directory_context_manager()
+
+# Stands for podman: records its calls and pretends images get pulled.
+FAKE_PODMAN = """#!{python}
+import json, os, sys
+state_dir = {state_dir!r}
+with open(os.path.join(state_dir, "calls"), "a") as f:
+    f.write(json.dumps(sys.argv[1:]) + "\\n")
+pulled = os.path.join(state_dir, "pulled")
+if sys.argv[1:3] == ["image", "inspect"]:
+    if not os.path.exists(pulled):
+        sys.exit(125)
+    print("sha256:podman")
+elif sys.argv[1] == "pull":
+    open(pulled, "w").close()
+elif sys.argv[1] == "ps":
+    print("container1")
+    print("container2")
+elif sys.argv[1:3] == ["kill", "container2"]:
+    sys.exit(125)
+elif sys.argv[1] == "run":
+    print("Collecting jinja2")
+    print("Created package", flush=True)
+    sys.exit(4)
+"""
+
+
+def _get_calls(state_dir):
+    with open(os.path.join(state_dir, "calls")) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_podman_build_machine_runs_script_with_one_command(monkeypatch):
+    with temporary_directory() as tempdir:
+        monkeypatch.setattr(defaults, "PODMAN_LOCK_DIR",
+                            os.path.join(tempdir, "locks"))
+        fake_podman = os.path.join(tempdir, "podman")
+        with open(fake_podman, "w") as f:
+            f.write(FAKE_PODMAN.format(python=sys.executable,
+                                       state_dir=tempdir))
+        os.chmod(fake_podman, 0o755)
+        with buildlog.BuildLog(None, "app") as build_log:
+            build_machine = podmanmachine.PodmanBuildMachine(
+                image="debian:stable", build_log=build_log,
+                resources=scheduler.BuildResources(2, 1024 ** 3),
+                labels={"vdist.batch": "1"}, command=fake_podman)
+            assert build_machine.get_image_id() == "sha256:podman"
+            assert build_machine.launch(
+                "/tmp/build", extra_binds={"/cache": "/vdist_cache"},
+                environment={"VDIST_PYTHON_CACHE_KEY": "key"},
+                read_only_binds={"/sources": "/work/scratch/app"}) == 4
+            build_machine.shutdown()
+        assert list(build_log.tail) == ["Collecting jinja2", "Created package"]
+        calls = _get_calls(tempdir)
+        # Image store is checked again once pull lock is held.
+        assert [call[0] for call in calls] == ["image", "image", "pull",
+                                               "image", "run", "rm"]
+        run_arguments = calls[4]
+        assert run_arguments[-2:] == ["debian:stable",
+                                      "/work/scratch/buildscript.sh"]
+        for argument in ["/tmp/build:/work:rw", "/cache:/vdist_cache:rw",
+                         "/sources:/work/scratch/app:ro",
+                         "VDIST_PYTHON_CACHE_KEY=key", "vdist.batch=1",
+                         "--rm", build_machine.container]:
+            assert argument in run_arguments
+        assert calls[5] == ["rm", "--force", build_machine.container]
+
+
+def test_podman_containers_are_killed_by_labels():
+    with temporary_directory() as tempdir:
+        fake_podman = os.path.join(tempdir, "podman")
+        with open(fake_podman, "w") as f:
+            f.write(FAKE_PODMAN.format(python=sys.executable,
+                                       state_dir=tempdir))
+        os.chmod(fake_podman, 0o755)
+        # Second container ended before it could be killed.
+        assert podmanmachine.kill_containers({"vdist.batch": "1"},
+                                             command=fake_podman) == \
+            ["container1"]
+        assert _get_calls(tempdir) == [
+            ["ps", "--quiet", "--filter", "label=vdist.batch=1"],
+            ["kill", "container1"], ["kill", "container2"]]
+
+
+# Stands for podman running a script that ends only when killed.
+HANGING_PODMAN = """#!{python}
+import os, sys, time
+killed = os.path.join({state_dir!r}, "killed")
+if sys.argv[1] == "kill":
+    open(killed, "w").close()
+elif sys.argv[1] == "run":
+    while not os.path.exists(killed):
+        time.sleep(0.05)
+    sys.exit(137)
+"""
+
+
+def test_podman_build_machine_kills_scripts_that_time_out():
+    with temporary_directory() as tempdir:
+        fake_podman = os.path.join(tempdir, "podman")
+        with open(fake_podman, "w") as f:
+            f.write(HANGING_PODMAN.format(python=sys.executable,
+                                          state_dir=tempdir))
+        os.chmod(fake_podman, 0o755)
+        with buildlog.BuildLog(None, "app") as build_log:
+            build_machine = podmanmachine.PodmanBuildMachine(
+                image="debian:stable", build_log=build_log,
+                command=fake_podman, timeout=0.5)
+            with pytest.raises(watchdog.BuildTimeoutException):
+                build_machine.launch("/tmp/build")
+            build_machine.shutdown()
+        assert os.path.exists(os.path.join(tempdir, "killed"))
@@ -0,0 +1,107 @@
+import os
+import pickle
+
+import pytest
+
+import vdist.defaults as defaults
+import vdist.leftovers as leftovers
+import vdist.pool as pool
+
+
+class FakeBuildMachine(object):
+    started = []
+    stopped = []
+    binds = {}
+
+    def __init__(self, image=None, labels=None):
+        self.image = image
+        self.container_id = None
+
+    def start(self, binds):
+        self.container_id = f"{self.image}-{len(FakeBuildMachine.started)}"
+        FakeBuildMachine.started.append(self.container_id)
+        FakeBuildMachine.binds[self.container_id] = binds
+        return self.container_id
+
+    def attach(self, container_id):
+        self.container_id = container_id
+
+    def shutdown(self):
+        FakeBuildMachine.stopped.append(self.container_id)
+
+
+def test_machine_pool_leases_started_machines(monkeypatch):
+    monkeypatch.setattr(pool.buildmachine, "BuildMachine", FakeBuildMachine)
+    machine_pool = pool.MachinePool(max_size=2)
+    try:
+        machine_pool.add_image("debian", builds=5)
+        machine_pool.add_image("centos", builds=1)
+        machine_pool.start()
+        assert len(FakeBuildMachine.started) == 3
+        assert machine_pool.accepts("debian")
+        assert not machine_pool.accepts("archlinux")
+        # Pools travel to builder processes pickled.
+        unpickled_pool = pickle.loads(pickle.dumps(machine_pool))
+        with unpickled_pool.lease("centos") as container_id:
+            assert container_id.startswith("centos")
+        with unpickled_pool.lease("centos") as second_container_id:
+            assert second_container_id == container_id
+    finally:
+        machine_pool.shutdown()
+    assert sorted(FakeBuildMachine.stopped) == sorted(FakeBuildMachine.started)
+    assert not os.path.exists(machine_pool.root)
+
+
+def test_machine_pool_container_path():
+    machine_pool = pool.MachinePool()
+    try:
+        host_path = os.path.join(machine_pool.root, "vdist1234", "app-1.0")
+        assert machine_pool.get_container_path(host_path) == \
+            "/".join([defaults.CONTAINER_POOL_DIR, "vdist1234", "app-1.0"])
+    finally:
+        machine_pool.shutdown()
+
+
+def _get_slot(container_id):
+    slots = [host_path for host_path, container_path
+             in FakeBuildMachine.binds[container_id].items()
+             if container_path == defaults.CONTAINER_POOL_DIR]
+    assert len(slots) == 1
+    return slots[0]
+
+
+def test_machine_pool_isolates_leases(monkeypatch):
+    monkeypatch.setattr(pool.buildmachine, "BuildMachine", FakeBuildMachine)
+    machine_pool = pool.MachinePool(max_size=2)
+    try:
+        machine_pool.add_image("debian", builds=2)
+        machine_pool.start()
+        build_folder = os.path.join(machine_pool.root, "vdist1234")
+        os.makedirs(os.path.join(build_folder, "app-1.0"))
+        with machine_pool.lease("debian", build_folder) as container_id, \
+                machine_pool.lease("debian") as other_container_id:
+            slot = _get_slot(container_id)
+            assert os.listdir(slot) == ["vdist1234"]
+            assert os.listdir(_get_slot(other_container_id)) == []
+            assert not os.path.exists(build_folder)
+        assert os.listdir(slot) == []
+        assert os.path.isdir(os.path.join(build_folder, "app-1.0"))
+    finally:
+        machine_pool.shutdown()
+
+
+def test_machine_pool_replaces_machines_not_reset(monkeypatch):
+    monkeypatch.setattr(pool.buildmachine, "BuildMachine", FakeBuildMachine)
+    machine_pool = pool.MachinePool(max_size=1)
+    try:
+        machine_pool.add_image("debian", builds=1)
+        machine_pool.start()
+        with pytest.raises(leftovers.MachineResetException):
+            with machine_pool.lease("debian") as container_id:
+                raise leftovers.MachineResetException("rm failed")
+        with machine_pool.lease("debian") as new_container_id:
+            assert new_container_id != container_id
+    finally:
+        machine_pool.shutdown()
+    assert container_id in FakeBuildMachine.stopped
+    assert new_container_id in FakeBuildMachine.stopped
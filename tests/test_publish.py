@@ -0,0 +1,64 @@
+import os
+
+import tests.testing_tools as testing_tools
+import vdist.fingerprint as fingerprint
+import vdist.publish as publish
+
+temporary_directory = testing_tools.get_temporary_directory_context_manager()
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_publish_lists_artifacts_in_manifest():
+    with temporary_directory() as tempdir:
+        package = os.path.join(tempdir, "build", "app_1.0_amd64.deb")
+        _write(package, "package contents")
+        output_folder = os.path.join(tempdir, "output")
+        published_files = publish.publish_artifacts([package], output_folder,
+                                                    "app")
+        assert published_files == [os.path.join(output_folder,
+                                                "app_1.0_amd64.deb")]
+        manifest = publish.read_manifest(output_folder)
+        assert manifest["app_1.0_amd64.deb"]["sha256"] == \
+            fingerprint.get_file_digest(package)
+        assert manifest["app_1.0_amd64.deb"]["build"] == "app"
+        # No temporary files are left behind.
+        assert sorted(os.listdir(output_folder)) == [
+            publish.MANIFEST_LOCK_FILE, "app_1.0_amd64.deb",
+            "vdist_manifest.json"]
+
+
+def test_publish_does_not_copy_already_published_contents():
+    with temporary_directory() as tempdir:
+        first_package = os.path.join(tempdir, "first", "app_1.0_amd64.deb")
+        second_package = os.path.join(tempdir, "second", "app_1.0_amd64.tgz")
+        _write(first_package, "package contents")
+        _write(second_package, "package contents")
+        output_folder = os.path.join(tempdir, "output")
+        publish.publish_artifacts([first_package], output_folder, "app")
+        published_file = os.path.join(output_folder, "app_1.0_amd64.deb")
+        inode = os.stat(published_file).st_ino
+        publish.publish_artifacts([first_package], output_folder, "app")
+        assert os.stat(published_file).st_ino == inode
+        publish.publish_artifacts([second_package], output_folder, "app")
+        assert os.stat(os.path.join(output_folder,
+                                    "app_1.0_amd64.tgz")).st_ino == inode
+
+
+def test_publish_replaces_changed_artifacts():
+    with temporary_directory() as tempdir:
+        package = os.path.join(tempdir, "build", "app_1.0_amd64.deb")
+        output_folder = os.path.join(tempdir, "output")
+        _write(package, "package contents")
+        publish.publish_artifacts([package], output_folder, "app", link=False)
+        _write(package, "new package contents")
+        publish.publish_artifacts([package], output_folder, "app", link=False)
+        published_file = os.path.join(output_folder, "app_1.0_amd64.deb")
+        with open(published_file) as f:
+            assert f.read() == "new package contents"
+        assert publish.read_manifest(output_folder)["app_1.0_amd64.deb"][
+            "sha256"] == fingerprint.get_file_digest(package)
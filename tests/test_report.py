@@ -0,0 +1,35 @@
+import json
+import os
+
+import tests.testing_tools as testing_tools
+import vdist.defaults as defaults
+import vdist.report as report
+
+temporary_directory = testing_tools.get_temporary_directory_context_manager()
+
+
+def _build_report(profile, fpm_duration):
+    return {"name": f"app-{profile}", "status": "built",
+            "report": {"profile": profile,
+                       "timings": {"container_start": 1.0},
+                       "phases": [{"name": "fpm", "started_at": 0,
+                                   "duration": fpm_duration}]}}
+
+
+def test_batch_report_averages_phases_per_profile():
+    with temporary_directory() as tempdir:
+        batch_report = report.get_batch_report(
+            [_build_report("centos", 10), _build_report("centos", 20),
+             _build_report("ubuntu-lts", 5),
+             {"name": "failed", "status": "failed", "report": None}],
+            started_at=100, finished_at=160)
+        assert batch_report["duration"] == 60
+        assert batch_report["profiles"]["centos"] == \
+            {"builds": 2, "timings": {"container_start": 1.0},
+             "phases": {"fpm": 15}}
+        report_paths = report.write_batch_report([tempdir, tempdir],
+                                                 batch_report)
+        assert report_paths == [os.path.join(tempdir,
+                                             defaults.BATCH_REPORT_FILENAME)]
+        with open(report_paths[0]) as f:
+            assert json.loads(f.read())["profiles"]["ubuntu-lts"]["builds"] == 1
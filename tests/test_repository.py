@@ -0,0 +1,134 @@
+import gzip
+import io
+import os
+import struct
+import tarfile
+
+import tests.testing_tools as testing_tools
+import vdist.repository as repository
+
+temporary_directory = testing_tools.get_temporary_directory_context_manager()
+
+CONTROL = """Package: app
+Version: {version}
+Architecture: amd64
+Maintainer: vdist
+Description: An app.
+"""
+
+
+def _tar(members, mode):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode=mode) as archive:
+        for name, text in members.items():
+            contents = text.encode("utf8")
+            member = tarfile.TarInfo(name)
+            member.size = len(contents)
+            archive.addfile(member, io.BytesIO(contents))
+    return data.getvalue()
+
+
+def _write_deb(path, version):
+    members = [("debian-binary", b"2.0\n"),
+               ("control.tar.gz",
+                _tar({"./control": CONTROL.format(version=version)}, "w:gz")),
+               ("data.tar.gz", _tar({"./opt/app/run": "#!/bin/sh"}, "w:gz"))]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(repository.AR_MAGIC)
+        for name, data in members:
+            f.write(repository.AR_HEADER.pack(
+                name.encode("ascii").ljust(16), b"0".ljust(12), b"0".ljust(6),
+                b"0".ljust(6), b"100644".ljust(8),
+                str(len(data)).encode("ascii").ljust(10), b"`\n"))
+            f.write(data + b"\n" * (len(data) % 2))
+
+
+def _rpm_header(tags):
+    index, store = b"", b""
+    for tag, (_type, value) in tags.items():
+        index += repository.RPM_INDEX_ENTRY.pack(tag, _type, len(store), 1)
+        store += value.encode("utf8") + b"\0" if isinstance(value, str) \
+            else struct.pack(">I", value)
+    return repository.RPM_HEADER_INTRO.pack(
+        repository.RPM_HEADER_MAGIC, len(tags), len(store)) + index + store
+
+
+def _write_rpm(path):
+    string, int32 = repository.RPM_TYPE_STRING, repository.RPM_TYPE_INT32
+    header = _rpm_header({1000: (string, "app"), 1001: (string, "1.0"),
+                          1002: (string, "1"), 1009: (int32, 2048),
+                          1022: (string, "x86_64")})
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"\xed\xab\xee\xdb".ljust(repository.RPM_LEAD_SIZE, b"\0"))
+        f.write(_rpm_header({}))
+        f.write(header)
+        f.write(b"payload")
+
+
+def test_repository_indexes_deb_packages():
+    with temporary_directory() as tempdir:
+        package = os.path.join(tempdir, "output", "app_1.0_amd64.deb")
+        _write_deb(package, "1.0")
+        local_repository = repository.Repository(os.path.join(tempdir, "repo"))
+        added_files = local_repository.add_packages(
+            "ubuntu-lts", [package, os.path.join(tempdir, "app.tar")])
+        folder = local_repository.get_folder("ubuntu-lts", "amd64")
+        assert added_files == [os.path.join(folder, "app_1.0_amd64.deb")]
+        with gzip.open(os.path.join(folder, "Packages.gz")) as f:
+            packages = f.read().decode("utf8")
+        assert "Package: app\nVersion: 1.0\n" in packages
+        assert "Filename: ./app_1.0_amd64.deb\n" in packages
+        assert "Packages.gz" in open(os.path.join(folder, "Release")).read()
+
+
+def test_repository_reads_only_new_packages():
+    with temporary_directory() as tempdir:
+        first_package = os.path.join(tempdir, "output", "app_1.0_amd64.deb")
+        second_package = os.path.join(tempdir, "output", "app_1.1_amd64.deb")
+        _write_deb(first_package, "1.0")
+        _write_deb(second_package, "1.1")
+        local_repository = repository.Repository(os.path.join(tempdir, "repo"))
+        local_repository.add_packages("ubuntu-lts", [first_package])
+        # Already indexed packages are not read again.
+        os.remove(first_package)
+        local_repository.add_packages("ubuntu-lts", [second_package])
+        folder = local_repository.get_folder("ubuntu-lts", "amd64")
+        with open(os.path.join(folder, "Packages")) as f:
+            packages = f.read()
+        assert "Version: 1.0\n" in packages
+        assert "Version: 1.1\n" in packages
+
+
+def test_repository_shares_and_discards_pool_files():
+    with temporary_directory() as tempdir:
+        package = os.path.join(tempdir, "output", "app_1.0_amd64.deb")
+        _write_deb(package, "1.0")
+        local_repository = repository.Repository(os.path.join(tempdir, "repo"))
+        first_file, = local_repository.add_packages("ubuntu-lts", [package])
+        second_file, = local_repository.add_packages("debian", [package])
+        assert os.path.samefile(first_file, second_file)
+        old_digest = repository.Repository.read_index(
+            os.path.dirname(first_file))["app_1.0_amd64.deb"]["sha256"]
+        _write_deb(package, "1.0-rebuilt")
+        local_repository.add_packages("ubuntu-lts", [package])
+        local_repository.add_packages("debian", [package])
+        assert not os.path.exists(local_repository._get_pool_path(old_digest))
+
+
+def test_repository_indexes_rpm_packages():
+    with temporary_directory() as tempdir:
+        package = os.path.join(tempdir, "output", "app-1.0-1.x86_64.rpm")
+        _write_rpm(package)
+        local_repository = repository.Repository(os.path.join(tempdir, "repo"))
+        local_repository.add_packages("centos", [package])
+        folder = local_repository.get_folder("centos", "x86_64")
+        with gzip.open(os.path.join(folder, "repodata",
+                                    "primary.xml.gz")) as f:
+            primary = f.read().decode("utf8")
+        assert 'packages="1"' in primary
+        assert '<version epoch="0" ver="1.0" rel="1"/>' in primary
+        assert 'installed="2048"' in primary
+        assert 'primary.xml.gz' in open(os.path.join(folder, "repodata",
+                                                     "repomd.xml")).read()
@@ -0,0 +1,104 @@
+import concurrent.futures as futures
+import os
+import threading
+
+import tests.testing_tools as testing_tools
+import vdist.configuration as configuration
+import vdist.scheduler as scheduler
+
+temporary_directory = testing_tools.get_temporary_directory_context_manager()
+
+
+def _configuration(profile, compile_python):
+    return configuration.Configuration({"app": "app", "version": "1.0",
+                                        "profile": profile,
+                                        "compile_python": compile_python})
+
+
+def _create_scheduler(tempdir, **kwargs):
+    cost_model = scheduler.BuildCostModel(
+        history_file=os.path.join(tempdir, "build_times.json"))
+    return scheduler.BuildScheduler(cost_model=cost_model, **kwargs)
+
+
+def test_cost_model_learns_durations():
+    with temporary_directory() as tempdir:
+        history_file = os.path.join(tempdir, "build_times.json")
+        cost_model = scheduler.BuildCostModel(history_file=history_file)
+        job = cost_model.estimate("ubuntu", _configuration("ubuntu-lts", True))
+        assert job.compiles
+        job.started_at, job.finished_at = 0, 100
+        cost_model.record(job)
+        cost_model.save()
+        learnt_model = scheduler.BuildCostModel(history_file=history_file)
+        assert learnt_model.estimate(
+            "ubuntu", _configuration("ubuntu-lts", True)).duration == 100
+
+
+def test_scheduler_caps_concurrent_compiles():
+    with temporary_directory() as tempdir:
+        build_scheduler = _create_scheduler(tempdir, max_cpus=16,
+                                            max_memory=64 * 1024 ** 3,
+                                            max_compiles=1)
+        compile_jobs = [build_scheduler.add(f"compile{i}",
+                                            _configuration("centos", True))
+                        for i in range(2)]
+        package_jobs = [build_scheduler.add(f"package{i}",
+                                            _configuration("centos", False))
+                        for i in range(3)]
+        admitted = build_scheduler.next_jobs(compile_jobs + package_jobs, [])
+        assert admitted == compile_jobs[:1] + package_jobs
+
+
+def test_scheduler_respects_resources_budget():
+    with temporary_directory() as tempdir:
+        build_scheduler = _create_scheduler(tempdir, max_cpus=4,
+                                            max_memory=64 * 1024 ** 3)
+        compile_job = build_scheduler.add("compile",
+                                          _configuration("centos", True))
+        package_job = build_scheduler.add("package",
+                                          _configuration("centos", False))
+        assert build_scheduler.next_jobs([package_job], [compile_job]) == []
+        # A job bigger than budget must still run when host is idle.
+        compile_job.resources.cpus = 8
+        assert build_scheduler.next_jobs([compile_job], []) == [compile_job]
+
+
+def test_scheduler_runs_longest_jobs_first():
+    with temporary_directory() as tempdir:
+        build_scheduler = _create_scheduler(tempdir, max_cpus=1,
+                                            max_memory=64 * 1024 ** 3)
+        build_scheduler.add("package", _configuration("centos", False))
+        build_scheduler.add("compile", _configuration("centos", True))
+        started = []
+        lock = threading.Lock()
+
+        def run(job):
+            with lock:
+                started.append(job.name)
+            return job.name
+
+        with futures.ThreadPoolExecutor(max_workers=2) as executor:
+            finished = [future.result() for job, future in
+                        build_scheduler.run(lambda job: executor.submit(run, job))]
+        assert started == ["compile", "package"]
+        assert finished == ["compile", "package"]
+
+
+def test_cancelled_scheduler_does_not_start_pending_jobs():
+    with temporary_directory() as tempdir:
+        build_scheduler = _create_scheduler(tempdir, max_cpus=1,
+                                            max_memory=64 * 1024 ** 3)
+        build_scheduler.add("compile", _configuration("centos", True))
+        build_scheduler.add("package", _configuration("centos", False))
+
+        def run(job):
+            raise RuntimeError(f"{job.name} failed")
+
+        outcomes = []
+        with futures.ThreadPoolExecutor(max_workers=2) as executor:
+            for job, future in build_scheduler.run(
+                    lambda job: executor.submit(run, job)):
+                outcomes.append((job.name, future.cancelled()))
+                build_scheduler.cancel()
+        assert outcomes == [("compile", False), ("package", True)]
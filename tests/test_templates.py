@@ -0,0 +1,169 @@
+import json
+import os
+import subprocess
+
+import tests.testing_tools as testing_tools
+import vdist.builder as builder
+import vdist.buildlog as buildlog
+import vdist.defaults as defaults
+import vdist.templates as templates
+
+temporary_directory = testing_tools.get_temporary_directory_context_manager()
+
+
+def _write(path, text, mtime):
+    with open(path, "w") as f:
+        f.write(text)
+    os.utime(path, (mtime, mtime))
+
+
+def test_rendered_scripts_follow_template_changes(monkeypatch):
+    with temporary_directory() as tempdir:
+        monkeypatch.setattr(defaults, "TEMPLATE_CACHE_DIR",
+                            os.path.join(tempdir, "templates"))
+        profiles_dir = os.path.join(tempdir, "profiles")
+        os.makedirs(profiles_dir)
+        template = os.path.join(profiles_dir, "custom.sh")
+        _write(template, "echo {{ app }}", 1000)
+        environment = templates.get_environment(profiles_dir)
+        assert templates.get_environment(profiles_dir) is environment
+        assert templates.render(environment, "custom.sh",
+                                {"app": "geolocate"}) == "echo geolocate"
+        assert templates.render(environment, "custom.sh",
+                                {"app": "vdist"}) == "echo vdist"
+        _write(template, "exec {{ app }}", 2000)
+        assert templates.render(environment, "custom.sh",
+                                {"app": "vdist"}) == "exec vdist"
+
+
+def test_source_digest_covers_included_templates(monkeypatch):
+    with temporary_directory() as tempdir:
+        monkeypatch.setattr(defaults, "TEMPLATE_CACHE_DIR",
+                            os.path.join(tempdir, "templates"))
+        profiles_dir = os.path.join(tempdir, "profiles")
+        os.makedirs(profiles_dir)
+        _write(os.path.join(profiles_dir, "custom.sh"),
+               "{% include '_custom_steps.sh' %}\n"
+               "{% include '_relocate.sh' %}\n"
+               "{% include '_custom_steps.sh' %}", 1000)
+        partial = os.path.join(profiles_dir, "_custom_steps.sh")
+        _write(partial, "make", 1000)
+        environment = templates.get_environment(profiles_dir)
+        digest = templates.get_source_digest(environment, "custom.sh")
+        assert templates.get_source_digest(environment, "custom.sh") == digest
+        _write(partial, "make -j4", 2000)
+        assert templates.get_source_digest(environment, "custom.sh") != digest
+
+
+def test_profiles_are_parsed_again_only_when_changed():
+    with temporary_directory() as tempdir:
+        profiles_file = os.path.join(tempdir, defaults.LOCAL_PROFILES_FILE)
+        profile = {"docker_image": "debian", "script": "debian.sh"}
+        _write(profiles_file, json.dumps({"custom": profile}), 1000)
+        profiles = builder.load_profiles(tempdir)
+        assert builder.load_profiles(tempdir)["custom"] is profiles["custom"]
+        _write(profiles_file, json.dumps({"custom": profile,
+                                          "other": profile}), 2000)
+        profiles = builder.load_profiles(tempdir)
+        assert "other" in profiles
+        assert "ubuntu-lts" in profiles
+
+
+def test_compiled_python_is_relocated():
+    with temporary_directory() as tempdir:
+        build_prefix = os.path.join(tempdir, "vdist_python")
+        basedir = os.path.join(tempdir, "opt", "app")
+        os.makedirs(os.path.join(build_prefix, "bin"))
+        os.makedirs(os.path.join(build_prefix, "lib", "python3.7"))
+        _write(os.path.join(build_prefix, "bin", "python3.7"), "ELF", 1000)
+        os.symlink(os.path.join(build_prefix, "bin", "python3.7"),
+                   os.path.join(build_prefix, "bin", "python3"))
+        _write(os.path.join(build_prefix, "bin", "pip3"),
+               f"#!{build_prefix}/bin/python3.7\nimport pip\n", 1000)
+        _write(os.path.join(build_prefix, "lib", "python3.7",
+                            "_sysconfigdata_m_linux.py"),
+               f"build_time_vars = {{'prefix': '{build_prefix}'}}\n", 1000)
+        environment = templates.get_environment(tempdir)
+        script = os.path.join(tempdir, "relocate.sh")
+        _write(script, environment.get_template("_relocate.sh").render(
+            python_build_prefix=build_prefix) + "\nrelocate_python\n", 1000)
+        subprocess.check_call(["bash", "-e", script],
+                              env=dict(os.environ, PYTHON_BASEDIR=basedir))
+        assert not os.path.exists(build_prefix)
+        assert os.readlink(os.path.join(basedir, "bin", "python3")) == \
+            os.path.join(basedir, "bin", "python3.7")
+        with open(os.path.join(basedir, "bin", "pip3")) as f:
+            assert f.readline() == f"#!{basedir}/bin/python3.7\n"
+        with open(os.path.join(basedir, "lib", "python3.7",
+                               "_sysconfigdata_m_linux.py")) as f:
+            assert f"'prefix': '{basedir}'" in f.read()
+
+
+def test_package_tree_is_pruned_and_deduplicated():
+    with temporary_directory() as tempdir:
+        basedir = os.path.join(tempdir, "opt", "app")
+        stdlib = os.path.join(basedir, "lib", "python3.7")
+        os.makedirs(os.path.join(stdlib, "test"))
+        os.makedirs(os.path.join(stdlib, "json", "__pycache__"))
+        _write(os.path.join(stdlib, "test", "test_os.py"), "x" * 4096, 1000)
+        _write(os.path.join(stdlib, "json", "__pycache__", "x.pyc"), "x", 1000)
+        _write(os.path.join(stdlib, "os.py"), "import sys\n", 1000)
+        _write(os.path.join(stdlib, "json", "tool.py"), "same\n", 1000)
+        _write(os.path.join(stdlib, "json", "copy.py"), "same\n", 1000)
+        environment = templates.get_environment(tempdir)
+        script = os.path.join(tempdir, "prune.sh")
+        _write(script, environment.get_template("_prune.sh").render(
+            prune_patterns=builder.PRUNE_PROFILES[builder.PRUNE_AGGRESSIVE]) +
+            "\nprune_package_tree python " + basedir + "\n", 1000)
+        output = subprocess.check_output(["bash", "-e", script]).decode()
+        assert not os.path.exists(os.path.join(stdlib, "test"))
+        assert not os.path.exists(os.path.join(stdlib, "json", "__pycache__"))
+        assert os.path.exists(os.path.join(stdlib, "os.py"))
+        assert os.path.samefile(os.path.join(stdlib, "json", "tool.py"),
+                                os.path.join(stdlib, "json", "copy.py"))
+        sizes = [int(line.split()[-1]) for line in output.splitlines()
+                 if line.startswith(buildlog.SIZE_MARKER)]
+        assert sizes[0] > sizes[1]
+
+
+def test_runtime_is_packaged_once_per_cached_interpreter():
+    with temporary_directory() as tempdir:
+        cache_entry = os.path.join(tempdir, "cache", "abc123")
+        os.makedirs(cache_entry)
+        _write(os.path.join(cache_entry, "complete"), "", 1000)
+        tools_dir = os.path.join(tempdir, "tools")
+        os.makedirs(tools_dir)
+        # Records every call and leaves a package where it is asked to.
+        _write(os.path.join(tools_dir, "fpm"),
+               '#!/bin/bash\n'
+               'echo "$@" >> ' + os.path.join(tempdir, "fpm_calls") + '\n'
+               'while [ "$1" != "-p" ]; do shift; done\n'
+               'touch $2/runtime.deb\n', 1000)
+        os.chmod(os.path.join(tools_dir, "fpm"), 0o755)
+        parameters = dict(python_cache_dir=os.path.join(tempdir, "cache"),
+                          shared_runtime=True,
+                          runtime_name="vdist-python3.7-ubuntu-lts",
+                          runtime_basedir=os.path.join(tempdir, "runtime"),
+                          package_tmp_root=os.path.join(tempdir, "tmp"),
+                          local_uid=os.getuid(), local_gid=os.getgid())
+        environment = templates.get_environment(tempdir)
+        script = os.path.join(tempdir, "runtime.sh")
+        for app in ("app1", "app2"):
+            shared_dir = os.path.join(tempdir, app)
+            os.makedirs(shared_dir)
+            _write(script, "\n".join([
+                environment.get_template("_python_cache.sh").render(
+                    **parameters),
+                environment.get_template("_runtime.sh").render(
+                    shared_dir=shared_dir, **parameters),
+                "package_runtime deb\n"]), 1000)
+            subprocess.check_call(
+                ["bash", "-e", script],
+                env=dict(os.environ, VDIST_PYTHON_CACHE_KEY="abc123",
+                         PATH=tools_dir + os.pathsep + os.environ["PATH"]))
+            assert os.listdir(shared_dir) == ["runtime.deb"]
+        with open(os.path.join(tempdir, "fpm_calls")) as f:
+            assert len(f.readlines()) == 1
+        assert os.listdir(os.path.join(cache_entry, "runtime",
+                                       "vdist-python3.7-ubuntu-lts",
+                                       "deb")) == ["runtime.deb"]
@@ -1,38 +1,201 @@
+import fcntl
+import hashlib
 import logging
 import os
 import shutil
 import re
 import json
+import shlex
 import tempfile
-from typing import Tuple, Dict
+import threading
+import time
+from typing import Tuple, Dict, List, Optional
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment
 
 import vdist.configuration as configuration
 import vdist.defaults as defaults
+import vdist.buildlog as buildlog
 import vdist.buildmachine as buildmachine
-
-
-def build_package(_configuration: configuration.Configuration) -> dict:
-    builder = _prepare_build(_configuration)
+import vdist.cache as cache
+import vdist.engine as engine
+import vdist.fingerprint as fingerprint
+import vdist.localmachine as localmachine
+import vdist.podmanmachine as podmanmachine
+import vdist.mirror as mirror
+import vdist.pool as pool
+import vdist.publish as publish
+import vdist.report as report
+import vdist.repository as repository
+import vdist.scheduler as scheduler
+import vdist.templates as templates
+
+POPULATION_AUTO = 'auto'
+POPULATION_REFLINK = 'reflink'
+POPULATION_HARDLINK = 'hardlink'
+POPULATION_COPY = 'copy'
+POPULATION_BIND = 'bind'
+POPULATION_MODES = [POPULATION_AUTO, POPULATION_REFLINK, POPULATION_HARDLINK,
+                    POPULATION_COPY, POPULATION_BIND]
+# Where build scripts are run: docker or podman containers, or host
+# processes.
+EXECUTOR_DOCKER = 'docker'
+EXECUTOR_PODMAN = 'podman'
+EXECUTOR_LOCAL = 'local'
+EXECUTORS = [EXECUTOR_DOCKER, EXECUTOR_PODMAN, EXECUTOR_LOCAL]
+# fpm output types a single build can package its tree into.
+PACKAGE_FORMATS = ['deb', 'rpm', 'pacman', 'tar', 'zip', 'apk', 'sh']
+# Configure flags of every interpreter optimization level. Profile guided
+# optimization runs Python test suite while compiling, so it takes far longer.
+PYTHON_OPTIMIZATIONS = {
+    'none': '',
+    'lto': '--with-lto',
+    'pgo+lto': '--enable-optimizations --with-lto'
+}
+PRUNE_NONE = 'none'
+PRUNE_STANDARD = 'standard'
+PRUNE_AGGRESSIVE = 'aggressive'
+# What every prune profile leaves out of packaged Python tree. Patterns with
+# a slash are globs relative to tree root, the rest are names removed at any
+# depth. Unless nothing is pruned, ELF files are stripped and identical files
+# are hardlinked too.
+_STANDARD_PRUNE_PATTERNS = ['lib/python*/test', 'lib/python*/*/test',
+                            'lib/python*/*/tests', 'lib/python*/idlelib',
+                            'lib/python*/tkinter', 'lib/python*/turtledemo',
+                            'lib/python*/config-*/libpython*.a',
+                            'lib/libpython*.a']
+PRUNE_PROFILES = {
+    PRUNE_NONE: [],
+    PRUNE_STANDARD: _STANDARD_PRUNE_PATTERNS,
+    PRUNE_AGGRESSIVE: _STANDARD_PRUNE_PATTERNS + [
+        'lib/python*/ensurepip', 'lib/python*/site-packages/*/tests',
+        'lib/python*/site-packages/*/test', '__pycache__']
+}
+# Options of pip_args that "pip wheel" understands too, telling whether they
+# take a value. Install only options, like --user or --target, are left out
+# when wheelhouse builds wheels.
+PIP_WHEEL_OPTIONS = {
+    '-i': True, '--index-url': True, '--extra-index-url': True,
+    '--no-index': False, '-f': True, '--find-links': True,
+    '-c': True, '--constraint': True, '--no-binary': True,
+    '--only-binary': True, '--prefer-binary': False, '--pre': False,
+    '--no-build-isolation': False, '--use-pep517': False,
+    '--no-use-pep517': False, '--check-build-dependencies': False,
+    '-C': True, '--config-settings': True, '--build-option': True,
+    '--global-option': True, '--ignore-requires-python': False,
+    '--no-deps': False, '--require-hashes': False, '--no-verify': False,
+    '--progress-bar': True, '--proxy': True, '--retries': True,
+    '--timeout': True, '--trusted-host': True, '--cert': True,
+    '--client-cert': True, '--cache-dir': True, '--no-cache-dir': False,
+    '--keyring-provider': True, '--use-feature': True,
+    '--use-deprecated': True, '--isolated': False, '-v': False,
+    '--verbose': False, '-q': False, '--quiet': False,
+    '--disable-pip-version-check': False, '--no-color': False,
+    '--no-input': False
+}
+# Linux ioctl to clone a file sharing its blocks (copy-on-write).
+FICLONE = 0x40049409
+# Parsed profiles files, with modification time and size they had then.
+_profiles_cache = {}
+_profiles_cache_lock = threading.Lock()
+
+
+def build_package(_configuration: configuration.Configuration,
+                  machine_pool: 'pool.MachinePool'=None,
+                  resources: 'scheduler.BuildResources'=None,
+                  force: bool=False,
+                  labels: Dict[str, str]=None,
+                  build_engine: 'engine.BuildEngine'=None,
+                  build_timeout: float=None) -> 'BuildResult':
+    started_at = time.time()
+    builder = _generate_builder(_configuration, machine_pool, resources, labels,
+                                build_engine, build_timeout)
+    try:
+        status, files = _build_or_reuse_package(builder, _configuration, force)
+        if _configuration.repository_dir is not None:
+            with report.timed(builder.timings, 'repository'):
+                repository.Repository(_configuration.repository_dir).add_packages(
+                    builder.build.profile, files)
+    finally:
+        # Failed builds are the ones whose report is most wanted.
+        builder.write_report()
+        _discard_build_folder_tree(builder)
+    return BuildResult(_configuration.name, status, time.time() - started_at,
+                       files, report=builder.get_report())
+
+
+def _discard_build_folder_tree(builder: 'Builder') -> None:
+    # Build folders are removed whatever the build outcome was, but a
+    # failure doing so must not hide the build one.
+    try:
+        builder.discard_build_folder_tree()
+    except OSError as e:
+        builder.logger.warning(f'Could not remove build folder '
+                               f'{builder.build_basedir}: {e}')
+
+
+def _build_or_reuse_package(builder: 'Builder',
+                            _configuration: configuration.Configuration,
+                            force: bool) -> Tuple[str, List[str]]:
+    with report.timed(builder.timings, 'fingerprint'):
+        build_fingerprint = builder.get_build_fingerprint()
+    if build_fingerprint is not None and not force:
+        with report.timed(builder.timings, 'artifact_reuse'):
+            files_reused = _reuse_stored_artifacts(_configuration,
+                                                   build_fingerprint)
+        if files_reused:
+            builder.logger.info(f'Inputs of {_configuration.name} did not change. '
+                                f'Reusing artifacts of build {build_fingerprint}.')
+            if _configuration.output_script:
+                builder.write_script_to_output_folder(_configuration)
+            return BuildResult.REUSED, files_reused
+    _prepare_build_folders(builder, _configuration)
     if _configuration.output_script:
         builder.copy_script_to_output_folder(_configuration)
     builder.start_build()
     files_created = builder.move_package_to_output_folder(_configuration)
-    return {_configuration.name: files_created, }
+    if build_fingerprint is not None:
+        with report.timed(builder.timings, 'artifact_store'):
+            _store_artifacts(_configuration, build_fingerprint, files_created)
+    return BuildResult.BUILT, files_created
 
 
-def _prepare_build(_configuration: configuration.Configuration) -> 'Builder':
+def bake_base_image(_configuration: configuration.Configuration,
+                    force: bool=False) -> str:
     builder = _generate_builder(_configuration)
+    return builder.bake_base_image(force)
+
+
+def _prepare_build(_configuration: configuration.Configuration,
+                   machine_pool: 'pool.MachinePool'=None,
+                   resources: 'scheduler.BuildResources'=None) -> 'Builder':
+    builder = _generate_builder(_configuration, machine_pool, resources)
+    _prepare_build_folders(builder, _configuration)
+    return builder
+
+
+def _prepare_build_folders(builder: 'Builder',
+                           _configuration: configuration.Configuration) -> None:
     builder.get_available_profiles()
     builder.create_build_folder_tree()
     builder.populate_build_folder_tree()
     _create_output_folder(_configuration)
-    return builder
 
 
-def _generate_builder(_configuration: configuration.Configuration) -> 'Builder':
-    builder = Builder(process_name=_configuration.name)
+def _generate_builder(_configuration: configuration.Configuration,
+                      machine_pool: 'pool.MachinePool'=None,
+                      resources: 'scheduler.BuildResources'=None,
+                      labels: Dict[str, str]=None,
+                      build_engine: 'engine.BuildEngine'=None,
+                      build_timeout: float=None) -> 'Builder':
+    builder = Builder(process_name=_configuration.name,
+                      machine_pool=machine_pool,
+                      resources=resources,
+                      log_dir=_configuration.log_dir,
+                      labels=labels,
+                      build_engine=build_engine,
+                      executor=_configuration.executor,
+                      build_timeout=build_timeout)
     builder.add_build(**_configuration.builder_parameters)
     return builder
 
@@ -46,16 +209,45 @@ def _get_script_output_filename(_configuration: configuration.Configuration) ->
 
 
 def _move_generated_package(_configuration: configuration.Configuration, package_folder: str) -> list:
-    files_moved = []
-    for file in os.listdir(package_folder):
-        # Only copy files with extension as they are likely the generated
-        # package.
-        if os.path.splitext(file)[1] != "":
-            source_file_pathname = os.path.join(package_folder, file)
-            shutil.copy(source_file_pathname, _configuration.output_folder)
-            destination_file_pathname = os.path.join(_configuration.output_folder, file)
-            files_moved.append(destination_file_pathname)
-    return files_moved
+    # Only publish files with extension as they are likely the generated
+    # package.
+    packages = [os.path.join(package_folder, file)
+                for file in sorted(os.listdir(package_folder))
+                if os.path.splitext(file)[1] != ""]
+    return publish.publish_artifacts(packages, _configuration.output_folder,
+                                     _configuration.name)
+
+
+def _reuse_stored_artifacts(_configuration: configuration.Configuration,
+                            build_fingerprint: str) -> list:
+    entry = cache.get_artifact_store().get(build_fingerprint)
+    if entry is None:
+        return []
+    entry.touch()
+    _create_output_folder(_configuration)
+    stored_files_folder = os.path.join(entry.path, cache.ENTRY_TREE)
+    stored_files = [os.path.join(stored_files_folder, file)
+                    for file in sorted(os.listdir(stored_files_folder))]
+    # Stored files are copied rather than linked, so nothing done to
+    # published ones can spoil store.
+    return publish.publish_artifacts(stored_files,
+                                     _configuration.output_folder,
+                                     _configuration.name,
+                                     digests=entry.metadata.get("files"),
+                                     link=False)
+
+
+def _store_artifacts(_configuration: configuration.Configuration,
+                     build_fingerprint: str, files_created: list) -> None:
+    if not files_created:
+        return
+    artifact_store = cache.get_artifact_store()
+    artifact_store.store(
+        build_fingerprint, files_created,
+        metadata={"name": _configuration.name,
+                  "files": {os.path.basename(file): fingerprint.get_file_digest(file)
+                            for file in files_created}})
+    artifact_store.prune()
 
 
 def _get_generated_package_folder(_configuration: configuration.Configuration, source_folder: str) -> str:
@@ -77,18 +269,148 @@ def _get_package_folder_name(_configuration: configuration.Configuration) -> str
     return package_folder
 
 
-# Standard shutil.copytree has problems copying into an already populated
-# folder, like we do with vdist. Workaround found here:
-#     https://stackoverflow.com/questions/1868714/how-do-i-copy-an-entire-directory-of-files-into-an-existing-directory-using-python
-def _copytree(src: str, dst: str, symlinks: bool=False, ignore: bool=None) -> None:
-    for item in os.listdir(src):
-        s = os.path.join(src, item)
-        d = os.path.join(dst, item)
-        if os.path.isdir(s):
-            shutil.copytree(s, d, symlinks, ignore)
-        else:
-            os.makedirs(os.path.dirname(d), exist_ok=True)
-            shutil.copy2(s, d)
+def load_profiles(profiles_dir: str=defaults.LOCAL_PROFILES_DIR) -> Dict[str, 'BuildProfile']:
+    internal_profiles = os.path.join(
+        os.path.dirname(__file__),
+        'profiles', 'internal_profiles.json')
+    profiles = _read_profiles_file(internal_profiles)
+
+    local_profiles = os.path.join(
+        profiles_dir, defaults.LOCAL_PROFILES_FILE)
+    if os.path.isfile(local_profiles):
+        profiles.update(_read_profiles_file(local_profiles))
+    return profiles
+
+
+def _read_profiles_file(config_file: str) -> Dict[str, 'BuildProfile']:
+    # Every build loads profiles more than once, so files are parsed again
+    # only when they change.
+    path = os.path.abspath(config_file)
+    stat = os.stat(path)
+    file_version = (stat.st_mtime_ns, stat.st_size)
+    with _profiles_cache_lock:
+        cached_version, cached_profiles = _profiles_cache.get(path, (None, None))
+    if cached_version == file_version:
+        return dict(cached_profiles)
+    build_profiles = _parse_profiles_file(path)
+    with _profiles_cache_lock:
+        _profiles_cache[path] = (file_version, build_profiles)
+    return dict(build_profiles)
+
+
+def _parse_profiles_file(config_file: str) -> Dict[str, 'BuildProfile']:
+    with open(config_file) as f:
+        profiles = json.loads(f.read())
+
+    build_profiles = {}
+    for profile_id in profiles:
+        build_profiles[profile_id] = BuildProfile(
+            profile_id=profile_id,
+            docker_image=profiles[profile_id].get('docker_image'),
+            script=profiles[profile_id]['script'],
+            insecure_registry=profiles[profile_id].get(
+                'insecure_registry', 'false'),
+            executor=profiles[profile_id].get('executor')
+        )
+    return build_profiles
+
+
+def get_machine_binds() -> Dict[str, str]:
+    # Host folders every build machine needs mounted, whatever its build.
+    python_cache = cache.get_python_cache()
+    python_cache.create()
+    wheelhouse = cache.get_wheelhouse()
+    wheelhouse.create()
+    os.makedirs(defaults.CCACHE_DIR, exist_ok=True)
+    return {python_cache.root: defaults.CONTAINER_PYTHON_CACHE_DIR,
+            wheelhouse.root: defaults.CONTAINER_WHEELHOUSE_DIR,
+            defaults.CCACHE_DIR: defaults.CONTAINER_CCACHE_DIR}
+
+
+def _reflink(src: str, dst: str) -> None:
+    with open(src, 'rb') as source_file, open(dst, 'wb') as destination_file:
+        fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+    shutil.copystat(src, dst)
+
+
+class _FilePopulator(object):
+    # Places files reflinking or hardlinking them if possible, falling back
+    # to copy. Once a method fails it's not tried again, because if it failed
+    # for a file it's likely to fail for every other file in the same tree.
+
+    def __init__(self, mode: str):
+        self.reflink = mode in (POPULATION_AUTO, POPULATION_REFLINK)
+        self.hardlink = mode in (POPULATION_AUTO, POPULATION_HARDLINK)
+
+    def place(self, src: str, dst: str) -> None:
+        if self.reflink:
+            try:
+                _reflink(src, dst)
+                return
+            except OSError:
+                self.reflink = False
+                if os.path.exists(dst):
+                    os.remove(dst)
+        if self.hardlink:
+            try:
+                os.link(os.path.realpath(src), dst)
+                return
+            except OSError:
+                self.hardlink = False
+        shutil.copy2(src, dst)
+
+
+def _populate_tree(src: str, dst: str, mode: str=POPULATION_COPY,
+                   ignore: List[str]=None) -> None:
+    """ Place src files into dst, even if dst is already populated.
+
+    :param src: Folder to get files from.
+    :param dst: Folder to place files into.
+    :param mode: How to place files: auto, reflink, hardlink or copy.
+    :param ignore: Glob patterns of files and folders to leave behind.
+    """
+    ignore_patterns = shutil.ignore_patterns(*ignore) if ignore else None
+    file_populator = _FilePopulator(mode)
+    for dirpath, dirnames, filenames in os.walk(src, followlinks=True):
+        ignored = ignore_patterns(dirpath, dirnames + filenames) \
+            if ignore_patterns else set()
+        dirnames[:] = [dirname for dirname in dirnames
+                       if dirname not in ignored]
+        destination_path = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(destination_path, exist_ok=True)
+        for filename in filenames:
+            if filename not in ignored:
+                file_populator.place(os.path.join(dirpath, filename),
+                                     os.path.join(destination_path, filename))
+
+
+class BuildResult(object):
+
+    BUILT = 'built'
+    REUSED = 'reused'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, name: str, status: str, duration: float,
+                 artifacts: List[str]=None, error: str=None,
+                 report: dict=None):
+        self.name = name
+        self.status = status
+        self.duration = duration
+        self.artifacts = artifacts or []
+        self.error = error
+        # Timings of build steps, see Builder.get_report().
+        self.report = report
+
+    @property
+    def succeeded(self) -> bool:
+        return self.status in (self.BUILT, self.REUSED)
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    def __str__(self):
+        return str(self.__dict__)
 
 
 class BuildProfile(object):
@@ -96,7 +418,7 @@ class BuildProfile(object):
     def __init__(self, **kwargs):
         self.required_attrs = ['profile_id', 'docker_image', 'script']
         # TODO: I'm not sure about insecure_registry is actually used any longer. Try to remove it.
-        self.optional_attrs = ['insecure_registry']
+        self.optional_attrs = ['insecure_registry', 'executor']
 
         for arg in kwargs:
             if arg not in self.required_attrs and \
@@ -105,6 +427,13 @@ class BuildProfile(object):
 
         self.__dict__.update(kwargs)
 
+        if getattr(self, 'executor', None) is None:
+            self.executor = EXECUTOR_DOCKER
+        if self.executor == EXECUTOR_LOCAL and \
+                getattr(self, 'docker_image', None) is None:
+            # Local profiles run on host, so they need no image.
+            self.docker_image = None
+
         self.validate()
 
         if hasattr(self, 'insecure_registry') and \
@@ -118,6 +447,8 @@ class BuildProfile(object):
             if not hasattr(self, attr):
                 raise AttributeError(
                     f'build profile misses attribute: {attr}')
+        if self.executor not in EXECUTORS:
+            raise AttributeError(f'unknown executor: {self.executor}')
         return True
 
     def __str__(self):
@@ -141,7 +472,17 @@ class Build(object):
                  after_remove=None,
                  before_remove=None,
                  after_upgrade=None,
-                 before_upgrade=None):
+                 before_upgrade=None,
+                 scratch_population=defaults.SCRATCH_POPULATION,
+                 source_ignore=None,
+                 package_formats=None,
+                 base_requirements=None,
+                 compile_jobs=None,
+                 use_ccache=True,
+                 shared_runtime=False,
+                 prune=defaults.PRUNE,
+                 python_optimization=defaults.PYTHON_OPTIMIZATION,
+                 configure_args=''):
         self.app = app
         self.version = version.format(**os.environ)
         self.source = source
@@ -161,7 +502,19 @@ class Build(object):
         else:
             self.python_basedir = python_basedir.format(**os.environ)
         self.compile_python = compile_python
+        # When None, compilation runs as many jobs as build machine CPU
+        # quota allows.
+        self.compile_jobs = int(compile_jobs) if compile_jobs else None
+        if self.compile_jobs is not None and self.compile_jobs < 1:
+            raise ValueError(f'compile_jobs must be positive: {compile_jobs}')
+        self.use_ccache = use_ccache
         self.python_version = python_version.format(**os.environ)
+        if python_optimization not in PYTHON_OPTIMIZATIONS:
+            raise ValueError(f'unknown python optimization: '
+                             f'{python_optimization}')
+        self.python_optimization = python_optimization
+        # Passed to configure as they are, after optimization level flags.
+        self.configure_args = configure_args.format(**os.environ)
         if custom_filename:
             self.custom_filename = custom_filename.format(**os.environ)
         else:
@@ -175,6 +528,55 @@ class Build(object):
         if runtime_deps:
             self.runtime_deps = runtime_deps
 
+        if scratch_population not in POPULATION_MODES:
+            raise ValueError(
+                f'unknown scratch population mode: {scratch_population}')
+        self.scratch_population = scratch_population
+        if source_ignore is None:
+            self.source_ignore = list(defaults.SOURCE_IGNORE)
+        else:
+            self.source_ignore = source_ignore
+        # When empty, package is only built in profile format.
+        self.package_formats = []
+        if package_formats:
+            unknown_formats = set(package_formats) - set(PACKAGE_FORMATS)
+            if unknown_formats:
+                raise ValueError(f'unknown package formats: '
+                                 f'{", ".join(sorted(unknown_formats))}')
+            if self.custom_filename and len(package_formats) > 1:
+                raise ValueError('custom_filename can not be shared by '
+                                 'several package formats')
+            self.package_formats = list(package_formats)
+        # Python dependencies baked into base image along with Python, when
+        # this build shares them with other builds of its batch.
+        self.base_requirements = list(base_requirements or [])
+        if prune not in PRUNE_PROFILES:
+            raise ValueError(f'unknown prune profile: {prune}')
+        self.prune = prune
+        # Compiled Python can ship as a runtime package of its own, which
+        # app package depends on, holding just a virtual environment on it.
+        self.shared_runtime = shared_runtime
+        self.runtime_name = None
+        self.runtime_basedir = None
+        if shared_runtime:
+            if not compile_python:
+                raise ValueError('shared_runtime needs Python to be compiled')
+            if self.python_version.startswith('2'):
+                raise ValueError('shared_runtime needs Python 3, as apps get '
+                                 'a virtual environment on it')
+            runtime = defaults.RUNTIME_PACKAGE_PREFIX + \
+                '.'.join(self.python_version.split('.')[:2])
+            if self.get_python_configure_flags() or prune != PRUNE_NONE:
+                # Runtimes compiled or pruned otherwise hold other trees, so
+                # they must not replace each other in hosts or repositories.
+                variant = json.dumps([self.get_python_configure_flags(), prune])
+                runtime = '-'.join([runtime, hashlib.sha256(
+                    variant.encode("utf8")).hexdigest()[:8]])
+            self.runtime_name = f'{runtime}-{profile}'
+            self.runtime_basedir = '/'.join([defaults.PYTHON_BASEDIR, runtime])
+            self.runtime_deps = self.runtime_deps + [
+                f'{self.runtime_name} >= {self.python_version}']
+
         self.profile = profile
         # I don't like method chaining but I didn't get it to work with a
         # auxiliary variable.
@@ -193,6 +595,32 @@ class Build(object):
     def __str__(self):
         return str(self.__dict__)
 
+    def get_python_configure_flags(self) -> str:
+        """ Tell configure flags this build adds to profile ones when
+        compiling Python.
+
+        :return: Optimization level flags followed by configure_args.
+        """
+        return ' '.join(flags for flags in
+                        [PYTHON_OPTIMIZATIONS[self.python_optimization],
+                         self.configure_args.strip()] if flags)
+
+    def get_wheel_pip_args(self) -> str:
+        """ Tell which pip_args can be passed to "pip wheel".
+
+        :return: pip_args options "pip wheel" accepts, with their values.
+        """
+        wheel_args = []
+        arguments = iter(shlex.split(self.pip_args))
+        for argument in arguments:
+            option, has_value, _ = argument.partition('=')
+            if option not in PIP_WHEEL_OPTIONS:
+                continue
+            wheel_args.append(argument)
+            if PIP_WHEEL_OPTIONS[option] and not has_value:
+                wheel_args.append(next(arguments, ''))
+        return ' '.join(shlex.quote(argument) for argument in wheel_args)
+
     def get_project_root_from_source(self) -> str:
         if self.source['type'] == 'git':
             return os.path.basename(self.source['uri'].rstrip('/'))
@@ -200,6 +628,14 @@ class Build(object):
             return os.path.basename(self.source['path'].rstrip('/'))
         return ''
 
+    def get_source_ignore(self) -> List[str]:
+        # Build scripts checkout requested branch from git_directory sources,
+        # so their VCS info must be kept.
+        if self.source['type'] == 'git_directory':
+            return [pattern for pattern in self.source_ignore
+                    if pattern != '.git']
+        return self.source_ignore
+
     def get_safe_dirname(self) -> str:
         return re.sub(
             '[^A-Za-z0-9\.\-]',
@@ -239,12 +675,28 @@ class Builder(object):
             self,
             process_name=defaults.BUILD_NAME,
             profiles_dir=defaults.LOCAL_PROFILES_DIR,
-            machine_logs=True):
+            machine_logs=True,
+            machine_pool=None,
+            resources=None,
+            log_dir=defaults.LOG_DIR,
+            labels=None,
+            use_base_images=True,
+            build_engine=None,
+            executor=None,
+            build_timeout=None):
         logging.basicConfig(format=f'%(asctime)s %(levelname)s [{process_name}] %(name)s %(message)s',
                             level=logging.INFO)
         self.logger = logging.getLogger('Builder')
 
-        self.build_basedir = tempfile.mkdtemp(prefix="vdist")
+        # When builds are leased to pooled machines, build folders must live
+        # inside pool folder because pool moves them into what those machines
+        # have mounted.
+        self.machine_pool = machine_pool
+        build_root = machine_pool.root if machine_pool is not None else None
+        self.build_basedir = tempfile.mkdtemp(prefix="vdist", dir=build_root)
+        self.shared_dir = defaults.SHARED_DIR
+        self.resources = resources
+        self.source_binds = {}
         self.profiles = {}
         # Actually, list of pending builds is no longer stored here, but in
         # vdist_launcher configurations when console launcher is used.
@@ -252,11 +704,43 @@ class Builder(object):
         self.build = None
 
         self.machine_logs = machine_logs
+        self.log_dir = log_dir
+        self.labels = labels
+        self.started_at = time.time()
+        # Seconds spent in every host side step and in every phase of build
+        # script.
+        self.timings = {}
+        self.phases = []
+        # Bytes of package trees build script reported, by name.
+        self.sizes = {}
+        # Seconds Python benchmarks took, by name.
+        self.benchmarks = {}
+        # Set when a baked base image replaces profile image.
+        self.use_base_images = use_base_images
+        self.base_image = None
+        self.base_image_selected = False
+        # When given, build machines are driven from engine loop.
+        self.build_engine = build_engine
+        # Overrides executor of build profile.
+        self.executor = executor
+        # Seconds build scripts may run. Engine enforces it on the machines
+        # it drives, and local and podman machines do it themselves.
+        self.build_timeout = build_timeout
         self.local_profiles_dir = profiles_dir
         self._load_profiles()
 
     def add_build(self, **kwargs) -> None:
         self.build = Build(**kwargs)
+        if self.machine_pool is not None and \
+                self.get_executor() != EXECUTOR_DOCKER:
+            # Only docker builds can be run by pooled machines.
+            self.machine_pool = None
+
+    def get_executor(self, build: Build=None) -> str:
+        if self.executor is not None:
+            return self.executor
+        profile = self.profiles.get((build or self.build).profile)
+        return profile.executor if profile is not None else EXECUTOR_DOCKER
 
     # TODO: Possibly redundant with already existing code. REFACTOR
     # def _create_vdist_dir(self) -> None:
@@ -265,40 +749,15 @@ class Builder(object):
     #         self.logger.info(f'Creating: {vdist_path}')
     #         os.mkdir(vdist_path)
 
-    def _add_profiles_from_file(self, config_file) -> None:
-        with open(config_file) as f:
-            profiles = json.loads(f.read())
-
-            for profile_id in profiles:
-                profile = BuildProfile(
-                    profile_id=profile_id,
-                    docker_image=profiles[profile_id]['docker_image'],
-                    script=profiles[profile_id]['script'],
-                    insecure_registry=profiles[profile_id].get(
-                        'insecure_registry', 'false')
-                )
-
-                self.profiles[profile_id] = profile
-
     def _load_profiles(self) -> None:
-        internal_profiles = os.path.join(
-            os.path.dirname(__file__),
-            'profiles', 'internal_profiles.json')
-        self._add_profiles_from_file(internal_profiles)
-
-        local_profiles = os.path.join(
-            self.local_profiles_dir, defaults.LOCAL_PROFILES_FILE)
-        if os.path.isfile(local_profiles):
-            self._add_profiles_from_file(local_profiles)
-
-    def _render_template(self, build) -> None:
-        internal_template_dir = os.path.join(
-            os.path.dirname(__file__), 'profiles')
+        self.profiles.update(load_profiles(self.local_profiles_dir))
 
-        local_template_dir = os.path.abspath(self.local_profiles_dir)
+    def _get_template_environment(self) -> Environment:
+        return templates.get_environment(self.local_profiles_dir)
 
-        env = Environment(loader=FileSystemLoader([internal_template_dir,
-                                                   local_template_dir]))
+    def _render_template(self, build, shared_dir: str=None,
+                         bake_only: bool=False) -> str:
+        env = self._get_template_environment()
 
         if build.profile not in self.profiles:
             raise BuildProfileNotFoundException(
@@ -306,18 +765,202 @@ class Builder(object):
 
         profile = self.profiles[build.profile]
         template_name = profile.script
-        template = env.get_template(template_name)
 
         # local uid and gid are needed to correctly set permissions
         # on the created artifacts after the build completes
-        return template.render(
-            local_uid=os.getuid(),
-            local_gid=os.getgid(),
+        local_uid, local_gid = os.getuid(), os.getgid()
+        if self.get_executor(build) != EXECUTOR_DOCKER:
+            # Local and rootless podman scripts run as user namespace root,
+            # which already is host user. Any other uid there would be a
+            # subordinate one at host.
+            local_uid, local_gid = 0, 0
+        return templates.render(env, template_name, dict(
+            local_uid=local_uid,
+            local_gid=local_gid,
+            # Local builds can't use package managers.
+            executor=self.get_executor(build),
             project_root=build.get_project_root_from_source(),
-            shared_dir=defaults.SHARED_DIR,
+            shared_dir=shared_dir or self.shared_dir,
             scratch_folder_name=defaults.SCRATCH_DIR,
+            python_cache_dir=defaults.CONTAINER_PYTHON_CACHE_DIR,
+            wheelhouse_dir=defaults.CONTAINER_WHEELHOUSE_DIR,
+            python_build_prefix=defaults.PYTHON_BUILD_PREFIX,
+            # Python compiled here, or baked into base image, is at build
+            # prefix until script relocates it.
+            relocate_python=bool(build.compile_python or self.base_image),
+            prune_patterns=PRUNE_PROFILES[build.prune],
+            python_configure_flags=build.get_python_configure_flags(),
+            wheel_pip_args=build.get_wheel_pip_args(),
+            ccache_dir=defaults.CONTAINER_CCACHE_DIR,
+            ccache_max_size=defaults.CCACHE_MAX_SIZE,
+            bake_only=bake_only,
             **build.__dict__
-        )
+        ))
+
+    def _get_template_digest(self, profile: BuildProfile) -> str:
+        return templates.get_source_digest(self._get_template_environment(),
+                                           profile.script)
+
+    def get_build_fingerprint(self) -> Optional[str]:
+        # Must be called before build folders are created, because their
+        # random paths would leak into rendered script.
+        self._select_base_image()
+        if self.build.source['type'] == 'git':
+            # Build must package the very commit we fingerprint.
+            mirror.pin_git_source(self.build.source)
+        # Ignored files don't reach the build, unless source is mounted.
+        ignore = [] if self._get_population_mode(self.build) == POPULATION_BIND \
+            else self.build.get_source_ignore()
+        source_digest = fingerprint.get_source_digest(self.build.source, ignore)
+        if source_digest is None:
+            return None
+        extra_digests = {}
+        if self.build.use_local_pip_conf:
+            extra_digests['pip_conf'] = fingerprint.get_directory_digest(
+                os.path.join(os.path.expanduser('~'), '.pip'))
+        # Pooled builds render a different shared dir, but they are not
+        # different builds for that.
+        build_script = self._render_template(self.build,
+                                             shared_dir=defaults.SHARED_DIR)
+        profile = self.profiles[self.build.profile]
+        build_machine = self._get_build_machine(profile)
+        return fingerprint.get_build_fingerprint(
+            build_script=build_script,
+            source_digest=source_digest,
+            image_id=build_machine.get_image_id(),
+            extra_digests=extra_digests)
+
+    def _get_base_image_tag(self, profile: BuildProfile) -> str:
+        # Base images hold what Python cache would, so they are keyed alike.
+        build_machine = buildmachine.BuildMachine(image=profile.docker_image)
+        key = cache.python_cache_key(
+            image_id=build_machine.get_image_id(),
+            python_version=self.build.python_version,
+            build_recipe=self._get_template_digest(profile),
+            configure_flags=self.build.get_python_configure_flags())
+        if self.build.base_requirements:
+            # Images baked for batch groups hold their shared dependencies.
+            key = hashlib.sha256("\n".join(
+                [key] + self.build.base_requirements).encode("utf8")).hexdigest()
+        if self.build.pip_args or self.build.use_local_pip_conf or \
+                self.build.build_deps:
+            # And system packages and pip settings they were installed with.
+            key = hashlib.sha256(json.dumps(
+                [key, self.build.pip_args, self.build.use_local_pip_conf,
+                 sorted(self.build.build_deps)]).encode("utf8")).hexdigest()
+        return f'{profile.profile_id}-{self.build.python_version}-{key[:12]}'
+
+    def find_base_image(self) -> Optional[str]:
+        """ Look for a base image baked for current build.
+
+        :return: Base image name, or None if it has not been baked.
+        """
+        profile = self.profiles[self.build.profile]
+        base_image = ":".join([defaults.BASE_IMAGE_REPOSITORY,
+                               self._get_base_image_tag(profile)])
+        if buildmachine.BuildMachine(image=base_image).has_image():
+            return base_image
+        return None
+
+    def _select_base_image(self) -> None:
+        # Decided only once, because it changes how build is rendered.
+        if self.base_image_selected:
+            return
+        self.base_image_selected = True
+        if not self.use_base_images or not self.build.compile_python or \
+                self.get_executor() != EXECUTOR_DOCKER:
+            return
+        base_image = self.find_base_image()
+        if base_image is None:
+            return
+        self.logger.info(f'Using base image {base_image}, Python is already '
+                         f'compiled there.')
+        self.base_image = base_image
+        self.build.compile_python = False
+        # Pooled machines run profile image, not this one. Besides, Python
+        # dependencies are installed into image interpreter, so a machine
+        # could not be reused by another build.
+        self.machine_pool = None
+
+    def _get_docker_image(self, profile: BuildProfile) -> str:
+        return self.base_image or profile.docker_image
+
+    def bake_base_image(self, force: bool=False) -> str:
+        """ Build a derived image of build profile one, with Python already
+        compiled.
+
+        Further builds with same profile and python_version use that image
+        instead of compiling Python again, whatever their python_basedir.
+
+        :param force: Bake image even if it already exists.
+        :return: Base image name.
+        """
+        if not self.build.compile_python:
+            raise ValueError(f'{self.build.name} does not compile Python, so '
+                             f'it needs no base image.')
+        if self.get_executor() != EXECUTOR_DOCKER:
+            raise ValueError(f'{self.build.name} is not built with docker, so '
+                             f'it can not use base images.')
+        profile = self.profiles[self.build.profile]
+        tag = self._get_base_image_tag(profile)
+        base_image = ":".join([defaults.BASE_IMAGE_REPOSITORY, tag])
+        if not force and buildmachine.BuildMachine(image=base_image).has_image():
+            self.logger.info(f'Base image already baked: {base_image}')
+            return base_image
+        self.create_build_folder_tree()
+        try:
+            self._write_build_script(
+                os.path.join(self.build.scratch_dir,
+                             defaults.SCRATCH_BUILDSCRIPT_NAME),
+                self._render_template(self.build, bake_only=True))
+            with self._open_build_log() as build_log:
+                build_machine = buildmachine.BuildMachine(
+                    image=profile.docker_image,
+                    build_log=build_log,
+                    labels=self.labels)
+                environment = self._get_python_cache_environment(
+                    build_machine, profile)
+                self.logger.info(f'Baking base image: {base_image}')
+                try:
+                    exit_code = build_machine.launch(
+                        build_dir=self.build.build_tmp_dir,
+                        extra_binds=get_machine_binds(),
+                        environment=environment)
+                    if exit_code == 0:
+                        build_machine.commit(
+                            defaults.BASE_IMAGE_REPOSITORY, tag,
+                            {'vdist.profile': profile.profile_id,
+                             'vdist.python_version': self.build.python_version})
+                finally:
+                    if build_machine.container is not None:
+                        build_machine.shutdown()
+            self._check_exit_code(exit_code, build_log)
+        finally:
+            self.discard_build_folder_tree()
+        return base_image
+
+    def _get_python_cache_environment(
+            self,
+            build_machine: buildmachine.BuildMachine,
+            profile: BuildProfile) -> Dict[str, str]:
+        # Returns environment variables build script needs to reuse compiled
+        # interpreters from our host side cache.
+        if not self.build.compile_python:
+            return {}
+        cache_key = cache.python_cache_key(
+            image_id=build_machine.get_image_id(),
+            python_version=self.build.python_version,
+            build_recipe=self._get_template_digest(profile),
+            configure_flags=self.build.get_python_configure_flags())
+        self.logger.info(f'Python cache key for {self.build.name}: {cache_key}')
+        return {'VDIST_PYTHON_CACHE_KEY': cache_key}
+
+    def _prune_python_cache(self) -> None:
+        if not self.build.compile_python:
+            return
+        evicted_entries = cache.get_python_cache().prune()
+        for entry in evicted_entries:
+            self.logger.info(f'Evicted Python cache entry: {entry.key}')
 
     def _clean_build_basedir(self) -> None:
         if os.path.exists(self.build_basedir):
@@ -341,22 +984,48 @@ class Builder(object):
 
         # copy local ~/.pip if necessary
         if build.use_local_pip_conf:
-            _copytree(
+            _populate_tree(
                 os.path.join(os.path.expanduser('~'), '.pip'),
                 os.path.join(build.scratch_dir, '.pip')
             )
 
-        # local source type, copy local dir to scratch dir
+        # git source type, export requested branch from our mirror
+        if build.source['type'] == 'git':
+            mirror.export_git_source(
+                build.source,
+                os.path.join(build.scratch_dir,
+                             build.get_project_root_from_source()))
+
+        # local source type, place local dir into scratch dir
         if build.source['type'] in ['directory', 'git_directory']:
             if not os.path.exists(build.source['path']):
                 raise ValueError(
                     f'path does not exist: {build.source["path"]}')
             else:
                 subdir = os.path.basename(build.source['path'])
-                _copytree(
-                    build.source['path'].rstrip('/'),
-                    os.path.join(build.scratch_dir, subdir)
-                )
+                source_path = build.source['path'].rstrip('/')
+                scratch_source_path = os.path.join(build.scratch_dir, subdir)
+                if self._get_population_mode(build) == POPULATION_BIND:
+                    # Build machine will mount source right here, read-only.
+                    os.makedirs(scratch_source_path, exist_ok=True)
+                    self.source_binds = {
+                        source_path: "/".join([self.shared_dir,
+                                               defaults.SCRATCH_DIR, subdir])}
+                else:
+                    _populate_tree(
+                        source_path,
+                        scratch_source_path,
+                        mode=self._get_population_mode(build),
+                        ignore=build.get_source_ignore()
+                    )
+
+    def _get_population_mode(self, build) -> str:
+        # Pooled machines are already running, so nothing else can be mounted
+        # in them.
+        if build.scratch_population == POPULATION_BIND and \
+                self.machine_pool is not None:
+            return POPULATION_AUTO
+        return build.scratch_population
 
     def _create_build_dir(self, build) -> Tuple[str, str]:
         subdir_name = build.get_safe_dirname()
@@ -375,22 +1044,142 @@ class Builder(object):
         return build_dir, scratch_dir
 
     def run_build(self) -> None:
+        self._select_base_image()
         profile = self.profiles[self.build.profile]
 
-        self.logger.info(f'launching docker image: {profile.docker_image}')
-
-        build_machine = buildmachine.BuildMachine(
-            image=profile.docker_image
-        )
-
-        self.logger.info(f'Running build machine for: {self.build.name}')
-        build_machine.launch(build_dir=self.build.build_tmp_dir)
-
-        self.logger.info(f'Shutting down build machine: {self.build.name}')
-        build_machine.shutdown()
+        if self.machine_pool is not None:
+            self._run_pooled_build(profile)
+        else:
+            self._run_standalone_build(profile)
+        self._prune_python_cache()
 
         self.logger.info(f'*** Resulting OS packages are in: {self.build.build_tmp_dir} ***')
 
+    def _run_standalone_build(self, profile: BuildProfile) -> None:
+        self.logger.info(f'launching {self.get_executor()} build machine: '
+                         f'{self._get_docker_image(profile)}')
+
+        with self._open_build_log() as build_log:
+            build_machine = self._get_build_machine(profile, build_log)
+
+            environment = self._get_python_cache_environment(build_machine,
+                                                             profile)
+
+            self.logger.info(f'Running build machine for: {self.build.name}')
+            try:
+                exit_code = build_machine.launch(
+                    build_dir=self.build.build_tmp_dir,
+                    extra_binds=get_machine_binds(),
+                    environment=environment,
+                    read_only_binds=self.source_binds)
+            finally:
+                if build_machine.container is not None:
+                    self.logger.info(f'Shutting down build machine: {self.build.name}')
+                    build_machine.shutdown()
+        self._collect_machine_timings(build_machine, build_log)
+        self._check_exit_code(exit_code, build_log)
+
+    def _run_pooled_build(self, profile: BuildProfile) -> None:
+        self.logger.info(f'Waiting for a pooled machine of: {profile.docker_image}')
+        with self.machine_pool.lease(profile.docker_image,
+                                     self.build_basedir) as container_id, \
+                self._open_build_log() as build_log:
+            build_machine = self._get_build_machine(profile, build_log)
+            build_machine.attach(container_id)
+
+            self.logger.info(f'Resetting pooled machine for: {self.build.name}')
+            build_machine.reset(self._get_leftover_paths())
+
+            environment = self._get_python_cache_environment(build_machine,
+                                                             profile)
+
+            self.logger.info(f'Running pooled machine for: {self.build.name}')
+            exit_code = build_machine.run_script(self.shared_dir, environment)
+        self._collect_machine_timings(build_machine, build_log)
+        self._check_exit_code(exit_code, build_log)
+
+    def _get_build_machine(self, profile: BuildProfile,
+                           build_log: buildlog.BuildLog=None):
+        # Every kind of build machine offers the same interface to run a
+        # build script, whatever it runs on.
+        if self.get_executor() == EXECUTOR_LOCAL:
+            return localmachine.LocalBuildMachine(resources=self.resources,
+                                                  build_log=build_log,
+                                                  labels=self.labels,
+                                                  timeout=self.build_timeout)
+        image = self._get_docker_image(profile)
+        if self.get_executor() == EXECUTOR_PODMAN:
+            return podmanmachine.PodmanBuildMachine(image=image,
+                                                    resources=self.resources,
+                                                    build_log=build_log,
+                                                    labels=self.labels,
+                                                    timeout=self.build_timeout)
+        if self.build_engine is not None:
+            return self.build_engine.get_build_machine(
+                image=image, resources=self.resources, build_log=build_log,
+                labels=self.labels)
+        return buildmachine.BuildMachine(image=image, resources=self.resources,
+                                         build_log=build_log,
+                                         labels=self.labels)
+
+    def _collect_machine_timings(self, build_machine: buildmachine.BuildMachine,
+                                 build_log: buildlog.BuildLog) -> None:
+        self.timings.update(build_machine.timings)
+        self.phases = build_log.get_phases()
+        self.sizes = dict(build_log.sizes)
+        self.benchmarks = dict(build_log.benchmarks)
+
+    def get_report(self) -> dict:
+        return {"name": self.build.name,
+                "profile": self.build.profile,
+                "timings": self.timings,
+                "phases": self.phases,
+                "sizes": self.sizes,
+                "benchmarks": self.benchmarks}
+
+    def write_report(self) -> Optional[str]:
+        # Reports are kept along with build logs.
+        if not self.machine_logs or self.build is None:
+            return None
+        report_path = buildlog.get_log_path(self.log_dir,
+                                            self.build.get_safe_dirname(),
+                                            self.started_at, '.json')
+        report.write_report(report_path, self.get_report())
+        return report_path
+
+    def _check_exit_code(self, exit_code: int,
+                         build_log: buildlog.BuildLog) -> None:
+        if exit_code == 0:
+            return
+        last_lines = "\n".join(build_log.tail)
+        raise BuildFailedException(
+            f'Build script of {self.build.name} exited with code '
+            f'{exit_code}. Last lines of its output:\n{last_lines}')
+
+    def _open_build_log(self) -> buildlog.BuildLog:
+        # Without machine logs, build output is only summarized in console.
+        log_path = None
+        if self.machine_logs:
+            log_path = buildlog.get_log_path(self.log_dir,
+                                             self.build.get_safe_dirname(),
+                                             self.started_at)
+        return buildlog.BuildLog(log_path, self.build.name)
+
+    def _get_leftover_paths(self) -> List[str]:
+        # Paths a previous build leased to the same machine could have
+        # populated and that would pollute our own build.
+        leftover_paths = [
+            "/".join([self.build.package_tmp_root.rstrip('/'), '*']),
+            "/".join([self.build.package_install_root, self.build.app]),
+            '/var/tmp/Python-*'
+        ]
+        if self.build.compile_python:
+            leftover_paths.extend([defaults.PYTHON_BUILD_PREFIX,
+                                   self.build.python_basedir])
+        if self.build.shared_runtime:
+            leftover_paths.append(self.build.runtime_basedir)
+        return leftover_paths
+
     def get_available_profiles(self) -> Dict[str, BuildProfile]:
         self._load_profiles()
         return self.profiles
@@ -402,7 +1191,9 @@ class Builder(object):
         self.run_build()
 
     def populate_build_folder_tree(self) -> None:
-        self._populate_scratch_dir(self.build)
+        self._select_base_image()
+        with report.timed(self.timings, 'scratch_population'):
+            self._populate_scratch_dir(self.build)
 
     def create_build_folder_tree(self) -> None:
         self._start_build_basedir()
@@ -416,6 +1207,8 @@ class Builder(object):
         build_tmp_dir, scratch_dir = self._create_build_dir(self.build)
         self.build.build_tmp_dir = build_tmp_dir
         self.build.scratch_dir = scratch_dir
+        if self.machine_pool is not None:
+            self.shared_dir = self.machine_pool.get_container_path(build_tmp_dir)
 
     def copy_script_to_output_folder(self, _configuration) -> None:
         source_folder = self.build.scratch_dir
@@ -424,11 +1217,24 @@ class Builder(object):
         script_output_filepath = _get_script_output_filename(_configuration)
         shutil.copy(script_filepath, script_output_filepath)
 
+    def discard_build_folder_tree(self) -> None:
+        self._clean_build_basedir()
+
+    def write_script_to_output_folder(self, _configuration) -> None:
+        self._write_build_script(_get_script_output_filename(_configuration),
+                                 self._render_template(self.build,
+                                                       shared_dir=defaults.SHARED_DIR))
+
     def move_package_to_output_folder(self, _configuration: configuration.Configuration) -> list:
-        files_moved = _move_generated_package(_configuration, self.build.build_tmp_dir)
+        with report.timed(self.timings, 'artifact_move'):
+            files_moved = _move_generated_package(_configuration, self.build.build_tmp_dir)
         return files_moved
 
 
+class BuildFailedException(Exception):
+    pass
+
+
 class BuildProfileNotFoundException(Exception):
     pass
 
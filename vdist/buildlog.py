@@ -0,0 +1,184 @@
+import codecs
+import collections
+import gzip
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Union
+
+import vdist.defaults as defaults
+
+# Build scripts print this at the beginning of every phase. See _phases.sh.
+PHASE_MARKER = '@@vdist-phase '
+# And this with a name and bytes when they measure something. See _prune.sh.
+SIZE_MARKER = '@@vdist-size '
+# And this with a name and seconds when they benchmark. See _benchmark.sh.
+BENCHMARK_MARKER = '@@vdist-benchmark '
+
+
+class LineDecoder(object):
+    """ Splits a stream of raw chunks into text lines.
+
+    Chunks may end in the middle of a multibyte character or of a line, so
+    both are kept until next chunk completes them.
+    """
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder("utf8")(errors="replace")
+        self.pending_text = ""
+
+    def feed(self, chunk: bytes) -> List[str]:
+        text = self.pending_text + self.decoder.decode(chunk)
+        lines = text.split("\n")
+        self.pending_text = lines.pop()
+        return [line.rstrip("\r") for line in lines]
+
+    def flush(self) -> List[str]:
+        text = self.pending_text + self.decoder.decode(b"", final=True)
+        self.pending_text = ""
+        return [text.rstrip("\r")] if text else []
+
+
+class BuildLog(object):
+    """ Compressed log file of a build, written by a thread of its own.
+
+    Feeding output never waits for disk or console, so a slow terminal does
+    not throttle builds. Console only gets a progress line from time to time.
+    If no path is given, output is summarized but not kept.
+
+    Output is timestamped as it is fed, so phases marked by build scripts can
+    be timed.
+    """
+
+    _END_OF_LOG = None
+
+    def __init__(self, path: Optional[str], name: str,
+                 summary_interval: float=defaults.LOG_SUMMARY_INTERVAL):
+        self.logger = logging.getLogger('BuildLog')
+        self.path = path
+        self.name = name
+        self.summary_interval = summary_interval
+        self.lines = 0
+        self.tail = collections.deque(maxlen=defaults.LOG_TAIL_LINES)
+        self.phase_markers = []
+        self.sizes = {}
+        self.benchmarks = {}
+        self.opened_at = time.time()
+        self.closed_at = None
+        self._chunks = queue.Queue()
+        self._decoder = LineDecoder()
+        self._last_summary = time.time()
+        self._file = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._file = gzip.open(path, 'wb')
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_chunks,
+                                        name=f'BuildLog-{name}', daemon=True)
+        self._writer.start()
+
+    def __enter__(self) -> 'BuildLog':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def feed(self, chunk: bytes) -> None:
+        self._chunks.put((time.time(), chunk))
+
+    def _write_chunks(self) -> None:
+        while True:
+            item = self._chunks.get()
+            if item is self._END_OF_LOG:
+                break
+            received_at, chunk = item
+            if self._file is not None:
+                self._file.write(chunk)
+            self._add_lines(self._decoder.feed(chunk), received_at)
+            if time.time() - self._last_summary >= self.summary_interval:
+                self._summarize()
+        self._add_lines(self._decoder.flush(), time.time())
+
+    def _add_lines(self, lines: List[str], received_at: float) -> None:
+        self.lines += len(lines)
+        self.tail.extend(lines)
+        for line in lines:
+            if line.startswith(PHASE_MARKER):
+                self.phase_markers.append(
+                    (line[len(PHASE_MARKER):].strip(), received_at))
+            elif line.startswith(SIZE_MARKER):
+                name, _, size = line[len(SIZE_MARKER):].strip().partition(' ')
+                if size.isdigit():
+                    self.sizes[name] = int(size)
+            elif line.startswith(BENCHMARK_MARKER):
+                name, _, seconds = \
+                    line[len(BENCHMARK_MARKER):].strip().partition(' ')
+                try:
+                    self.benchmarks[name] = float(seconds)
+                except ValueError:
+                    pass
+
+    def get_phases(self) -> List[Dict[str, Union[str, float]]]:
+        """ Time phases marked by build script.
+
+        :return: Dicts with name, start time and duration of every phase, in
+            the order they were run. Last phase lasts until log is closed.
+        """
+        ended_at = self.closed_at or time.time()
+        end_times = [started_at for _, started_at
+                     in self.phase_markers[1:]] + [ended_at]
+        return [{"name": name, "started_at": started_at,
+                 "duration": ended_at - started_at}
+                for (name, started_at), ended_at
+                in zip(self.phase_markers, end_times)]
+
+    def _summarize(self) -> None:
+        self._last_summary = time.time()
+        last_line = self.tail[-1] if self.tail else ""
+        self.logger.info(f'{self.name}: {self.lines} lines | {last_line}')
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._chunks.put(self._END_OF_LOG)
+        self._writer.join()
+        self.closed_at = time.time()
+        if self._file is None:
+            self.logger.info(f'{self.name}: {self.lines} lines')
+            return
+        self._file.close()
+        self.logger.info(f'{self.name}: {self.lines} lines written to '
+                         f'{self.path}')
+
+
+def log_process_output(output: int, build_log: Optional[BuildLog],
+                       logger: logging.Logger) -> None:
+    """ Read output of a process until it ends.
+
+    :param output: File descriptor of process output.
+    :param build_log: Build log to feed output into. If None, output lines
+        are logged instead.
+    :param logger: Logger to log output lines with.
+    """
+    decoder = LineDecoder()
+    while True:
+        chunk = os.read(output, 65536)
+        if not chunk:
+            break
+        if build_log is not None:
+            build_log.feed(chunk)
+        else:
+            for line in decoder.feed(chunk):
+                logger.info(line)
+    if build_log is None:
+        for line in decoder.flush():
+            logger.info(line)
+
+
+def get_log_path(log_dir: str, build_name: str, started_at: float=None,
+                 extension: str='.log.gz') -> str:
+    timestamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(started_at))
+    return os.path.join(log_dir, f'{build_name}-{timestamp}{extension}')
@@ -1,53 +1,164 @@
 import itertools
+import json
 import logging
 import os
-from typing import Dict, Any
+from typing import Dict, Any, List
 import docker
 
+import vdist.buildlog as buildlog
 import vdist.defaults as defaults
+import vdist.leftovers as leftovers
+import vdist.report as report
+import vdist.scheduler as scheduler
+
+CPU_PERIOD = 100000
 
 
 class BuildMachine(object):
 
-    def __init__(self, image: str=None):
+    def __init__(self, image: str=None,
+                 resources: scheduler.BuildResources=None,
+                 build_log: buildlog.BuildLog=None,
+                 labels: Dict[str, str]=None):
         self.logger = logging.getLogger('BuildMachine')
         self.image = image
+        self.resources = resources
+        self.build_log = build_log
+        # Labels let us find containers of a batch, wherever they were started.
+        self.labels = labels or {}
+        # Seconds spent in every container operation.
+        self.timings = {}
         self.container = None
         self.docker_client = docker.from_env(version="auto")
 
     @staticmethod
-    def _binds_to_shell_volumes(binds: Dict[str, str]) -> Dict[str, Dict[str, str]]:
-        volumes = {k: {'bind': v, 'mode': 'rw'} for k, v in binds.items()}
+    def _binds_to_shell_volumes(binds: Dict[str, str], mode: str='rw') -> Dict[str, Dict[str, str]]:
+        volumes = {k: {'bind': v, 'mode': mode} for k, v in binds.items()}
         return volumes
 
-    def launch(self, build_dir: str, extra_binds: Dict[str, str]=None) -> None:
+    def get_image_id(self) -> str:
+        try:
+            image = self.docker_client.images.get(self.image)
+        except docker.errors.ImageNotFound:
+            self.logger.info(f'Pulling image: {self.image}')
+            image = self.docker_client.images.pull(self.image)
+        return image.id
+
+    def has_image(self) -> bool:
+        try:
+            self.docker_client.images.get(self.image)
+        except docker.errors.ImageNotFound:
+            return False
+        return True
+
+    def commit(self, repository: str, tag: str,
+               labels: Dict[str, str]=None) -> str:
+        """ Save container filesystem as a new image.
+
+        :param repository: Repository of new image.
+        :param tag: Tag of new image.
+        :param labels: Labels to add to the ones inherited from base image.
+        :return: Id of new image.
+        """
+        self.logger.info(f'Committing container {self.container.id} as: '
+                         f'{repository}:{tag}')
+        changes = [f'LABEL {key}={json.dumps(value)}'
+                   for key, value in (labels or {}).items()]
+        image = self.container.commit(repository=repository, tag=tag,
+                                      changes=changes)
+        return image.id
+
+    def launch(self, build_dir: str, extra_binds: Dict[str, str]=None,
+               environment: Dict[str, str]=None,
+               read_only_binds: Dict[str, str]=None) -> int:
         binds = {build_dir: defaults.SHARED_DIR}
         if extra_binds:
             binds = dict(itertools.chain(binds.items(), extra_binds.items()))
+        with report.timed(self.timings, 'container_start'):
+            self.container = self._start_container(binds, read_only_binds)
+        return self.run_script(defaults.SHARED_DIR, environment)
+
+    def start(self, binds: Dict[str, str]) -> str:
+        # Starts an idle container to be attached to later, maybe from another
+        # process. That's what machine pools use.
+        self.container = self._start_container(binds)
+        return self.container.id
+
+    def attach(self, container_id: str) -> None:
+        with report.timed(self.timings, 'container_attach'):
+            self.container = self.docker_client.containers.get(container_id)
+            if self.resources is not None:
+                # Pooled containers were started before knowing which build
+                # they would run, so apply that build limits now.
+                self.container.update(memswap_limit=-1,
+                                      **self._get_resources_limits())
+
+    def _get_resources_limits(self) -> Dict[str, int]:
+        if self.resources is None:
+            return {}
+        return {'cpu_period': CPU_PERIOD,
+                'cpu_quota': int(self.resources.cpus * CPU_PERIOD),
+                'mem_limit': self.resources.memory}
+
+    def reset(self, paths: List[str]) -> None:
+        # Paths may have wildcards, so a shell is needed to expand them.
+        command = leftovers.get_reset_command(paths)
+        self.logger.info(f'Removing from container: {" ".join(paths)}')
+        with report.timed(self.timings, 'container_reset'):
+            result = self.container.exec_run(command)
+        if result.exit_code != 0:
+            raise leftovers.MachineResetException(
+                f'could not reset container {self.container.id}: '
+                f'{result.output.decode("utf8", errors="replace").strip()}')
+
+    def run_script(self, shared_dir: str,
+                   environment: Dict[str, str]=None) -> int:
         path_to_command = os.path.join(
-            defaults.SHARED_DIR,
+            shared_dir,
             defaults.SCRATCH_DIR,
             defaults.SCRATCH_BUILDSCRIPT_NAME
         )
-        self.container = self._start_container(binds)
-        self._run_command_on_container(path_to_command)
+        with report.timed(self.timings, 'script'):
+            return self._run_command_on_container(path_to_command, environment)
 
-    def _run_command_on_container(self, path_to_command: str) -> int:
-        result = self.container.exec_run(path_to_command, stream=True)
-        for line in result.output:
-            self.logger.info(line.decode("utf8"))
-        return result.exit_code
+    def _run_command_on_container(self, path_to_command: str,
+                                  environment: Dict[str, str]=None) -> int:
+        # Container.exec_run() does not report exit code of streamed commands,
+        # so low level API is used to inspect it once output ends.
+        exec_id = self.docker_client.api.exec_create(
+            self.container.id, path_to_command, environment=environment)['Id']
+        output = self.docker_client.api.exec_start(exec_id, stream=True)
+        if self.build_log is not None:
+            for chunk in output:
+                self.build_log.feed(chunk)
+        else:
+            decoder = buildlog.LineDecoder()
+            for chunk in output:
+                for line in decoder.feed(chunk):
+                    self.logger.info(line)
+            for line in decoder.flush():
+                self.logger.info(line)
+        exit_code = self.docker_client.api.exec_inspect(exec_id)['ExitCode']
+        # Killed containers leave their commands without exit code.
+        return exit_code if exit_code is not None else -1
 
     # I've been unable to locate Container class in docker exported hierarchy. So I've set Any as return type.
-    def _start_container(self, binds: Dict[str, str]) -> Any:
+    def _start_container(self, binds: Dict[str, str],
+                         read_only_binds: Dict[str, str]=None) -> Any:
         self.logger.info(f'Starting container: {self.image}')
+        volumes = self._binds_to_shell_volumes(binds)
+        if read_only_binds:
+            volumes.update(self._binds_to_shell_volumes(read_only_binds, mode='ro'))
         container = self.docker_client.containers.run(image=self.image, detach=True, command="bash", tty=True,
-                                                      stdin_open=True, volumes=self._binds_to_shell_volumes(binds))
+                                                      stdin_open=True, volumes=volumes,
+                                                      labels=self.labels,
+                                                      **self._get_resources_limits())
         return container
 
     def shutdown(self) -> None:
-        self._stop_container()
-        self._remove_container()
+        with report.timed(self.timings, 'container_stop'):
+            self._stop_container()
+            self._remove_container()
 
     def _remove_container(self) -> None:
         self.logger.info(f'Removing container: {self.container.id}')
@@ -56,3 +167,29 @@ class BuildMachine(object):
     def _stop_container(self) -> None:
         self.logger.info(f'Stopping container: {self.container.id}')
         self.container.stop()
+
+
+def list_images(repository: str) -> List[Any]:
+    docker_client = docker.from_env(version="auto")
+    return docker_client.images.list(name=repository)
+
+
+def kill_containers(labels: Dict[str, str]) -> List[str]:
+    """ Kill every running container that has given labels.
+
+    :param labels: Labels containers were started with.
+    :return: Ids of killed containers.
+    """
+    logger = logging.getLogger('BuildMachine')
+    docker_client = docker.from_env(version="auto")
+    filters = {'label': [f'{key}={value}' for key, value in labels.items()]}
+    killed_containers = []
+    for container in docker_client.containers.list(filters=filters):
+        logger.info(f'Killing container: {container.id}')
+        try:
+            container.kill()
+        except docker.errors.APIError:
+            # Container ended meanwhile.
+            continue
+        killed_containers.append(container.id)
+    return killed_containers
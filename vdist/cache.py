@@ -0,0 +1,274 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Dict, List, Optional, Union
+
+import vdist.defaults as defaults
+
+ENTRY_METADATA_FILE = 'entry.json'
+ENTRY_COMPLETE_MARKER = 'complete'
+ENTRY_TREE = 'tree'
+STAGING_SUFFIX = '.tmp.'
+# Staging folders older than this are regarded as leftovers of aborted builds.
+STALE_STAGING_AGE = 24 * 60 * 60
+
+
+def python_cache_key(image_id: str, python_version: str,
+                     build_recipe: str, configure_flags: str='') -> str:
+    # Most configure flags are hardcoded in profile templates, so
+    # build_recipe is expected to be a digest of the template that compiles
+    # the interpreter. configure_flags are those a build adds.
+    # Interpreters are compiled at a neutral prefix and relocated later, so
+    # where apps want them does not matter.
+    material = json.dumps([image_id, python_version, build_recipe,
+                           configure_flags])
+    return hashlib.sha256(material.encode("utf8")).hexdigest()
+
+
+def get_folder_size(path: str) -> int:
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                # File removed while we were walking. Not our problem.
+                pass
+    return size
+
+
+class CacheEntry(object):
+
+    def __init__(self, path: str):
+        self.path = path
+        self.key = os.path.basename(path)
+
+    @property
+    def complete(self) -> bool:
+        return os.path.isfile(os.path.join(self.path, ENTRY_COMPLETE_MARKER))
+
+    @property
+    def last_used(self) -> float:
+        # Build scripts touch complete marker every time they restore an
+        # entry, so its modification time is our LRU clock.
+        marker = os.path.join(self.path, ENTRY_COMPLETE_MARKER)
+        if os.path.isfile(marker):
+            return os.path.getmtime(marker)
+        return os.path.getmtime(self.path)
+
+    @property
+    def size(self) -> int:
+        return get_folder_size(self.path)
+
+    @property
+    def metadata(self) -> dict:
+        try:
+            with open(os.path.join(self.path, ENTRY_METADATA_FILE)) as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return {}
+
+    def touch(self) -> None:
+        os.utime(os.path.join(self.path, ENTRY_COMPLETE_MARKER))
+
+    def __str__(self):
+        return str(self.__dict__)
+
+
+class Cache(object):
+    """ Content addressed folder store with size based LRU eviction.
+
+    Every entry is a subfolder named after its key. An entry is only valid
+    once its complete marker exists, so writers are expected to populate a
+    staging folder and rename it to its final key.
+    """
+
+    def __init__(self, root: str, max_size: int=defaults.CACHE_MAX_SIZE):
+        self.root = root
+        self.max_size = max_size
+
+    def create(self) -> None:
+        os.makedirs(self.root, exist_ok=True)
+
+    def entries(self) -> List[CacheEntry]:
+        if not os.path.isdir(self.root):
+            return []
+        entries = [CacheEntry(os.path.join(self.root, name))
+                   for name in os.listdir(self.root)
+                   if STAGING_SUFFIX not in name and
+                   os.path.isdir(os.path.join(self.root, name))]
+        return [entry for entry in entries if entry.complete]
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        entry = CacheEntry(os.path.join(self.root, key))
+        return entry if entry.complete else None
+
+    def size(self) -> int:
+        return sum(entry.size for entry in self.entries())
+
+    def store(self, key: str, files: List[str],
+              metadata: dict=None) -> CacheEntry:
+        """ Store copies of given files as a new entry.
+
+        :param key: Entry key.
+        :param files: Paths of files to store in entry tree.
+        :param metadata: Any JSON serializable data to keep along.
+        :return: Stored entry.
+        """
+        self.create()
+        entry_path = os.path.join(self.root, key)
+        staging_path = "".join([entry_path, STAGING_SUFFIX, str(os.getpid())])
+        shutil.rmtree(staging_path, ignore_errors=True)
+        os.makedirs(os.path.join(staging_path, ENTRY_TREE))
+        for file in files:
+            shutil.copy2(file, os.path.join(staging_path, ENTRY_TREE))
+        with open(os.path.join(staging_path, ENTRY_METADATA_FILE), 'w') as f:
+            f.write(json.dumps(metadata or {}))
+        open(os.path.join(staging_path, ENTRY_COMPLETE_MARKER), 'w').close()
+        try:
+            os.rename(staging_path, entry_path)
+        except OSError:
+            # Another process stored this entry meanwhile. Keep theirs.
+            shutil.rmtree(staging_path, ignore_errors=True)
+        return CacheEntry(entry_path)
+
+    def remove(self, key: str) -> None:
+        shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+
+    def clear(self) -> List[CacheEntry]:
+        return self.prune(max_size=0)
+
+    def prune(self, max_size: int=None) -> List[CacheEntry]:
+        """ Evict least recently used entries until cache fits in max_size.
+
+        :param max_size: Size limit in bytes. Defaults to cache max_size.
+        :return: Evicted entries.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        self._remove_stale_staging_folders()
+        entries = sorted(self.entries(), key=lambda entry: entry.last_used)
+        sizes = {entry.key: entry.size for entry in entries}
+        total_size = sum(sizes.values())
+        evicted = []
+        for entry in entries:
+            if total_size <= max_size:
+                break
+            self.remove(entry.key)
+            total_size -= sizes[entry.key]
+            evicted.append(entry)
+        return evicted
+
+    def _remove_stale_staging_folders(self) -> None:
+        if not os.path.isdir(self.root):
+            return
+        now = time.time()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if STAGING_SUFFIX in name and \
+                    now - os.path.getmtime(path) > STALE_STAGING_AGE:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+class WheelhouseEntry(object):
+
+    def __init__(self, key: str, size: int, last_used: float,
+                 metadata: dict=None):
+        self.key = key
+        self.size = size
+        self.last_used = last_used
+        self.metadata = metadata or {}
+
+    def __str__(self):
+        return str(self.__dict__)
+
+
+class Wheelhouse(object):
+    """ Wheels built by build scripts, in a folder per profile and Python
+    ABI.
+
+    Build scripts don't leave any trace when they reuse a wheel, so eviction
+    removes oldest wheels first rather than least recently used ones.
+    """
+
+    def __init__(self, root: str, max_size: int=defaults.CACHE_MAX_SIZE):
+        self.root = root
+        self.max_size = max_size
+
+    def create(self) -> None:
+        os.makedirs(self.root, exist_ok=True)
+
+    def _wheels(self) -> Dict[str, List[WheelhouseEntry]]:
+        wheels = {}
+        if not os.path.isdir(self.root):
+            return wheels
+        for profile in sorted(os.listdir(self.root)):
+            profile_path = os.path.join(self.root, profile)
+            if not os.path.isdir(profile_path):
+                continue
+            for abi in sorted(os.listdir(profile_path)):
+                abi_path = os.path.join(profile_path, abi)
+                if not os.path.isdir(abi_path):
+                    continue
+                folder_wheels = wheels.setdefault("/".join([profile, abi]), [])
+                for wheel in os.listdir(abi_path):
+                    if not wheel.endswith(".whl"):
+                        continue
+                    stat = os.stat(os.path.join(abi_path, wheel))
+                    folder_wheels.append(WheelhouseEntry(
+                        "/".join([profile, abi, wheel]), stat.st_size,
+                        stat.st_mtime))
+        return wheels
+
+    def entries(self) -> List[WheelhouseEntry]:
+        entries = []
+        for folder, wheels in self._wheels().items():
+            profile, abi = folder.split("/")
+            entries.append(WheelhouseEntry(
+                folder,
+                sum(wheel.size for wheel in wheels),
+                max([wheel.last_used for wheel in wheels], default=0),
+                {"profile": profile, "abi": abi, "wheels": len(wheels)}))
+        return entries
+
+    def size(self) -> int:
+        return sum(entry.size for entry in self.entries())
+
+    def prune(self, max_size: int=None) -> List[WheelhouseEntry]:
+        if max_size is None:
+            max_size = self.max_size
+        wheels = sorted((wheel for folder_wheels in self._wheels().values()
+                         for wheel in folder_wheels),
+                        key=lambda wheel: wheel.last_used)
+        total_size = sum(wheel.size for wheel in wheels)
+        evicted = []
+        for wheel in wheels:
+            if total_size <= max_size:
+                break
+            os.remove(os.path.join(self.root, wheel.key))
+            total_size -= wheel.size
+            evicted.append(wheel)
+        return evicted
+
+    def clear(self) -> List[WheelhouseEntry]:
+        return self.prune(max_size=0)
+
+
+def get_python_cache() -> Cache:
+    return Cache(defaults.PYTHON_CACHE_DIR, defaults.PYTHON_CACHE_MAX_SIZE)
+
+
+def get_artifact_store() -> Cache:
+    return Cache(defaults.ARTIFACT_STORE_DIR, defaults.ARTIFACT_STORE_MAX_SIZE)
+
+
+def get_wheelhouse() -> Wheelhouse:
+    return Wheelhouse(defaults.WHEELHOUSE_DIR, defaults.WHEELHOUSE_MAX_SIZE)
+
+
+def get_caches() -> Dict[str, Union[Cache, Wheelhouse]]:
+    return {"python": get_python_cache(),
+            "wheels": get_wheelhouse(),
+            "artifacts": get_artifact_store()}
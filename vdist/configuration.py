@@ -5,15 +5,19 @@ import vdist.defaults as defaults
 import vdist.source as source
 
 LISTABLE_ARGUMENTS = {"source_git", "source_git_directory", "runtime_deps",
-                      "build_deps"}
-LONG_TEXT_ARGUMENTS = {"fpm_args", "pip_args"}
+                      "build_deps", "source_ignore", "package_formats"}
+LONG_TEXT_ARGUMENTS = {"fpm_args", "pip_args", "configure_args"}
+BOOLEAN_ARGUMENTS = {"use_ccache", "shared_runtime"}
 PROCESSABLE_ARGUMENTS = {"source_directory", "compile_python",
                          "fpm_args"}
 SCRIPTS_ARGUMENTS = {"after_install", "before_install", "after_remove",
                      "before_remove", "after_upgrade", "before_upgrade"}
-USELESS_ARGUMENTS = {"mode", "name", "output_folder", "output_script"}
+USELESS_ARGUMENTS = {"mode", "name", "output_folder", "output_script",
+                     "force", "fail_fast", "log_dir", "engine",
+                     "build_timeout", "executor", "repository_dir"}
 PROCESSABLE_ARGUMENTS |= LISTABLE_ARGUMENTS
 PROCESSABLE_ARGUMENTS |= LONG_TEXT_ARGUMENTS
+PROCESSABLE_ARGUMENTS |= BOOLEAN_ARGUMENTS
 
 
 class Configuration(object):
@@ -29,6 +33,11 @@ class Configuration(object):
         self.output_script = arguments.get("output_script",
                                            defaults.OUTPUT_SCRIPT)
         self.name = arguments.get("name", defaults.BUILD_NAME)
+        self.log_dir = arguments.get("log_dir", defaults.LOG_DIR)
+        # None lets build profile choose.
+        self.executor = arguments.get("executor")
+        # Packages are only added to a repository if one is given.
+        self.repository_dir = arguments.get("repository_dir")
         self.builder_parameters = {key: value for key, value in arguments.items()
                                    if key not in PROCESSABLE_ARGUMENTS and
                                    key not in USELESS_ARGUMENTS}
@@ -36,6 +45,7 @@ class Configuration(object):
         self._process_long_text_arguments(arguments)
         self._process_source_directory_argument(arguments)
         self._process_compile_python_argument(arguments)
+        self._process_boolean_arguments(arguments)
 
     def _process_source_directory_argument(self, arguments):
         if "source_directory" in arguments.keys():
@@ -48,6 +58,20 @@ class Configuration(object):
             self.builder_parameters["compile_python"] = bool(
                 arguments["compile_python"])
 
+    def _process_boolean_arguments(self, arguments):
+        boolean_arguments_found = BOOLEAN_ARGUMENTS.intersection(
+            arguments.keys())
+        for argument in boolean_arguments_found:
+            value = arguments[argument]
+            if isinstance(value, str):
+                # Same values configparser takes for booleans.
+                try:
+                    value = configparser.ConfigParser.BOOLEAN_STATES[
+                        value.strip().lower()]
+                except KeyError:
+                    raise ValueError(f"{argument} is not a boolean: {value}")
+            self.builder_parameters[argument] = value
+
     def _process_listable_arguments(self, arguments):
         argument_keys = set(arguments.keys())
         listable_arguments_found = LISTABLE_ARGUMENTS.intersection(argument_keys)
@@ -61,7 +85,8 @@ class Configuration(object):
                 self.builder_parameters["source"] = source.git_directory(
                     generated_list[0],
                     generated_list[1])
-            if argument in ["runtime_deps", "build_deps"]:
+            if argument in ["runtime_deps", "build_deps", "source_ignore",
+                            "package_formats"]:
                 self.builder_parameters[argument] = generated_list
 
     def _process_long_text_arguments(self, arguments):
@@ -2,6 +2,9 @@ import argparse
 import os.path
 from typing import Dict
 
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3,
+              "T": 1024 ** 4}
+
 
 def _check_is_file(_string: str) -> str:
     if os.path.isfile(_string):
@@ -11,6 +14,18 @@ def _check_is_file(_string: str) -> str:
                                          "not exists.".format(_string))
 
 
+def _check_is_size(_string: str) -> int:
+    # Accepts sizes like 512M or 10G and returns them in bytes.
+    number, unit = _string[:-1], _string[-1:].upper()
+    if unit.isdigit():
+        number, unit = _string, ""
+    try:
+        return int(float(number) * SIZE_UNITS[unit])
+    except (KeyError, ValueError):
+        raise argparse.ArgumentTypeError("{0} is not a valid "
+                                         "size.".format(_string))
+
+
 # TODO: Some defaults are redundant with defaults at object creation. Fix it.
 def parse_arguments(args: list=None) -> Dict[str, str]:
     arg_parser = argparse.ArgumentParser(description="A tool that lets you "
@@ -45,6 +60,92 @@ def parse_arguments(args: list=None) -> Dict[str, str]:
                                      action="store_const",
                                      const=True,
                                      default=False)
+    automatic_subparser.add_argument("--force",
+                                     required=False,
+                                     help="Build packages even if their "
+                                          "inputs did not change since they "
+                                          "were last built.",
+                                     action="store_const",
+                                     const=True,
+                                     default=False)
+    automatic_subparser.add_argument("--fail_fast",
+                                     required=False,
+                                     help="Cancel remaining builds as soon as "
+                                          "one of them fails.",
+                                     action="store_const",
+                                     const=True,
+                                     default=False)
+    automatic_subparser.add_argument("--log_dir",
+                                     required=False,
+                                     help="Folder where compressed build logs "
+                                          "are written. (Defaults to "
+                                          "~/.vdist/logs)",
+                                     metavar="LOG_DIR")
+    automatic_subparser.add_argument("--executor",
+                                     required=False,
+                                     choices=["docker", "podman", "local"],
+                                     help="Run build scripts in docker or "
+                                          "podman containers, or as host "
+                                          "processes, whatever build "
+                                          "profiles say.",
+                                     metavar="EXECUTOR")
+    automatic_subparser.add_argument("--repository_dir",
+                                     required=False,
+                                     help="Folder of a local repository to "
+                                          "add generated packages to, along "
+                                          "with their apt, yum or pacman "
+                                          "indexes.",
+                                     metavar="REPOSITORY_DIR")
+    automatic_subparser.add_argument("--engine",
+                                     required=False,
+                                     choices=["process", "asyncio"],
+                                     help="How builds are run: 'process' "
+                                          "runs every build in a process of "
+                                          "its own, 'asyncio' drives every "
+                                          "build machine from this process "
+                                          "(it falls back to 'process' if "
+                                          "docker TLS, ssh hosts or registry "
+                                          "credentials are set). (Defaults "
+                                          "to 'process')",
+                                     metavar="ENGINE")
+    automatic_subparser.add_argument("--build_timeout",
+                                     required=False,
+                                     type=float,
+                                     help="Seconds a build script may run "
+                                          "before being killed. Docker "
+                                          "builds need 'asyncio' engine for "
+                                          "it. (Defaults to no timeout)",
+                                     metavar="SECONDS")
+    automatic_subparser.add_argument("--pool_size",
+                                     required=False,
+                                     type=int,
+                                     help="Maximum number of reusable build "
+                                          "machines started per docker image. "
+                                          "0 disables machine pooling. "
+                                          "(Defaults to 4)",
+                                     metavar="POOL_SIZE")
+    automatic_subparser.add_argument("--max_cpus",
+                                     required=False,
+                                     type=float,
+                                     help="CPUs concurrent builds can use "
+                                          "altogether. (Defaults to every "
+                                          "host CPU)",
+                                     metavar="MAX_CPUS")
+    automatic_subparser.add_argument("--max_memory",
+                                     required=False,
+                                     type=_check_is_size,
+                                     help="Memory concurrent builds can use "
+                                          "altogether. Accepts K, M, G and T "
+                                          "suffixes. (Defaults to 80%% of host "
+                                          "memory)",
+                                     metavar="MAX_MEMORY")
+    automatic_subparser.add_argument("--max_compiles",
+                                     required=False,
+                                     type=int,
+                                     help="Maximum number of concurrent builds "
+                                          "compiling Python. (Defaults to host "
+                                          "CPUs / 4)",
+                                     metavar="MAX_COMPILES")
     manual_subparser = subparsers.add_parser("manual",
                                              help="Manual configuration. "
                                                   "Parameters are going to be "
@@ -136,12 +237,80 @@ def parse_arguments(args: list=None) -> Dict[str, str]:
                                   required=False,
                                   help="Python version to package.",
                                   metavar="PYTHON_VERSION")
+    manual_subparser.add_argument("--python_optimization",
+                                  required=False,
+                                  choices=["none", "lto", "pgo+lto"],
+                                  help="How compiled Python is optimized. "
+                                       "(Defaults to 'none')",
+                                  metavar="PYTHON_OPTIMIZATION")
+    manual_subparser.add_argument("--configure_args",
+                                  required=False,
+                                  help="Extra arguments for Python configure "
+                                       "script.",
+                                  metavar="CONFIGURE_ARGS")
     manual_subparser.add_argument("-t", "--requirements_path",
                                   required=False,
                                   help="Path to your pip requirements file, "
                                        "relative to your project root. "
                                        "(Defaults to */requirements.txt*).",
                                   metavar="REQUIREMENTS_PATH")
+    manual_subparser.add_argument("--compile_jobs",
+                                  required=False,
+                                  help="Parallel jobs compiling Python. "
+                                       "(Defaults to build machine CPU "
+                                       "quota)",
+                                  metavar="JOBS")
+    manual_subparser.add_argument("--no_ccache",
+                                  required=False,
+                                  dest="use_ccache",
+                                  help="Compile Python without reusing "
+                                       "objects compiled by former builds.",
+                                  action="store_const",
+                                  const="False",
+                                  default=None)
+    manual_subparser.add_argument("--shared_runtime",
+                                  required=False,
+                                  help="Ship compiled Python as a runtime "
+                                       "package of its own, which app "
+                                       "package depends on, holding just a "
+                                       "virtual environment on it.",
+                                  action="store_const",
+                                  const="True",
+                                  default=None)
+    manual_subparser.add_argument("--prune",
+                                  required=False,
+                                  choices=["none", "standard", "aggressive"],
+                                  help="What is left out of packaged Python "
+                                       "tree before stripping binaries and "
+                                       "hardlinking identical files. "
+                                       "(Defaults to 'none')",
+                                  metavar="PRUNE")
+    manual_subparser.add_argument("--scratch_population",
+                                  required=False,
+                                  choices=["auto", "reflink", "hardlink",
+                                           "copy", "bind"],
+                                  help="How local sources are placed in "
+                                       "build folder. 'auto' tries reflinks, "
+                                       "then hardlinks and falls back to "
+                                       "copy. 'bind' mounts sources "
+                                       "read-only instead. (Defaults to "
+                                       "'auto')",
+                                  metavar="SCRATCH_POPULATION")
+    manual_subparser.add_argument("--source_ignore",
+                                  required=False,
+                                  nargs="*",
+                                  help="Patterns of local source files left "
+                                       "out of build. (Defaults to .git, "
+                                       "node_modules, .tox and __pycache__)",
+                                  metavar="SOURCE_IGNORE")
+    manual_subparser.add_argument("--package_formats",
+                                  required=False,
+                                  nargs="*",
+                                  help="Package formats to build from a "
+                                       "single build environment, like deb, "
+                                       "rpm, pacman or tar. (Defaults to "
+                                       "profile format)",
+                                  metavar="PACKAGE_FORMAT")
     manual_subparser.add_argument("-o", "--output_folder",
                                   required=False,
                                   help="Folder where generated packages should "
@@ -153,6 +322,32 @@ def parse_arguments(args: list=None) -> Dict[str, str]:
                                   action="store_const",
                                   const=True,
                                   default=False)
+    manual_subparser.add_argument("--log_dir",
+                                  required=False,
+                                  help="Folder where compressed build log is "
+                                       "written. (Defaults to ~/.vdist/logs)",
+                                  metavar="LOG_DIR")
+    manual_subparser.add_argument("--executor",
+                                  required=False,
+                                  choices=["docker", "podman", "local"],
+                                  help="Run build script in a docker or "
+                                       "podman container, or as a host "
+                                       "process, whatever build profile "
+                                       "says.",
+                                  metavar="EXECUTOR")
+    manual_subparser.add_argument("--repository_dir",
+                                  required=False,
+                                  help="Folder of a local repository to add "
+                                       "generated packages to, along with "
+                                       "their apt, yum or pacman indexes.",
+                                  metavar="REPOSITORY_DIR")
+    manual_subparser.add_argument("--force",
+                                  required=False,
+                                  help="Build package even if its inputs did "
+                                       "not change since it was last built.",
+                                  action="store_const",
+                                  const=True,
+                                  default=False)
 
     # WARNING: Keep package scripts arguments names similar to fpm arguments for
     # scripts. Arguments names from here are directly used as fpm arguments
@@ -187,6 +382,58 @@ def parse_arguments(args: list=None) -> Dict[str, str]:
                                   help="A script to be run before package "
                                        "upgrade",
                                   metavar="BEFORE_UPGRADE_SCRIPT")
+    cache_subparser = subparsers.add_parser("cache",
+                                            help="Manage compiled Python "
+                                                 "interpreters and built "
+                                                 "artifacts caches.")
+    cache_subparser.add_argument("cache_action",
+                                 choices=["list", "prune"],
+                                 help="List cache entries or evict least "
+                                      "recently used ones.")
+    cache_subparser.add_argument("--max_size",
+                                 required=False,
+                                 type=_check_is_size,
+                                 help="Size cache should be pruned to. "
+                                      "Accepts K, M, G and T suffixes. "
+                                      "(Defaults to 10G)",
+                                 metavar="MAX_SIZE")
+    cache_subparser.add_argument("--all",
+                                 required=False,
+                                 help="Remove every cache entry.",
+                                 action="store_const",
+                                 const=True,
+                                 default=False)
+    images_subparser = subparsers.add_parser("images",
+                                             help="Manage base images with "
+                                                  "Python already compiled.")
+    images_subparser.add_argument("images_action",
+                                  choices=["bake", "list"],
+                                  help="Bake base images or list baked "
+                                       "ones.")
+    images_subparser.add_argument("configuration_file",
+                                  nargs="?",
+                                  default=None,
+                                  type=_check_is_file,
+                                  help="Bake base images for every build of "
+                                       "this configuration file that "
+                                       "compiles Python.",
+                                  metavar="CONFIGURATION FILENAME")
+    images_subparser.add_argument("-p", "--profile",
+                                  required=False,
+                                  help="Build profile to bake base image for.",
+                                  metavar="PROFILE")
+    images_subparser.add_argument("-V", "--python_version",
+                                  required=False,
+                                  help="Python version to compile into base "
+                                       "image.",
+                                  metavar="PYTHON_VERSION")
+    images_subparser.add_argument("--force",
+                                  required=False,
+                                  help="Bake base images even if they already "
+                                       "exist.",
+                                  action="store_const",
+                                  const=True,
+                                  default=False)
     parsed_arguments = vars(arg_parser.parse_args(args))
     filtered_parser_arguments = {key: value for key, value in parsed_arguments.items()
                                  if value is not None}
@@ -2,15 +2,67 @@ import os
 
 PYTHON_BASEDIR = '/opt'
 PYTHON_VERSION = '3.7.5'
+# Where Python is compiled before being relocated to every app python_basedir.
+PYTHON_BUILD_PREFIX = '/opt/vdist_python'
+# Shared runtime packages are named after this, Python version and profile.
+RUNTIME_PACKAGE_PREFIX = 'vdist-python'
+PRUNE = 'none'
+PYTHON_OPTIMIZATION = 'none'
 LOCAL_PROFILES_DIR = 'buildprofiles'
 LOCAL_PROFILES_FILE = 'profiles.json'
 VDIST_USERDIR = os.path.join(os.path.expanduser('~'), '.vdist')
 BUILD_BASEDIR = "/tmp/vdist"
 SCRATCH_BUILDSCRIPT_NAME = 'buildscript.sh'
 SCRATCH_DIR = 'scratch'
+SCRATCH_POPULATION = 'auto'
+SOURCE_IGNORE = ['.git', 'node_modules', '.tox', '__pycache__']
 SHARED_DIR = '/work'
 PACKAGE_INSTALL_ROOT = PYTHON_BASEDIR
 PACKAGE_TMP_ROOT = '/tmp'
 OUTPUT_FOLDER = "./"
 OUTPUT_SCRIPT = False
+MANIFEST_FILENAME = "vdist_manifest.json"
 BUILD_NAME = "Default project"
+CACHE_DIR = os.path.join(VDIST_USERDIR, 'cache')
+CACHE_MAX_SIZE = 10 * 1024 ** 3
+TEMPLATE_CACHE_DIR = os.path.join(CACHE_DIR, 'templates')
+RENDER_CACHE_SIZE = 256
+CONTAINER_CACHE_DIR = '/vdist_cache'
+PYTHON_CACHE_DIR = os.path.join(CACHE_DIR, 'python')
+PYTHON_CACHE_MAX_SIZE = CACHE_MAX_SIZE
+CONTAINER_PYTHON_CACHE_DIR = '/'.join([CONTAINER_CACHE_DIR, 'python'])
+MACHINE_POOL_SIZE = 4
+CONTAINER_POOL_DIR = '/vdist_pool'
+BUILD_TIMES_FILE = os.path.join(VDIST_USERDIR, 'build_times.json')
+COMPILE_JOB_CPUS = 4
+COMPILE_JOB_MEMORY = 2 * 1024 ** 3
+COMPILE_JOB_DURATION = 600
+PACKAGING_JOB_CPUS = 1
+PACKAGING_JOB_MEMORY = 1024 ** 3
+PACKAGING_JOB_DURATION = 120
+HOST_MEMORY_SHARE = 0.8
+ARTIFACT_STORE_DIR = os.path.join(CACHE_DIR, 'artifacts')
+ARTIFACT_STORE_MAX_SIZE = CACHE_MAX_SIZE
+WHEELHOUSE_DIR = os.path.join(CACHE_DIR, 'wheels')
+WHEELHOUSE_MAX_SIZE = CACHE_MAX_SIZE
+CONTAINER_WHEELHOUSE_DIR = '/'.join([CONTAINER_CACHE_DIR, 'wheels'])
+CCACHE_DIR = os.path.join(CACHE_DIR, 'ccache')
+# In ccache size format, per profile.
+CCACHE_MAX_SIZE = '2G'
+CONTAINER_CCACHE_DIR = '/'.join([CONTAINER_CACHE_DIR, 'ccache'])
+GIT_MIRROR_DIR = os.path.join(CACHE_DIR, 'git')
+BATCH_LABEL = 'vdist.batch'
+BASE_IMAGE_REPOSITORY = 'vdist-base'
+LOG_DIR = os.path.join(VDIST_USERDIR, 'logs')
+LOG_SUMMARY_INTERVAL = 10
+LOG_TAIL_LINES = 20
+BATCH_REPORT_FILENAME = 'vdist_report.json'
+BUILD_ENGINE = 'process'
+BUILD_ENGINES = ['process', 'asyncio']
+DOCKER_HOST = 'unix:///var/run/docker.sock'
+DOCKER_API_VERSION = '1.25'
+ENGINE_MAX_CONNECTIONS = 10
+CONTAINER_STOP_TIMEOUT = 10
+PODMAN_COMMAND = 'podman'
+PODMAN_LOCK_DIR = os.path.join(CACHE_DIR, 'podman')
+LOCAL_MACHINE_DIR = os.path.join(VDIST_USERDIR, 'machines')
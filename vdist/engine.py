@@ -0,0 +1,570 @@
+import asyncio
+import concurrent.futures as futures
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import urllib.parse
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import vdist.buildlog as buildlog
+import vdist.defaults as defaults
+import vdist.leftovers as leftovers
+import vdist.report as report
+import vdist.scheduler as scheduler
+import vdist.watchdog as watchdog
+
+CPU_PERIOD = 100000
+# Header of every frame of a multiplexed stream: stream type, three padding
+# bytes and frame size.
+FRAME_HEADER = struct.Struct('>BxxxL')
+
+
+# Docker hosts DockerAPI can connect to.
+DOCKER_HOST_SCHEMES = ['unix', 'tcp', 'http']
+
+
+def _has_registry_credentials() -> bool:
+    config_dir = os.environ.get('DOCKER_CONFIG',
+                                os.path.join(os.path.expanduser('~'), '.docker'))
+    try:
+        with open(os.path.join(config_dir, 'config.json')) as config_file:
+            config = json.load(config_file)
+    except (OSError, ValueError):
+        return False
+    return any(config.get(key) for key in ('auths', 'credsStore',
+                                           'credHelpers'))
+
+
+def get_unsupported_setup() -> Optional[str]:
+    """ Tell why docker daemon set for this host can't be used through
+    DockerAPI.
+
+    :return: Reason, or None if DockerAPI can be used.
+    """
+    docker_host = os.environ.get('DOCKER_HOST', defaults.DOCKER_HOST)
+    if urllib.parse.urlparse(docker_host).scheme not in DOCKER_HOST_SCHEMES:
+        return f'docker host {docker_host} is not supported'
+    if os.environ.get('DOCKER_TLS_VERIFY') or os.environ.get('DOCKER_CERT_PATH'):
+        return 'TLS connections to docker daemon are not supported'
+    if _has_registry_credentials():
+        # Images needing them could not be pulled.
+        return 'docker registry credentials are not supported'
+    return None
+
+
+class DockerAPIError(Exception):
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f'Docker API error {status}: {message}')
+        self.status = status
+
+
+BuildTimeoutException = watchdog.BuildTimeoutException
+
+
+class DockerAPI(object):
+    """ Minimal asyncio client of Docker Engine API.
+
+    Short requests share a pool of keep-alive connections. Output streams are
+    hijacked by docker daemon until they end, so each one gets a connection of
+    its own.
+    """
+
+    def __init__(self, base_url: str=None,
+                 max_connections: int=defaults.ENGINE_MAX_CONNECTIONS,
+                 api_version: str=defaults.DOCKER_API_VERSION):
+        self.logger = logging.getLogger('DockerAPI')
+        self.base_url = base_url or os.environ.get('DOCKER_HOST',
+                                                   defaults.DOCKER_HOST)
+        self.api_version = api_version
+        self.max_connections = max_connections
+        self._idle_connections = []
+        self._connection_slots = None
+
+    async def _connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        url = urllib.parse.urlparse(self.base_url)
+        if url.scheme == 'unix':
+            return await asyncio.open_unix_connection(url.path)
+        if url.scheme in ('tcp', 'http'):
+            return await asyncio.open_connection(url.hostname, url.port or 2375)
+        raise ValueError(f'unsupported docker host: {self.base_url}')
+
+    def _get_connection_slots(self) -> asyncio.Semaphore:
+        # Created lazily, so it belongs to the loop this client is used from.
+        if self._connection_slots is None:
+            self._connection_slots = asyncio.Semaphore(self.max_connections)
+        return self._connection_slots
+
+    def _get_request_text(self, method: str, path: str,
+                          params: Dict[str, Any]=None,
+                          body: Any=None) -> bytes:
+        target = f'/v{self.api_version}{path}'
+        if params:
+            target = f'{target}?{urllib.parse.urlencode(params)}'
+        payload = b'' if body is None else json.dumps(body).encode('utf8')
+        headers = [f'{method} {target} HTTP/1.1',
+                   'Host: docker',
+                   f'Content-Length: {len(payload)}']
+        if body is not None:
+            headers.append('Content-Type: application/json')
+        return ('\r\n'.join(headers) + '\r\n\r\n').encode('utf8') + payload
+
+    @staticmethod
+    async def _read_response_head(reader: asyncio.StreamReader) -> Tuple[int, Dict[str, str]]:
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('docker daemon closed connection')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return status, headers
+
+    @staticmethod
+    async def _iter_body(reader: asyncio.StreamReader, status: int,
+                         headers: Dict[str, str]) -> AsyncIterator[bytes]:
+        if status in (204, 304):
+            return
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    return
+                yield await reader.readexactly(size)
+                await reader.readline()
+        elif 'content-length' in headers:
+            length = int(headers['content-length'])
+            if length:
+                yield await reader.readexactly(length)
+        else:
+            # Hijacked streams last until daemon closes connection.
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    return
+                yield chunk
+
+    async def _exchange(self, reader: asyncio.StreamReader,
+                        writer: asyncio.StreamWriter,
+                        request_text: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        writer.write(request_text)
+        await writer.drain()
+        status, headers = await self._read_response_head(reader)
+        content = b''.join([chunk async for chunk in
+                            self._iter_body(reader, status, headers)])
+        return status, headers, content
+
+    async def request(self, method: str, path: str,
+                      params: Dict[str, Any]=None,
+                      body: Any=None) -> Any:
+        """ Send a request through a pooled connection.
+
+        :param method: HTTP method.
+        :param path: API path, without version prefix.
+        :param params: Query string parameters.
+        :param body: Object to send as JSON body.
+        :return: Decoded JSON response, or None if response is empty.
+        """
+        request_text = self._get_request_text(method, path, params, body)
+        async with self._get_connection_slots():
+            reused = bool(self._idle_connections)
+            reader, writer = self._idle_connections.pop() if reused \
+                else await self._connect()
+            try:
+                status, headers, content = await self._exchange(
+                    reader, writer, request_text)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if not reused:
+                    raise
+                # Daemon may close idle connections whenever it likes.
+                reader, writer = await self._connect()
+                try:
+                    status, headers, content = await self._exchange(
+                        reader, writer, request_text)
+                except BaseException:
+                    writer.close()
+                    raise
+            except BaseException:
+                writer.close()
+                raise
+            if headers.get('connection', '').lower() == 'close' or \
+                    ('content-length' not in headers and
+                     'transfer-encoding' not in headers and
+                     status not in (204, 304)):
+                writer.close()
+            else:
+                self._idle_connections.append((reader, writer))
+        if status >= 400:
+            raise DockerAPIError(status, _get_error_message(content))
+        return json.loads(content.decode('utf8')) if content else None
+
+    async def stream(self, method: str, path: str,
+                     params: Dict[str, Any]=None,
+                     body: Any=None) -> AsyncIterator[bytes]:
+        """ Send a request through a connection of its own and yield response
+        body as it arrives. """
+        reader, writer = await self._connect()
+        try:
+            writer.write(self._get_request_text(method, path, params, body))
+            await writer.drain()
+            status, headers = await self._read_response_head(reader)
+            if status >= 400:
+                content = b''.join([chunk async for chunk in
+                                    self._iter_body(reader, status, headers)])
+                raise DockerAPIError(status, _get_error_message(content))
+            async for chunk in self._iter_body(reader, status, headers):
+                yield chunk
+        finally:
+            writer.close()
+
+    def close(self) -> None:
+        for _, writer in self._idle_connections:
+            writer.close()
+        self._idle_connections = []
+
+
+def _get_error_message(content: bytes) -> str:
+    try:
+        return json.loads(content.decode('utf8'))['message']
+    except (ValueError, KeyError, TypeError):
+        return content.decode('utf8', errors='replace')
+
+
+async def _demultiplex(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    # Commands run without tty get their stdout and stderr interleaved in
+    # frames. Build logs want them together, as a terminal would show them.
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= FRAME_HEADER.size:
+            _, size = FRAME_HEADER.unpack_from(buffer)
+            if len(buffer) < FRAME_HEADER.size + size:
+                break
+            yield buffer[FRAME_HEADER.size:FRAME_HEADER.size + size]
+            buffer = buffer[FRAME_HEADER.size + size:]
+
+
+def _split_image_name(image: str) -> Tuple[str, str]:
+    repository, _, tag = image.rpartition(':')
+    if not repository or '/' in tag:
+        return image, 'latest'
+    return repository, tag
+
+
+class AsyncBuildMachine(object):
+    """ Docker container that runs a build script, driven through asyncio. """
+
+    def __init__(self, api: DockerAPI, image: str=None,
+                 resources: scheduler.BuildResources=None,
+                 build_log: buildlog.BuildLog=None,
+                 labels: Dict[str, str]=None):
+        self.logger = logging.getLogger('BuildMachine')
+        self.api = api
+        self.image = image
+        self.resources = resources
+        self.build_log = build_log
+        self.labels = labels or {}
+        self.timings = {}
+        self.container = None
+
+    def _get_resources_limits(self) -> Dict[str, int]:
+        if self.resources is None:
+            return {}
+        return {'CpuPeriod': CPU_PERIOD,
+                'CpuQuota': int(self.resources.cpus * CPU_PERIOD),
+                'Memory': self.resources.memory}
+
+    async def get_image_id(self) -> str:
+        try:
+            image = await self.api.request('GET', f'/images/{self.image}/json')
+        except DockerAPIError as e:
+            if e.status != 404:
+                raise
+            await self._pull_image()
+            image = await self.api.request('GET', f'/images/{self.image}/json')
+        return image['Id']
+
+    async def _pull_image(self) -> None:
+        self.logger.info(f'Pulling image: {self.image}')
+        repository, tag = _split_image_name(self.image)
+        async for chunk in self.api.stream('POST', '/images/create',
+                                           params={'fromImage': repository,
+                                                   'tag': tag}):
+            # Progress is reported as JSON lines, errors among them.
+            for line in chunk.splitlines():
+                try:
+                    message = json.loads(line.decode('utf8'))
+                except ValueError:
+                    continue
+                if 'error' in message:
+                    raise DockerAPIError(500, message['error'])
+
+    async def launch(self, build_dir: str, extra_binds: Dict[str, str]=None,
+                     environment: Dict[str, str]=None,
+                     read_only_binds: Dict[str, str]=None) -> int:
+        binds = {build_dir: defaults.SHARED_DIR}
+        binds.update(extra_binds or {})
+        with report.timed(self.timings, 'container_start'):
+            self.container = await self._start_container(binds,
+                                                         read_only_binds)
+        return await self.run_script(defaults.SHARED_DIR, environment)
+
+    async def _start_container(self, binds: Dict[str, str],
+                               read_only_binds: Dict[str, str]=None) -> str:
+        self.logger.info(f'Starting container: {self.image}')
+        volumes = [f'{host_path}:{container_path}:rw'
+                   for host_path, container_path in binds.items()]
+        volumes.extend(f'{host_path}:{container_path}:ro'
+                       for host_path, container_path
+                       in (read_only_binds or {}).items())
+        container_config = {'Image': self.image, 'Cmd': ['bash'], 'Tty': True,
+                            'OpenStdin': True, 'Labels': self.labels,
+                            'HostConfig': dict(Binds=volumes,
+                                               **self._get_resources_limits())}
+        try:
+            container = await self.api.request('POST', '/containers/create',
+                                               body=container_config)
+        except DockerAPIError as e:
+            if e.status != 404:
+                raise
+            await self._pull_image()
+            container = await self.api.request('POST', '/containers/create',
+                                               body=container_config)
+        # Known from now on, so it is removed even if start is interrupted.
+        self.container = container['Id']
+        await self.api.request('POST', f'/containers/{self.container}/start')
+        return self.container
+
+    async def attach(self, container_id: str) -> None:
+        with report.timed(self.timings, 'container_attach'):
+            self.container = container_id
+            if self.resources is not None:
+                await self.api.request('POST',
+                                       f'/containers/{container_id}/update',
+                                       body=dict(MemorySwap=-1,
+                                                 **self._get_resources_limits()))
+
+    async def reset(self, paths: List[str]) -> None:
+        command = leftovers.get_reset_command(paths)
+        self.logger.info(f'Removing from container: {" ".join(paths)}')
+        with report.timed(self.timings, 'container_reset'):
+            exit_code = await self._run_command(command, log_output=False)
+        if exit_code != 0:
+            raise leftovers.MachineResetException(
+                f'could not reset container {self.container}: '
+                f'exit code {exit_code}')
+
+    async def run_script(self, shared_dir: str,
+                         environment: Dict[str, str]=None) -> int:
+        path_to_command = os.path.join(
+            shared_dir,
+            defaults.SCRATCH_DIR,
+            defaults.SCRATCH_BUILDSCRIPT_NAME
+        )
+        with report.timed(self.timings, 'script'):
+            try:
+                return await self._run_command([path_to_command], environment)
+            except asyncio.CancelledError:
+                # Stopping waiting for output is not enough, script would go
+                # on running.
+                await self.kill()
+                raise
+
+    async def _run_command(self, command: List[str],
+                           environment: Dict[str, str]=None,
+                           log_output: bool=True) -> int:
+        exec_config = {'Cmd': command, 'AttachStdout': True,
+                       'AttachStderr': True, 'Tty': False}
+        if environment:
+            exec_config['Env'] = [f'{key}={value}'
+                                  for key, value in environment.items()]
+        exec_id = (await self.api.request(
+            'POST', f'/containers/{self.container}/exec',
+            body=exec_config))['Id']
+        output = _demultiplex(self.api.stream('POST', f'/exec/{exec_id}/start',
+                                              body={'Detach': False,
+                                                    'Tty': False}))
+        if not log_output:
+            async for _ in output:
+                pass
+        elif self.build_log is not None:
+            async for chunk in output:
+                self.build_log.feed(chunk)
+        else:
+            decoder = buildlog.LineDecoder()
+            async for chunk in output:
+                for line in decoder.feed(chunk):
+                    self.logger.info(line)
+            for line in decoder.flush():
+                self.logger.info(line)
+        exit_code = (await self.api.request('GET',
+                                            f'/exec/{exec_id}/json'))['ExitCode']
+        # Killed containers leave their commands without exit code.
+        return exit_code if exit_code is not None else -1
+
+    async def kill(self) -> None:
+        if self.container is None:
+            return
+        self.logger.info(f'Killing container: {self.container}')
+        try:
+            await self.api.request('POST', f'/containers/{self.container}/kill')
+        except DockerAPIError:
+            # Container ended meanwhile.
+            pass
+
+    async def shutdown(self) -> None:
+        with report.timed(self.timings, 'container_stop'):
+            self.logger.info(f'Stopping container: {self.container}')
+            await self.api.request('POST', f'/containers/{self.container}/stop',
+                                   params={'t': defaults.CONTAINER_STOP_TIMEOUT})
+            self.logger.info(f'Removing container: {self.container}')
+            await self.api.request('DELETE', f'/containers/{self.container}',
+                                   params={'force': 1})
+
+
+class BuildEngine(object):
+    """ Drives build machines of every build from a single asyncio loop.
+
+    Builds keep running their host side steps in their own threads, but all
+    of their containers are handled from a loop thread through one shared
+    Docker API client, so blocking on output streams costs no process.
+    Build scripts can be given a timeout and all of them can be cancelled
+    at once.
+    """
+
+    def __init__(self, api: DockerAPI=None, build_timeout: float=None):
+        self.logger = logging.getLogger('BuildEngine')
+        self.api = api or DockerAPI()
+        self.build_timeout = build_timeout
+        self.cancelled = False
+        self.loop = None
+        self._loop_thread = None
+        # Tasks cancel() should stop. Only touched from engine loop.
+        self._running = set()
+
+    def __enter__(self) -> 'BuildEngine':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def start(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self.loop.run_forever,
+                                             name='BuildEngine', daemon=True)
+        self._loop_thread.start()
+
+    def run(self, coroutine: Any, cancellable: bool=True) -> Any:
+        """ Run a coroutine in engine loop and wait for its result.
+
+        :param coroutine: Coroutine to run.
+        :param cancellable: Whether cancel() should stop it.
+        :return: Whatever coroutine returned.
+        """
+        if cancellable:
+            coroutine = self._run_cancellable(coroutine)
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def _run_cancellable(self, coroutine: Any) -> Any:
+        if self.cancelled:
+            coroutine.close()
+            raise asyncio.CancelledError()
+        # Cancelling this task, and not the future its caller waits for, lets
+        # coroutine clean up before caller goes on.
+        task = asyncio.ensure_future(coroutine)
+        self._running.add(task)
+        try:
+            return await task
+        finally:
+            self._running.discard(task)
+
+    def _cancel_running(self) -> None:
+        for task in self._running:
+            task.cancel()
+
+    def cancel(self) -> None:
+        """ Cancel every running build script and refuse to start new ones.
+        Containers can still be shut down. """
+        self.cancelled = True
+        self.loop.call_soon_threadsafe(self._cancel_running)
+
+    def get_build_machine(self, image: str=None,
+                          resources: scheduler.BuildResources=None,
+                          build_log: buildlog.BuildLog=None,
+                          labels: Dict[str, str]=None) -> 'EngineBuildMachine':
+        return EngineBuildMachine(self, AsyncBuildMachine(
+            self.api, image=image, resources=resources, build_log=build_log,
+            labels=labels))
+
+    async def _close_api(self) -> None:
+        self.api.close()
+
+    def close(self) -> None:
+        if self.loop is None:
+            return
+        self.run(self._close_api(), cancellable=False)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._loop_thread.join()
+        self.loop.close()
+        self.loop = None
+
+
+class EngineBuildMachine(object):
+    """ Blocking facade of an AsyncBuildMachine, with BuildMachine interface,
+    so builders can use any of them. """
+
+    def __init__(self, engine: BuildEngine, machine: AsyncBuildMachine):
+        self.engine = engine
+        self.machine = machine
+        self.timings = machine.timings
+        self.started_at = time.time()
+
+    @property
+    def container(self) -> Optional[str]:
+        return self.machine.container
+
+    def _run_script_coroutine(self, coroutine: Any) -> int:
+        if self.engine.build_timeout is None:
+            return self.engine.run(coroutine)
+        remaining_time = self.engine.build_timeout - \
+            (time.time() - self.started_at)
+        try:
+            return self.engine.run(asyncio.wait_for(coroutine,
+                                                    max(remaining_time, 0)))
+        except (asyncio.TimeoutError, futures.TimeoutError):
+            raise BuildTimeoutException(
+                f'Build script did not end within {self.engine.build_timeout} '
+                f'seconds.')
+
+    def get_image_id(self) -> str:
+        return self.engine.run(self.machine.get_image_id())
+
+    def launch(self, build_dir: str, extra_binds: Dict[str, str]=None,
+               environment: Dict[str, str]=None,
+               read_only_binds: Dict[str, str]=None) -> int:
+        return self._run_script_coroutine(self.machine.launch(
+            build_dir, extra_binds, environment, read_only_binds))
+
+    def attach(self, container_id: str) -> None:
+        self.engine.run(self.machine.attach(container_id))
+
+    def reset(self, paths: List[str]) -> None:
+        self.engine.run(self.machine.reset(paths))
+
+    def run_script(self, shared_dir: str,
+                   environment: Dict[str, str]=None) -> int:
+        return self._run_script_coroutine(
+            self.machine.run_script(shared_dir, environment))
+
+    def shutdown(self) -> None:
+        self.engine.run(self.machine.shutdown(), cancellable=False)
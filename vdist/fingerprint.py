@@ -0,0 +1,103 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+from typing import Dict, List, Optional
+
+logger = logging.getLogger('fingerprint')
+
+COMMIT_ID = re.compile(r'^[0-9a-f]{40}$')
+CHUNK_SIZE = 1024 * 1024
+
+
+def _git(*args: str) -> str:
+    return subprocess.check_output(["git"] + list(args),
+                                   stderr=subprocess.DEVNULL).decode("utf8")
+
+
+def get_file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_directory_digest(path: str, ignore: List[str]=None) -> str:
+    ignore_patterns = shutil.ignore_patterns(*ignore) if ignore else None
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
+        ignored = ignore_patterns(dirpath, dirnames + filenames) \
+            if ignore_patterns else set()
+        # Walk order is filesystem dependent, but digest must not be.
+        dirnames[:] = sorted(dirname for dirname in dirnames
+                             if dirname not in ignored)
+        for filename in sorted(filenames):
+            if filename in ignored:
+                continue
+            file_path = os.path.join(dirpath, filename)
+            digest.update(os.path.relpath(file_path, path).encode("utf8"))
+            if os.path.islink(file_path):
+                digest.update(os.readlink(file_path).encode("utf8"))
+                continue
+            digest.update(get_file_digest(file_path).encode("utf8"))
+    return digest.hexdigest()
+
+
+def get_git_directory_digest(path: str, branch: str,
+                             ignore: List[str]=None) -> str:
+    # Build scripts checkout branch over a copy of the whole working tree,
+    # git ignored files included, so a commit id alone is never enough.
+    digest = hashlib.sha256()
+    try:
+        digest.update(_git("-C", path, "rev-parse", branch).encode("utf8"))
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    # VCS internals change with any git command, even if sources don't.
+    digest.update(get_directory_digest(
+        path, (ignore or []) + ['.git']).encode("utf8"))
+    return digest.hexdigest()
+
+
+def get_git_digest(uri: str, branch: str) -> Optional[str]:
+    if COMMIT_ID.match(branch):
+        return branch
+    try:
+        remote_references = _git("ls-remote", uri, branch).split()
+    except (OSError, subprocess.CalledProcessError):
+        logger.warning(f'Could not reach {uri}, it will be built anyway.')
+        return None
+    # ls-remote returns "<commit> <reference>" pairs.
+    return remote_references[0] if remote_references else None
+
+
+def get_source_digest(source: Dict[str, str],
+                      ignore: List[str]=None) -> Optional[str]:
+    if source['type'] == 'git':
+        if 'commit' in source:
+            return source['commit']
+        return get_git_digest(source['uri'], source['branch'])
+    if source['type'] == 'git_directory':
+        return get_git_directory_digest(source['path'], source['branch'],
+                                        ignore)
+    if source['type'] == 'directory':
+        return get_directory_digest(source['path'], ignore)
+    return None
+
+
+def get_build_fingerprint(build_script: str, source_digest: str,
+                          image_id: str, extra_digests: Dict[str, str]=None) -> str:
+    """ Hash everything a build depends on.
+
+    :param build_script: Rendered build script.
+    :param source_digest: Digest of source tree to package.
+    :param image_id: Id of docker image build is run in.
+    :param extra_digests: Any other input, like local pip configuration.
+    :return: Build fingerprint.
+    """
+    material = json.dumps([build_script, source_digest, image_id,
+                           extra_digests or {}], sort_keys=True)
+    return hashlib.sha256(material.encode("utf8")).hexdigest()
@@ -0,0 +1,142 @@
+import collections
+import logging
+import os
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+import vdist.builder as builder
+import vdist.configuration as configuration
+import vdist.mirror as mirror
+
+logger = logging.getLogger('grouping')
+
+
+class BuildGroup(object):
+    """ Builds of a batch that can share a base image.
+
+    They compile the same Python the same way, so it is compiled once, along
+    with the dependencies all of them need, into a base image every one of
+    them builds on.
+    """
+
+    def __init__(self, key: Tuple, names: List[str],
+                 common_requirements: List[str]):
+        self.key = key
+        self.names = names
+        self.common_requirements = common_requirements
+
+    def __str__(self):
+        return f'{"/".join(str(value) for value in self.key)}: ' \
+               f'{len(self.names)} builds, ' \
+               f'{len(self.common_requirements)} shared requirements'
+
+
+def get_group_key(build: builder.Build, executor: str) -> Optional[Tuple]:
+    """ Tell which builds can share a base image with this one.
+
+    :param build: Build to group.
+    :param executor: Where build script is run.
+    :return: A key only builds compiling the same Python share, or None if
+        build can't use base images.
+    """
+    if not build.compile_python or executor != builder.EXECUTOR_DOCKER:
+        return None
+    key = (build.profile, build.python_version)
+    configure_flags = build.get_python_configure_flags()
+    if configure_flags:
+        key += (configure_flags,)
+    # Base image is baked with pip settings and system packages of one of
+    # its builds, so those must be the same for all of them.
+    if build.pip_args or build.use_local_pip_conf or build.build_deps:
+        key += (build.pip_args, build.use_local_pip_conf,
+                tuple(sorted(build.build_deps)))
+    return key
+
+
+def _get_requirements_path(build: builder.Build) -> str:
+    # Build scripts look for requirements from working_dir, if any.
+    return os.path.normpath(os.path.join(build.working_dir,
+                                         build.requirements_path.lstrip('/')))
+
+
+def _read_source_file(source: Dict[str, str], path: str) -> Optional[str]:
+    try:
+        if source['type'] == 'git':
+            commit = source.get('commit') or source['branch']
+            return mirror.GitMirror(source['uri']).read_file(commit, path)
+        if source['type'] == 'git_directory':
+            return subprocess.check_output(
+                ['git', '-C', source['path'], 'show',
+                 f'{source["branch"]}:{path}'],
+                stderr=subprocess.PIPE).decode('utf8')
+        if source['type'] == 'directory':
+            with open(os.path.join(source['path'], path)) as f:
+                return f.read()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return None
+
+
+def read_requirements(build: builder.Build) -> List[str]:
+    """ Read plain requirements of a build.
+
+    :param build: Build whose requirements file is read.
+    :return: Requirement specifiers, without comments. Options, like nested
+        requirements files or editable installs, are left out, as they may
+        depend on build files.
+    """
+    text = _read_source_file(build.source, _get_requirements_path(build))
+    requirements = []
+    for line in (text or '').splitlines():
+        requirement = line.split(' #')[0].strip()
+        if requirement and not requirement.startswith(('#', '-')) and \
+                requirement not in requirements:
+            requirements.append(requirement)
+    return requirements
+
+
+def _get_common_requirements(requirements: List[List[str]]) -> List[str]:
+    common_requirements = set(requirements[0]).intersection(*requirements[1:])
+    # Kept in file order, as pip reads them.
+    return [requirement for requirement in requirements[0]
+            if requirement in common_requirements]
+
+
+def plan_groups(configurations: Dict[str, configuration.Configuration],
+                profiles: Dict[str, builder.BuildProfile]) -> List[BuildGroup]:
+    """ Group batch builds that can share a base image.
+
+    :param configurations: Batch configurations, by name.
+    :param profiles: Available build profiles.
+    :return: Groups of more than one build, with requirements every build of
+        group has.
+    """
+    names = collections.OrderedDict()
+    builds = {}
+    for name, _configuration in configurations.items():
+        try:
+            build = builder.Build(**_configuration.builder_parameters)
+        except (TypeError, ValueError) as e:
+            # Left to its own build, which will report it.
+            logger.info(f'{name} is not grouped: {e}')
+            continue
+        if build.profile not in profiles:
+            continue
+        executor = _configuration.executor or profiles[build.profile].executor
+        key = get_group_key(build, executor)
+        if key is not None:
+            names.setdefault(key, []).append(name)
+            builds[name] = build
+    groups = []
+    for key, group_names in names.items():
+        if len(group_names) < 2:
+            continue
+        if any(builds[name].shared_runtime for name in group_names):
+            # Base image Python becomes a runtime package, so nothing else
+            # must be installed there.
+            common_requirements = []
+        else:
+            common_requirements = _get_common_requirements(
+                [read_requirements(builds[name]) for name in group_names])
+        groups.append(BuildGroup(key, group_names, common_requirements))
+    return groups
@@ -0,0 +1,43 @@
+import posixpath
+import shlex
+from typing import List
+
+# Folders whose contents a reset never removes, whatever builds ask for.
+PROTECTED_FOLDERS = ['/', '/bin', '/boot', '/dev', '/etc', '/home', '/lib',
+                     '/lib64', '/proc', '/root', '/run', '/sbin', '/sys',
+                     '/usr', '/var']
+
+
+class MachineResetException(Exception):
+    pass
+
+
+def _get_absolute_path(path: str) -> str:
+    # POSIX keeps a leading double slash, but we don't.
+    return posixpath.normpath('/' + path.lstrip('/'))
+
+
+def get_reset_command(paths: List[str]) -> List[str]:
+    """ Get command that removes leftovers of former builds from a reused
+    build machine.
+
+    Only a trailing "*" is expanded by shell, everything else is quoted.
+    Relative paths, paths going up, top level folders and contents of system
+    folders are refused, so a bad package_tmp_root can't wipe the machine.
+
+    :param paths: Absolute paths to remove. They may end with "*".
+    :return: Command to run in build machine.
+    """
+    quoted_paths = []
+    for path in paths:
+        if path.endswith('*'):
+            literal_path, wildcard = path[:-1], '*'
+        else:
+            literal_path, wildcard = path, ''
+        if not path.startswith('/') or '..' in path.split('/') or \
+                _get_absolute_path(path).count('/') < 2 or \
+                (literal_path.endswith('/') and
+                 _get_absolute_path(literal_path) in PROTECTED_FOLDERS):
+            raise ValueError(f'refusing to remove from build machine: {path!r}')
+        quoted_paths.append(shlex.quote(literal_path) + wildcard)
+    return ["bash", "-c", " ".join(["rm", "-rf"] + quoted_paths)]
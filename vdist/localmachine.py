@@ -0,0 +1,202 @@
+import hashlib
+import json
+import logging
+import os
+import platform
+import shlex
+import shutil
+import signal
+import subprocess
+import tempfile
+from typing import Dict, List
+
+import vdist.buildlog as buildlog
+import vdist.defaults as defaults
+import vdist.report as report
+import vdist.scheduler as scheduler
+import vdist.watchdog as watchdog
+
+# Host folders build scripts need to run. They are mounted read-only, so
+# scripts can use host tools but can't alter host.
+SYSTEM_DIRS = ['usr', 'etc', 'bin', 'sbin', 'lib', 'lib32', 'lib64', 'libx32']
+# Folders build scripts write into. Each root has its own.
+WRITABLE_DIRS = ['tmp', 'var/tmp', 'opt', 'root']
+
+
+def _get_labels_dir(labels: Dict[str, str]) -> str:
+    labels_hash = hashlib.sha256(
+        json.dumps(labels, sort_keys=True).encode('utf8')).hexdigest()
+    return os.path.join(defaults.LOCAL_MACHINE_DIR, labels_hash)
+
+
+def kill_machines(labels: Dict[str, str]) -> List[int]:
+    """ Kill build scripts of every running local machine that has given
+    labels, whatever process launched them.
+
+    :param labels: Labels machines were created with.
+    :return: Process ids of killed scripts.
+    """
+    logger = logging.getLogger('LocalBuildMachine')
+    labels_dir = _get_labels_dir(labels)
+    try:
+        pids = [int(pid) for pid in os.listdir(labels_dir)]
+    except FileNotFoundError:
+        return []
+    killed_scripts = []
+    for pid in pids:
+        logger.info(f'Killing build script: {pid}')
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            # Script ended meanwhile.
+            continue
+        killed_scripts.append(pid)
+    return killed_scripts
+
+
+class LocalBuildMachine(object):
+    """ Runs build scripts as host processes instead of inside containers.
+
+    It offers the same interface standalone docker build machines do, so
+    builders can use any of them. Every script runs chrooted in a temporary
+    root of its own, inside a mount namespace where host system folders are
+    mounted read-only and build folder is mounted at the same path docker
+    machines use. Namespaces are entered as an unprivileged user through
+    unshare, so no daemon nor root permissions are needed. Build resources
+    are not enforced, though.
+    """
+
+    def __init__(self, resources: scheduler.BuildResources=None,
+                 build_log: buildlog.BuildLog=None,
+                 labels: Dict[str, str]=None,
+                 timeout: float=None):
+        self.logger = logging.getLogger('LocalBuildMachine')
+        self.resources = resources
+        self.build_log = build_log
+        self.labels = labels or {}
+        # Seconds build script may run before being killed.
+        self.timeout = timeout
+        self.timings = {}
+        # Temporary root folder. Named as in docker machines so builders can
+        # check whether it was started.
+        self.container = None
+        self.process = None
+
+    def get_image_id(self) -> str:
+        # Scripts use host userland, so host distribution plays image role.
+        digest = hashlib.sha256(platform.machine().encode("utf8"))
+        try:
+            with open('/etc/os-release', 'rb') as f:
+                digest.update(f.read())
+        except OSError:
+            digest.update(platform.platform().encode("utf8"))
+        return f'local:{digest.hexdigest()}'
+
+    @staticmethod
+    def _get_isolation_script(root: str, binds: Dict[str, str],
+                              read_only_binds: Dict[str, str],
+                              command: str) -> str:
+        lines = ['set -e']
+        for directory in SYSTEM_DIRS:
+            host_path = f'/{directory}'
+            root_path = shlex.quote(os.path.join(root, directory))
+            if os.path.islink(host_path):
+                # Merged /usr layouts have them as relative links.
+                lines.append(f'ln -s {shlex.quote(os.readlink(host_path))} '
+                             f'{root_path}')
+            elif os.path.isdir(host_path):
+                lines.extend([f'mkdir -p {root_path}',
+                              f'mount --rbind {host_path} {root_path}',
+                              f'mount -o remount,bind,ro {root_path}'])
+        for directory in ['dev', 'proc']:
+            root_path = shlex.quote(os.path.join(root, directory))
+            lines.extend([f'mkdir -p {root_path}',
+                          f'mount --rbind /{directory} {root_path}'])
+        for directory in WRITABLE_DIRS:
+            lines.append(f'mkdir -p {shlex.quote(os.path.join(root, directory))}')
+        for host_path, container_path in binds.items():
+            root_path = shlex.quote(os.path.join(root,
+                                                 container_path.lstrip('/')))
+            lines.extend([f'mkdir -p {root_path}',
+                          f'mount --bind {shlex.quote(host_path)} {root_path}'])
+        for host_path, container_path in read_only_binds.items():
+            root_path = shlex.quote(os.path.join(root,
+                                                 container_path.lstrip('/')))
+            lines.extend([f'mkdir -p {root_path}',
+                          f'mount --bind {shlex.quote(host_path)} {root_path}',
+                          f'mount -o remount,bind,ro {root_path}'])
+        lines.append(f'exec chroot {shlex.quote(root)} {shlex.quote(command)}')
+        return '\n'.join(lines)
+
+    def launch(self, build_dir: str, extra_binds: Dict[str, str]=None,
+               environment: Dict[str, str]=None,
+               read_only_binds: Dict[str, str]=None) -> int:
+        binds = {build_dir: defaults.SHARED_DIR}
+        binds.update(extra_binds or {})
+        with report.timed(self.timings, 'container_start'):
+            self.container = tempfile.mkdtemp(prefix="vdistroot")
+        path_to_command = "/".join([defaults.SHARED_DIR, defaults.SCRATCH_DIR,
+                                    defaults.SCRATCH_BUILDSCRIPT_NAME])
+        script = self._get_isolation_script(self.container, binds,
+                                            read_only_binds or {},
+                                            path_to_command)
+        with report.timed(self.timings, 'script'):
+            return self._run_command(
+                ['unshare', '--mount', '--map-root-user', 'bash', '-c', script],
+                environment)
+
+    def _run_command(self, command: List[str],
+                     environment: Dict[str, str]=None) -> int:
+        # Scripts get a clean environment, as they would in a container.
+        command_environment = {'PATH': '/usr/local/sbin:/usr/local/bin:'
+                                       '/usr/sbin:/usr/bin:/sbin:/bin',
+                               'HOME': '/root',
+                               'LANG': 'C.UTF-8'}
+        command_environment.update(environment or {})
+        self.logger.info(f'Running build script in: {self.container}')
+        # A session of its own lets us kill script along with its children.
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT,
+                                        env=command_environment,
+                                        start_new_session=True)
+        pid_path = self._register_process() if self.labels else None
+        try:
+            with watchdog.Watchdog(self.timeout, self.kill) as script_watchdog:
+                buildlog.log_process_output(self.process.stdout.fileno(),
+                                            self.build_log, self.logger)
+                self.process.stdout.close()
+                exit_code = self.process.wait()
+        finally:
+            if pid_path is not None:
+                os.remove(pid_path)
+        script_watchdog.check()
+        return exit_code
+
+    def _register_process(self) -> str:
+        # Script session is named after its process, so kill_machines() can
+        # find it by labels from other processes too.
+        labels_dir = _get_labels_dir(self.labels)
+        os.makedirs(labels_dir, exist_ok=True)
+        pid_path = os.path.join(labels_dir, str(self.process.pid))
+        open(pid_path, 'w').close()
+        return pid_path
+
+    def kill(self) -> None:
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.logger.info(f'Killing build script in: {self.container}')
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            # Script ended meanwhile.
+            pass
+
+    def shutdown(self) -> None:
+        with report.timed(self.timings, 'container_stop'):
+            self.kill()
+            if self.process is not None:
+                self.process.wait()
+            # Mounts were gone along with script namespace, so only files
+            # written by script remain.
+            self.logger.info(f'Removing root: {self.container}')
+            shutil.rmtree(self.container, ignore_errors=True)
@@ -0,0 +1,132 @@
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import shutil
+import subprocess
+from typing import Dict, Iterator, Optional
+
+import vdist.defaults as defaults
+
+logger = logging.getLogger('mirror')
+
+
+def _git(*args: str) -> str:
+    return subprocess.check_output(["git"] + list(args),
+                                   stderr=subprocess.PIPE).decode("utf8")
+
+
+class GitMirror(object):
+    """ Host side bare mirror of a git repository.
+
+    Mirrors are fetched incrementally and shared by every build of the same
+    repository, so build machines get a local shallow clone instead of
+    cloning from remote.
+    """
+
+    def __init__(self, uri: str, root: str=None):
+        self.uri = uri
+        self.root = root or defaults.GIT_MIRROR_DIR
+        uri_digest = hashlib.sha256(uri.encode("utf8")).hexdigest()[:16]
+        name = re.sub(r'[^A-Za-z0-9.\-]', '_', os.path.basename(uri.rstrip('/')))
+        self.path = os.path.join(self.root, f'{name}-{uri_digest}.git')
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        # Concurrent builds of same repository must not fetch it at once.
+        os.makedirs(self.root, exist_ok=True)
+        with open(f'{self.path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def update(self) -> None:
+        with self._locked():
+            if os.path.isdir(self.path):
+                logger.info(f'Fetching {self.uri} into {self.path}')
+                _git("-C", self.path, "fetch", "--prune", "--tags", "origin")
+            else:
+                logger.info(f'Mirroring {self.uri} into {self.path}')
+                staging_path = f'{self.path}.tmp'
+                shutil.rmtree(staging_path, ignore_errors=True)
+                _git("clone", "--mirror", self.uri, staging_path)
+                os.rename(staging_path, self.path)
+
+    def get_commit(self, revision: str) -> Optional[str]:
+        if not os.path.isdir(self.path):
+            return None
+        try:
+            return _git("-C", self.path, "rev-parse", "--verify", "--quiet",
+                        f'{revision}^{{commit}}').strip()
+        except subprocess.CalledProcessError:
+            return None
+
+    def export(self, commit: str, destination: str) -> None:
+        """ Place a shallow clone of given commit into destination.
+
+        Its git metadata is kept, because setuptools_scm, pbr or versioneer
+        read versions from it. Build scripts remove it before packaging.
+
+        :param commit: Commit id, or any other revision mirror knows about.
+        :param destination: Folder to clone commit into.
+        """
+        commit_id = _git("-C", self.path, "rev-parse", "--verify",
+                         f'{commit}^{{commit}}').strip()
+        os.makedirs(destination, exist_ok=True)
+        _git("-C", destination, "init", "-q")
+        # Pinned commits may not be branch tips anymore.
+        _git("-C", destination, "fetch", "-q", "--depth", "1",
+             "--upload-pack",
+             "git -c uploadpack.allowAnySHA1InWant=true upload-pack",
+             f'file://{os.path.abspath(self.path)}', commit_id)
+        _git("-C", destination, "checkout", "-q", "--detach", commit_id)
+        # Shallow clones have no history to describe, but tags of packaged
+        # commit itself are enough for release builds.
+        for tag in _git("-C", self.path, "tag", "--points-at",
+                        commit_id).split():
+            _git("-C", destination, "tag", tag, commit_id)
+
+    def read_file(self, commit: str, path: str) -> Optional[str]:
+        """ Read a file as it was at a commit.
+
+        :param commit: Commit id, or any other revision mirror knows about.
+        :param path: File path, relative to repository root.
+        :return: File contents, or None if it did not exist.
+        """
+        try:
+            return _git("-C", self.path, "show", f'{commit}:{path}')
+        except subprocess.CalledProcessError:
+            return None
+
+
+def pin_git_source(source: Dict[str, str], fetch: bool=True) -> str:
+    """ Resolve branch of a git source to a commit, fetching if needed.
+
+    Resolved commit is stored in source dict, so later calls for the same
+    source don't fetch again.
+
+    :param source: A source created with vdist.source.git().
+    :param fetch: Whether mirror can be updated if commit is not pinned yet.
+    :return: Commit id.
+    """
+    mirror = GitMirror(source['uri'])
+    commit = source.get('commit')
+    if commit is not None and mirror.get_commit(commit) == commit:
+        return commit
+    if fetch:
+        mirror.update()
+    commit = mirror.get_commit(source['branch'])
+    if commit is None:
+        raise ValueError(f'{source["branch"]} not found in {source["uri"]}')
+    source['commit'] = commit
+    return commit
+
+
+def export_git_source(source: Dict[str, str], destination: str) -> None:
+    commit = pin_git_source(source)
+    logger.info(f'Exporting {source["uri"]} at {commit}')
+    GitMirror(source['uri']).export(commit, destination)
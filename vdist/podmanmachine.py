@@ -0,0 +1,169 @@
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import subprocess
+import uuid
+from typing import Dict, Iterator, List
+
+import vdist.buildlog as buildlog
+import vdist.defaults as defaults
+import vdist.report as report
+import vdist.scheduler as scheduler
+import vdist.watchdog as watchdog
+
+
+def kill_containers(labels: Dict[str, str],
+                    command: str=defaults.PODMAN_COMMAND) -> List[str]:
+    """ Kill every running podman container that has given labels.
+
+    :param labels: Labels containers were started with.
+    :param command: Podman compatible command line.
+    :return: Ids of killed containers.
+    """
+    logger = logging.getLogger('PodmanBuildMachine')
+    arguments = [command, 'ps', '--quiet']
+    for key, value in labels.items():
+        arguments.extend(['--filter', f'label={key}={value}'])
+    result = subprocess.run(arguments, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    killed_containers = []
+    for container in result.stdout.decode('utf8').split():
+        logger.info(f'Killing container: {container}')
+        # Containers that ended meanwhile can't be killed.
+        if subprocess.run([command, 'kill', container],
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE).returncode == 0:
+            killed_containers.append(container)
+    return killed_containers
+
+
+class PodmanBuildMachine(object):
+    """ Runs build scripts in containers through podman command line.
+
+    Podman needs no daemon, so concurrent builds don't queue behind one: every
+    build script is a one shot "podman run" process of its own. Builds share
+    user image store, where every image is pulled just once however many
+    builds want it at the same time. Any command line accepting podman
+    (docker) arguments can be used instead of podman.
+    """
+
+    def __init__(self, image: str=None,
+                 resources: scheduler.BuildResources=None,
+                 build_log: buildlog.BuildLog=None,
+                 labels: Dict[str, str]=None,
+                 command: str=defaults.PODMAN_COMMAND,
+                 timeout: float=None):
+        self.logger = logging.getLogger('PodmanBuildMachine')
+        self.image = image
+        self.resources = resources
+        self.build_log = build_log
+        self.labels = labels or {}
+        self.command = command
+        # Seconds build script may run before its container is killed.
+        self.timeout = timeout
+        self.timings = {}
+        # Container name, set once launched.
+        self.container = None
+        self.process = None
+
+    def _run(self, arguments: List[str]) -> subprocess.CompletedProcess:
+        return subprocess.run([self.command] + arguments,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def _inspect_image(self) -> str:
+        result = self._run(['image', 'inspect', '--format', '{{.Id}}',
+                            self.image])
+        return result.stdout.decode('utf8').strip() \
+            if result.returncode == 0 else ''
+
+    @contextlib.contextmanager
+    def _image_lock(self) -> Iterator[None]:
+        os.makedirs(defaults.PODMAN_LOCK_DIR, exist_ok=True)
+        lock_name = hashlib.sha256(self.image.encode('utf8')).hexdigest()
+        with open(os.path.join(defaults.PODMAN_LOCK_DIR,
+                               f'{lock_name}.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_image_id(self) -> str:
+        image_id = self._inspect_image()
+        if image_id:
+            return image_id
+        # Concurrent builds of the same image wait for the first one to pull
+        # it, and then find it in store.
+        with self._image_lock():
+            image_id = self._inspect_image()
+            if not image_id:
+                self.logger.info(f'Pulling image: {self.image}')
+                result = self._run(['pull', self.image])
+                if result.returncode != 0:
+                    raise RuntimeError(f'Could not pull {self.image}: '
+                                       f'{result.stderr.decode("utf8")}')
+                image_id = self._inspect_image()
+        return image_id
+
+    def _get_resources_arguments(self) -> List[str]:
+        if self.resources is None:
+            return []
+        return ['--cpus', str(self.resources.cpus),
+                '--memory', str(self.resources.memory)]
+
+    def _get_run_arguments(self, binds: Dict[str, str],
+                           read_only_binds: Dict[str, str],
+                           environment: Dict[str, str],
+                           path_to_command: str) -> List[str]:
+        arguments = ['run', '--rm', '--name', self.container]
+        for key, value in self.labels.items():
+            arguments.extend(['--label', f'{key}={value}'])
+        for host_path, container_path in binds.items():
+            arguments.extend(['--volume', f'{host_path}:{container_path}:rw'])
+        for host_path, container_path in read_only_binds.items():
+            arguments.extend(['--volume', f'{host_path}:{container_path}:ro'])
+        for key, value in environment.items():
+            arguments.extend(['--env', f'{key}={value}'])
+        arguments.extend(self._get_resources_arguments())
+        return arguments + [self.image, path_to_command]
+
+    def launch(self, build_dir: str, extra_binds: Dict[str, str]=None,
+               environment: Dict[str, str]=None,
+               read_only_binds: Dict[str, str]=None) -> int:
+        binds = {build_dir: defaults.SHARED_DIR}
+        binds.update(extra_binds or {})
+        self.container = f'vdist-{uuid.uuid4().hex}'
+        path_to_command = "/".join([defaults.SHARED_DIR, defaults.SCRATCH_DIR,
+                                    defaults.SCRATCH_BUILDSCRIPT_NAME])
+        arguments = self._get_run_arguments(binds, read_only_binds or {},
+                                            environment or {}, path_to_command)
+        self.logger.info(f'Running container {self.container}: {self.image}')
+        # Container is created, started and removed by a single command, so
+        # its start can't be timed apart from script.
+        with report.timed(self.timings, 'script'):
+            self.process = subprocess.Popen([self.command] + arguments,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT)
+            with watchdog.Watchdog(self.timeout, self.kill) as script_watchdog:
+                buildlog.log_process_output(self.process.stdout.fileno(),
+                                            self.build_log, self.logger)
+                self.process.stdout.close()
+                exit_code = self.process.wait()
+        script_watchdog.check()
+        return exit_code
+
+    def kill(self) -> None:
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.logger.info(f'Killing container: {self.container}')
+        self._run(['kill', self.container])
+
+    def shutdown(self) -> None:
+        with report.timed(self.timings, 'container_stop'):
+            self.kill()
+            if self.process is not None:
+                self.process.wait()
+            # Usually gone already, as it is run with --rm.
+            self._run(['rm', '--force', self.container])
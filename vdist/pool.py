@@ -0,0 +1,121 @@
+import concurrent.futures as futures
+import contextlib
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from typing import Dict, Iterator
+
+import vdist.buildmachine as buildmachine
+import vdist.defaults as defaults
+import vdist.leftovers as leftovers
+
+
+class MachinePool(object):
+    """ Pre-started build machines that builds lease instead of starting
+    their own.
+
+    Every machine has a slot folder of its own mounted. Leased builds place
+    their build folders under pool root and pool moves them into slot of the
+    machine they lease while it runs them, so builds can't see each other's
+    files. Pool can be passed to other processes: idle machines are tracked
+    with manager queues that every process can reach. Machines that can't be
+    reset are replaced.
+    """
+
+    def __init__(self, max_size: int=defaults.MACHINE_POOL_SIZE,
+                 binds: Dict[str, str]=None, labels: Dict[str, str]=None):
+        self.logger = logging.getLogger('MachinePool')
+        self.max_size = max_size
+        self.root = tempfile.mkdtemp(prefix="vdistpool")
+        self.binds = dict(binds) if binds else {}
+        self.labels = labels or {}
+        self._manager = multiprocessing.Manager()
+        self._machines_wanted = {}
+        self._idle_machines = {}
+        # Replacements may be started by other processes.
+        self._container_ids = self._manager.list()
+
+    def __getstate__(self):
+        # Manager itself can't be pickled, but its queues can.
+        state = dict(self.__dict__)
+        state['_manager'] = None
+        state['logger'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.logger = logging.getLogger('MachinePool')
+
+    def add_image(self, image: str, builds: int) -> None:
+        self._machines_wanted[image] = min(
+            self.max_size, self._machines_wanted.get(image, 0) + builds)
+
+    def accepts(self, image: str) -> bool:
+        return image in self._idle_machines
+
+    def start(self) -> None:
+        with futures.ThreadPoolExecutor() as executor:
+            starters = []
+            for image, machines in self._machines_wanted.items():
+                self._idle_machines[image] = self._manager.Queue()
+                starters.extend(executor.submit(self._start_machine, image)
+                                for _ in range(machines))
+            for starter in futures.as_completed(starters):
+                starter.result()
+
+    def _start_machine(self, image: str) -> None:
+        slot = tempfile.mkdtemp(prefix="slot", dir=self.root)
+        build_machine = buildmachine.BuildMachine(image=image,
+                                                  labels=self.labels)
+        container_id = build_machine.start(
+            dict(self.binds, **{slot: defaults.CONTAINER_POOL_DIR}))
+        self._container_ids.append((image, container_id))
+        self._idle_machines[image].put((container_id, slot))
+
+    def get_container_path(self, host_path: str) -> str:
+        relative_path = os.path.relpath(host_path, self.root)
+        return "/".join([defaults.CONTAINER_POOL_DIR, relative_path])
+
+    @contextlib.contextmanager
+    def lease(self, image: str, host_path: str=None) -> Iterator[str]:
+        """ Lease an idle machine of given image.
+
+        :param image: Docker image machine must run.
+        :param host_path: Folder right under pool root that leased machine
+            must see at its container path while lease lasts.
+        :return: Id of leased container.
+        """
+        container_id, slot = self._idle_machines[image].get()
+        if host_path is not None:
+            leased_path = os.path.join(slot, os.path.basename(host_path))
+            os.rename(host_path, leased_path)
+        reusable = True
+        try:
+            yield container_id
+        except leftovers.MachineResetException:
+            reusable = False
+            raise
+        finally:
+            if host_path is not None:
+                os.rename(leased_path, host_path)
+            if reusable:
+                self._idle_machines[image].put((container_id, slot))
+            else:
+                # Its leftovers would leak into next build, so it is left
+                # aside until shutdown.
+                self.logger.warning(f'Replacing pooled machine {container_id}, '
+                                    f'it could not be reset')
+                self._start_machine(image)
+
+    def shutdown(self) -> None:
+        for image, container_id in self._container_ids:
+            build_machine = buildmachine.BuildMachine(image=image)
+            build_machine.attach(container_id)
+            build_machine.shutdown()
+        self._container_ids[:] = []
+        self._manager.shutdown()
+        # Build folders inside are owned by our user (build scripts chown
+        # them), but don't make a fuss if something was left behind.
+        shutil.rmtree(self.root, ignore_errors=True)
@@ -0,0 +1,24 @@
+{% if base_requirements %}
+# Installs Python dependencies every build of a batch group shares into the
+# base image baked for that group, so its builds only install their own ones.
+# Base images hold Python at neutral prefix, until builds relocate it.
+install_base_requirements() {
+    if [[ ${PYTHON_VERSION:0:1} == "2" ]]; then
+        PYTHON_BIN="$PYTHON_BUILD_PREFIX/bin/python"
+        PIP_BIN="$PYTHON_BUILD_PREFIX/bin/pip"
+        $PYTHON_BIN -m ensurepip
+    else
+        PYTHON_BIN="$PYTHON_BUILD_PREFIX/bin/python3"
+        PIP_BIN="$PYTHON_BUILD_PREFIX/bin/pip3"
+    fi
+    local base_requirements=$(mktemp)
+    cat > $base_requirements <<'EOF'
+{{ base_requirements|join('\n') }}
+EOF
+    prepare_wheelhouse
+    install_packaging_tools
+    wheelhouse_install -r $base_requirements
+    report_wheelhouse
+    rm -f $base_requirements
+}
+{% endif %}
@@ -0,0 +1,102 @@
+{% if python_configure_flags %}
+# Helpers to measure how fast optimized Python is. A few small workloads, in
+# the spirit of pyperformance ones, are timed with compiled interpreter and,
+# if image has one, with distro python3, to tell the speedup.
+
+# Accepts interpreter to benchmark.
+benchmark_python() {
+    local benchmark_script=$(mktemp)
+    cat > $benchmark_script <<'EOF'
+from __future__ import print_function
+import json
+import re
+import subprocess
+import sys
+import time
+
+timer = getattr(time, "perf_counter", time.time)
+
+
+def nbody(steps=20000):
+    bodies = [[0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 39.47],
+              [4.84, -1.16, -0.10, 0.60, 2.81, -0.02, 0.03],
+              [8.34, 4.12, -0.40, -1.01, 1.82, 0.008, 0.011],
+              [12.89, -15.11, -0.22, 1.08, 0.86, -0.01, 0.0017],
+              [15.37, -25.91, 0.17, 0.97, 0.59, -0.03, 0.002]]
+    for _ in range(steps):
+        for i, body in enumerate(bodies):
+            for other in bodies[i + 1:]:
+                dx, dy, dz = body[0] - other[0], body[1] - other[1], \
+                    body[2] - other[2]
+                magnitude = 0.01 * (dx * dx + dy * dy + dz * dz) ** -1.5
+                body[3] -= dx * other[6] * magnitude
+                other[3] += dx * body[6] * magnitude
+        for body in bodies:
+            body[0] += 0.01 * body[3]
+
+
+def fibonacci(n=24):
+    return n if n < 2 else fibonacci(n - 1) + fibonacci(n - 2)
+
+
+def json_roundtrip(times=3000):
+    data = {"name": "vdist", "values": list(range(50)),
+            "nested": {"text": "x" * 100, "flag": True, "ratio": 0.5}}
+    for _ in range(times):
+        json.loads(json.dumps(data))
+
+
+def regex(times=2000):
+    text = "user-%d@example.com, 10.0.0.%d; " * 20
+    pattern = re.compile(r"([\w.-]+)@([\w.-]+)|(\d+\.\d+\.\d+\.\d+)")
+    for index in range(times):
+        pattern.findall(text % ((index,) * 40))
+
+
+def strings_and_dicts(times=200):
+    for _ in range(times):
+        words = dict(("key%d" % index, str(index) * 3)
+                     for index in range(1000))
+        "-".join(sorted(words.values())).upper().split("-")
+
+
+BENCHMARKS = [nbody, fibonacci, json_roundtrip, regex, strings_and_dicts]
+
+
+def run():
+    results = {}
+    for benchmark in BENCHMARKS:
+        durations = []
+        for _ in range(3):
+            started_at = timer()
+            benchmark()
+            durations.append(timer() - started_at)
+        results[benchmark.__name__] = min(durations)
+    return results
+
+
+if len(sys.argv) > 1 and sys.argv[1] == "--raw":
+    print(json.dumps(run()))
+    sys.exit(0)
+results = run()
+for name in sorted(results):
+    print("@@vdist-benchmark %s %.6f" % (name, results[name]))
+total = sum(results.values())
+print("@@vdist-benchmark total %.6f" % total)
+print("vdist benchmark: %.3fs for Python %s" % (total, sys.version.split()[0]))
+if len(sys.argv) > 1:
+    try:
+        reference = json.loads(subprocess.check_output(
+            [sys.argv[1], __file__, "--raw"]).decode("utf8"))
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        sys.exit(0)
+    reference_total = sum(reference[name] for name in results)
+    print("@@vdist-benchmark reference %.6f" % reference_total)
+    print("vdist benchmark: %.2fx speedup over %s" % (reference_total / total,
+                                                      sys.argv[1]))
+EOF
+    $1 $benchmark_script $(command -v python3 || true) || \
+        echo "vdist benchmark: could not benchmark $1"
+    rm -f $benchmark_script
+}
+{% endif %}
@@ -0,0 +1,65 @@
+# Helpers to compile Python in parallel, reusing objects compiled by former
+# builds through a ccache folder kept in vdist host cache. If that folder is
+# not mounted (for instance, when this script is run by hand) or ccache can't
+# be installed, Python is compiled as usual.
+CCACHE_ENABLED=""
+
+# Jobs to pass to "make -j".
+compile_jobs() {
+    local jobs="{{compile_jobs or ''}}"
+    if [ -z "$jobs" ] && [ -f /sys/fs/cgroup/cpu.max ]; then
+        # cgroup v2 CPU quota, as set by vdist build resources.
+        local quota period
+        read quota period < /sys/fs/cgroup/cpu.max
+        if [ "$quota" != "max" ]; then
+            jobs=$(( (quota + period - 1) / period ))
+        fi
+    elif [ -z "$jobs" ] && [ -f /sys/fs/cgroup/cpu/cpu.cfs_quota_us ]; then
+        # Same for cgroup v1, where no quota is -1.
+        local quota=$(cat /sys/fs/cgroup/cpu/cpu.cfs_quota_us)
+        local period=$(cat /sys/fs/cgroup/cpu/cpu.cfs_period_us)
+        if [ "$quota" -gt 0 ]; then
+            jobs=$(( (quota + period - 1) / period ))
+        fi
+    fi
+    if [ -z "$jobs" ]; then
+        jobs=$(nproc)
+    fi
+    echo $jobs
+}
+
+# Accepts command to install ccache with profile package manager, if there
+# is one build can use.
+setup_ccache() {
+{% if use_ccache %}
+    if [ ! -d "{{ccache_dir}}" ]; then
+        return 0
+    fi
+    if ! command -v ccache > /dev/null && ! { [ $# -gt 0 ] && "$@"; }; then
+        echo "ccache could not be installed, so Python is compiled without it"
+        return 0
+    fi
+    # Every profile has its own compilers, so it gets its own objects.
+    export CCACHE_DIR="{{ccache_dir}}/{{profile}}"
+    export CCACHE_MAXSIZE="{{ccache_max_size}}"
+    # Sources are unpacked at the same place by every build, but compilers
+    # may change when profile image is updated.
+    export CCACHE_BASEDIR=/var/tmp
+    export CCACHE_COMPILERCHECK=content
+    export CC="ccache ${CC:-gcc}"
+    mkdir -p $CCACHE_DIR
+    ccache --zero-stats
+    CCACHE_ENABLED="yes"
+{% else %}
+    return 0
+{% endif %}
+}
+
+report_ccache() {
+    if [ -z "$CCACHE_ENABLED" ]; then
+        return 0
+    fi
+    ccache --show-stats | sed 's/^/vdist ccache: /'
+    chown -R {{local_uid}}:{{local_gid}} $CCACHE_DIR
+    unset CC
+}
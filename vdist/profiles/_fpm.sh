@@ -0,0 +1,29 @@
+{% if package_formats %}
+# Packages given paths in every requested format. All of them are built from
+# the very same tree, so fpm runs for each format at once, with a folder and a
+# log of its own to keep their outputs apart.
+fpm_package_formats() {
+    local packages_dir={{package_tmp_root}}/vdist_packages
+    local package_format
+    local pids=()
+    local failed=0
+    for package_format in {{package_formats|join(' ')}}; do
+        mkdir -p $packages_dir/$package_format
+        fpm -s dir -t $package_format -n {{app}} -p $packages_dir/$package_format{% if custom_filename %}/{{custom_filename}}{% endif %} -v {{version}} {% for dep in runtime_deps %} --depends '{{dep}}' {% endfor %} {{fpm_args}} "$@" > $packages_dir/$package_format.log 2>&1 &
+        pids+=($!)
+    done
+    local index=0
+    for package_format in {{package_formats|join(' ')}}; do
+        if ! wait ${pids[$index]}; then
+            echo "vdist fpm: $package_format package failed."
+            failed=1
+        fi
+        cat $packages_dir/$package_format.log
+        index=$((index + 1))
+    done
+    if [ $failed -ne 0 ]; then
+        return 1
+    fi
+    cp $packages_dir/*/* {{shared_dir}}
+}
+{% endif %}
@@ -0,0 +1,6 @@
+# vdist timestamps every line of build output, so marking when each phase
+# begins is enough to know how long it took. Markers are printed to stdout,
+# where bash trace does not prefix them with "+".
+vdist_phase() {
+    echo "@@vdist-phase $1"
+}
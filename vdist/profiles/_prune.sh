@@ -0,0 +1,58 @@
+{% if prune_patterns %}
+# Helpers to make packages smaller before fpm runs. What prune profile leaves
+# out is removed, ELF files are stripped and identical files are hardlinked.
+# Sizes before and after are reported to vdist.
+
+_get_tree_size() {
+    du -scb "$@" | tail -n 1 | cut -f 1
+}
+
+_strip_elf_files() {
+    if ! command -v strip > /dev/null; then
+        echo "strip not found, so binaries are packaged unstripped"
+        return 0
+    fi
+    local file
+    find "$@" -type f \( -name '*.so' -o -name '*.so.*' -o -perm -u+x \) -print0 | \
+        while IFS= read -r -d '' file; do
+            if [ "$(head -c 4 "$file" | tail -c 3)" == "ELF" ]; then
+                strip --strip-unneeded "$file" 2> /dev/null || true
+            fi
+        done
+}
+
+_hardlink_identical_files() {
+    local original duplicate
+    find "$@" -type f -size +0 -print0 | xargs -0 -r sha256sum | sort | \
+        awk '{ path = substr($0, 67) } $1 == digest { print original "\t" path; next } { digest = $1; original = path }' | \
+        while IFS=$'\t' read -r original duplicate; do
+            # Hardlinks share permissions too.
+            if [ "$(stat -c %a:%u:%g "$original")" == "$(stat -c %a:%u:%g "$duplicate")" ]; then
+                ln -f "$original" "$duplicate"
+            fi
+        done
+}
+
+# Accepts a name to report sizes with, and folders going into package.
+prune_package_tree() {
+    local name=$1
+    shift
+    local size_before=$(_get_tree_size "$@")
+    local folder
+    for folder in "$@"; do
+{% for pattern in prune_patterns %}
+{% if '/' in pattern %}
+        rm -rf $folder/{{pattern}}
+{% else %}
+        find $folder -depth -name '{{pattern}}' -exec rm -rf {} +
+{% endif %}
+{% endfor %}
+    done
+    _strip_elf_files "$@"
+    _hardlink_identical_files "$@"
+    local size_after=$(_get_tree_size "$@")
+    echo "vdist prune: $* went from $size_before to $size_after bytes"
+    echo "@@vdist-size ${name}_before $size_before"
+    echo "@@vdist-size ${name}_after $size_after"
+}
+{% endif %}
@@ -0,0 +1,37 @@
+# Helpers to reuse compiled Python interpreters through vdist host cache.
+# Interpreters are cached as compiled, at PYTHON_BUILD_PREFIX.
+# VDIST_PYTHON_CACHE_KEY is set by vdist when it launches this script. If it
+# is empty (for instance, when this script is run by hand) cache is bypassed
+# and Python is compiled as usual.
+PYTHON_CACHE_ENTRY="{{python_cache_dir}}/${VDIST_PYTHON_CACHE_KEY}"
+
+restore_cached_python() {
+    if [ -z "$VDIST_PYTHON_CACHE_KEY" ] || [ ! -f "$PYTHON_CACHE_ENTRY/complete" ]; then
+        return 1
+    fi
+    echo "Restoring compiled Python from cache entry $VDIST_PYTHON_CACHE_KEY"
+    mkdir -p $PYTHON_BUILD_PREFIX
+    cp -a $PYTHON_CACHE_ENTRY/tree/. $PYTHON_BUILD_PREFIX/
+    # Cache eviction is LRU, so mark this entry as recently used.
+    touch $PYTHON_CACHE_ENTRY/complete
+}
+
+store_cached_python() {
+    if [ -z "$VDIST_PYTHON_CACHE_KEY" ] || [ -d "$PYTHON_CACHE_ENTRY" ]; then
+        return 0
+    fi
+    echo "Storing compiled Python in cache entry $VDIST_PYTHON_CACHE_KEY"
+    # Populate a staging folder and rename it afterwards so parallel builds
+    # never see a half written entry.
+    PYTHON_CACHE_STAGING="$PYTHON_CACHE_ENTRY.tmp.$(hostname)"
+    rm -rf $PYTHON_CACHE_STAGING
+    mkdir -p $PYTHON_CACHE_STAGING/tree
+    cp -a $PYTHON_BUILD_PREFIX/. $PYTHON_CACHE_STAGING/tree/
+    cat > $PYTHON_CACHE_STAGING/entry.json <<EOF
+{"profile": "{{profile}}", "python_version": "$PYTHON_VERSION"}
+EOF
+    touch $PYTHON_CACHE_STAGING/complete
+    chown -R {{local_uid}}:{{local_gid}} $PYTHON_CACHE_STAGING
+    # If another build stored this entry meanwhile, just keep theirs.
+    mv -T $PYTHON_CACHE_STAGING $PYTHON_CACHE_ENTRY || rm -rf $PYTHON_CACHE_STAGING
+}
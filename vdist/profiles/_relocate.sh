@@ -0,0 +1,78 @@
+# Helpers to compile Python at a neutral prefix, so the same interpreter can
+# be cached and baked once per profile and Python version, and to move it
+# afterwards to PYTHON_BASEDIR of the app being packaged, or wherever it is
+# asked to.
+PYTHON_BUILD_PREFIX="{{python_build_prefix}}"
+
+_relocate_symlinks() {
+    local basedir=$1 link target
+    find $basedir -type l | while read link; do
+        target=$(readlink "$link")
+        if [[ "$target" == "$PYTHON_BUILD_PREFIX/"* ]]; then
+            ln -sfn "$basedir/${target#$PYTHON_BUILD_PREFIX/}" "$link"
+        fi
+    done
+}
+
+_relocate_shebangs() {
+    # pip and every other launcher are scripts whose shebang points to the
+    # interpreter they were installed with.
+    local basedir=$1 script
+    for script in $basedir/bin/*; do
+        if [ -f "$script" ] && [ ! -L "$script" ] && [ "$(head -c 2 "$script")" == "#!" ]; then
+            sed -i "1s|^#!$PYTHON_BUILD_PREFIX/|#!$basedir/|" "$script"
+        fi
+    done
+}
+
+_relocate_build_configuration() {
+    # sysconfig data, Makefile and pkg-config files tell how Python was
+    # built, so extensions compiled later are built for its real place.
+    local basedir=$1 file
+    for file in $basedir/lib/python*/_sysconfigdata*.py \
+                $basedir/lib/python*/config*/Makefile \
+                $basedir/lib/pkgconfig/*.pc \
+                $basedir/bin/python*-config; do
+        if [ -f "$file" ] && [ ! -L "$file" ]; then
+            sed -i "s|$PYTHON_BUILD_PREFIX|$basedir|g" "$file"
+        fi
+    done
+}
+
+_relocate_rpaths() {
+    # Profiles link shared libpython with a relative RPATH, but any absolute
+    # one pointing to neutral prefix must be rewritten.
+    local basedir=$1 elf rpath
+    for elf in $basedir/bin/* $basedir/lib/*.so*; do
+        if [ ! -f "$elf" ] || [ -L "$elf" ] || \
+                ! readelf -d "$elf" 2> /dev/null | grep -E '\((RPATH|RUNPATH)\)' | grep -q "$PYTHON_BUILD_PREFIX"; then
+            continue
+        fi
+        if ! command -v patchelf > /dev/null; then
+            echo "patchelf is needed to relocate RPATH of $elf"
+            return 1
+        fi
+        rpath=$(patchelf --print-rpath "$elf")
+        patchelf --set-rpath "${rpath//$PYTHON_BUILD_PREFIX/$basedir}" "$elf"
+    done
+}
+
+# Accepts folder to move Python to. Defaults to PYTHON_BASEDIR.
+relocate_python() {
+    local basedir=${1:-$PYTHON_BASEDIR}
+    if [ "$PYTHON_BUILD_PREFIX" == "$basedir" ]; then
+        return 0
+    fi
+    echo "Relocating compiled Python from $PYTHON_BUILD_PREFIX to $basedir"
+    if [ -e "$basedir" ]; then
+        cp -a $PYTHON_BUILD_PREFIX/. $basedir/
+        rm -rf $PYTHON_BUILD_PREFIX
+    else
+        mkdir -p $(dirname $basedir)
+        mv $PYTHON_BUILD_PREFIX $basedir
+    fi
+    _relocate_symlinks $basedir
+    _relocate_shebangs $basedir
+    _relocate_build_configuration $basedir
+    _relocate_rpaths $basedir
+}
@@ -0,0 +1,56 @@
+{% if shared_runtime %}
+# Helpers to ship compiled Python as a runtime package of its own. App
+# package only carries a virtual environment on that runtime and depends on
+# it, so hosts running many apps install Python just once.
+RUNTIME_BASEDIR="{{runtime_basedir}}"
+# Runtime packages are kept along with the cached interpreter they were built
+# from, so every app sharing it packages runtime once.
+RUNTIME_CACHE_DIR="$PYTHON_CACHE_ENTRY/runtime/{{runtime_name}}"
+
+# Accepts package format and folder of runtime package built in it.
+_store_runtime_package() {
+    if [ -z "$VDIST_PYTHON_CACHE_KEY" ] || [ ! -f "$PYTHON_CACHE_ENTRY/complete" ] || \
+            [ -d "$RUNTIME_CACHE_DIR/$1" ]; then
+        return 0
+    fi
+    local staging_dir="$RUNTIME_CACHE_DIR/$1.tmp.$(hostname)"
+    rm -rf $staging_dir
+    mkdir -p $staging_dir
+    cp $2/* $staging_dir/
+    chown -R {{local_uid}}:{{local_gid}} $PYTHON_CACHE_ENTRY/runtime
+    # If another build stored it meanwhile, just keep theirs.
+    mv -T $staging_dir $RUNTIME_CACHE_DIR/$1 || rm -rf $staging_dir
+}
+
+# Accepts package formats to build runtime in.
+package_runtime() {
+    local runtime_dir={{package_tmp_root}}/vdist_runtime
+    local package_format
+    local missing_formats=()
+    for package_format in "$@"; do
+        if [ -n "$VDIST_PYTHON_CACHE_KEY" ] && [ -d "$RUNTIME_CACHE_DIR/$package_format" ]; then
+            echo "Reusing {{runtime_name}} $package_format package from cache entry $VDIST_PYTHON_CACHE_KEY"
+            cp $RUNTIME_CACHE_DIR/$package_format/* {{shared_dir}}
+        else
+            missing_formats+=($package_format)
+        fi
+    done
+    if [ -z "${missing_formats[*]}" ]; then
+        return 0
+    fi
+{% if prune_patterns %}
+    prune_package_tree runtime $RUNTIME_BASEDIR
+{% endif %}
+    for package_format in "${missing_formats[@]}"; do
+        mkdir -p $runtime_dir/$package_format
+        fpm -s dir -t $package_format -n {{runtime_name}} -p $runtime_dir/$package_format -v $PYTHON_VERSION -a native --description "Python $PYTHON_VERSION runtime shared by vdist packages" $RUNTIME_BASEDIR
+        cp $runtime_dir/$package_format/* {{shared_dir}}
+        _store_runtime_package $package_format $runtime_dir/$package_format
+    done
+}
+
+create_app_environment() {
+    echo "Creating virtual environment for {{app}} on {{runtime_name}}"
+    $RUNTIME_BASEDIR/bin/python3 -m venv $PYTHON_BASEDIR
+}
+{% endif %}
@@ -0,0 +1,85 @@
+# Helpers to install Python dependencies through a wheelhouse kept in vdist
+# host cache, so wheels are only downloaded and built once per profile and
+# Python ABI. If wheelhouse folder is not mounted (for instance, when this
+# script is run by hand) dependencies are installed straight from index.
+WHEELHOUSE=""
+
+prepare_wheelhouse() {
+    if [ ! -d "{{wheelhouse_dir}}" ]; then
+        return 0
+    fi
+    # Python 2 lacks of SOABI, so we make up a similar tag for it.
+    PYTHON_ABI=$($PYTHON_BIN -c "import platform, sys, sysconfig; print(sysconfig.get_config_var('SOABI') or 'py%d%d-%s' % (sys.version_info[0], sys.version_info[1], platform.machine()))")
+    WHEELHOUSE="{{wheelhouse_dir}}/{{profile}}/$PYTHON_ABI"
+    mkdir -p $WHEELHOUSE
+    WHEELHOUSE_SNAPSHOT=$(mktemp)
+    ls $WHEELHOUSE > $WHEELHOUSE_SNAPSHOT
+}
+
+# Packaging tools always come from index. Wheelhouse would keep installing
+# whatever versions of them were cached first.
+install_packaging_tools() {
+    $PIP_BIN install {{pip_args}} -U pip setuptools wheel
+}
+
+# Accepts same arguments as "pip install".
+wheelhouse_install() {
+    if [ -z "$WHEELHOUSE" ]; then
+        $PIP_BIN install {{pip_args}} "$@"
+        return
+    fi
+    if ! $PIP_BIN install {{pip_args}} --no-index --find-links $WHEELHOUSE "$@"; then
+        # Some wheels are missing. "pip wheel" does not understand upgrade
+        # flags, nor install only pip_args, but everything else can be passed
+        # as it is.
+        local wheel_args=()
+        for arg in "$@"; do
+            if [ "$arg" != "-U" ] && [ "$arg" != "--upgrade" ]; then
+                wheel_args+=("$arg")
+            fi
+        done
+        # Lock wheelhouse so concurrent builds of this profile don't write
+        # the same wheel at once.
+        if flock $WHEELHOUSE/.lock $PIP_BIN wheel {{wheel_pip_args}} --find-links $WHEELHOUSE --wheel-dir $WHEELHOUSE "${wheel_args[@]}"; then
+            $PIP_BIN install {{pip_args}} --no-index --find-links $WHEELHOUSE "$@"
+        else
+            echo "vdist wheelhouse: could not build wheels, installing from index."
+            $PIP_BIN install {{pip_args}} "$@"
+        fi
+    fi
+}
+
+report_wheelhouse() {
+    if [ -z "$WHEELHOUSE" ]; then
+        return 0
+    fi
+    $PYTHON_BIN - $WHEELHOUSE $WHEELHOUSE_SNAPSHOT $PIP_BIN <<'EOF'
+import os
+import re
+import subprocess
+import sys
+
+wheelhouse, snapshot, pip = sys.argv[1:4]
+
+
+def normalize(name):
+    return re.sub(r"[-_.]+", "_", name).lower()
+
+
+def project(wheel):
+    return normalize(wheel.split("-")[0])
+
+
+before = set(open(snapshot).read().split())
+after = set(name for name in os.listdir(wheelhouse) if name.endswith(".whl"))
+freeze = subprocess.check_output([pip, "freeze", "--all"]).decode("utf8")
+installed = set(normalize(line.split("==")[0]) for line in freeze.split())
+misses = installed & set(project(wheel) for wheel in after - before)
+hits = (installed & set(project(wheel) for wheel in before)) - misses
+print("vdist wheelhouse: %d hits, %d misses" % (len(hits), len(misses)))
+for name in sorted(misses):
+    print("vdist wheelhouse miss: %s" % name)
+EOF
+    rm -f $WHEELHOUSE_SNAPSHOT
+    chown -R {{local_uid}}:{{local_gid}} {{wheelhouse_dir}}/{{profile}}
+}
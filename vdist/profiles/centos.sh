@@ -5,30 +5,89 @@ PYTHON_BASEDIR="{{python_basedir}}"
 # Fail on error.
 set -e
 
+{% include "_python_cache.sh" %}
+{% include "_wheelhouse.sh" %}
+{% include "_compile.sh" %}
+{% include "_relocate.sh" %}
+{% include "_runtime.sh" %}
+{% include "_prune.sh" %}
+{% include "_benchmark.sh" %}
+{% include "_phases.sh" %}
+{% include "_fpm.sh" %}
+{% include "_base_requirements.sh" %}
+
 {% if build_deps %}
+vdist_phase build_deps
+{% if executor == 'local' %}
+# Local builds run on host userland, mounted read-only, so these must be
+# installed there already.
+echo "Local build expects these build dependencies on host: {{build_deps|join(' ')}}"
+{% else %}
 # Refresh repositories list to avoid problems with too old databases.
 yum update -y
 # Install build dependencies.
 yum install -y {{build_deps|join(' ')}}
 {% endif %}
+{% endif %}
 
 # Install prerequisites
 ## TODO: Try to comment this. I think we don't need it any longer.
 # easy_install virtualenv
 
 {% if compile_python %}
+vdist_phase python_compile
 # Download and compile what is going to be the Python we are going to use
 # as our portable python environment.
+if ! restore_cached_python; then
+{% if executor != 'local' %}
     # Since Python 3.7 you need libffi to compile it.
     yum update --nogpgcheck -y
     yum install libffi-devel -y
+{% endif %}
     cd /var/tmp
     curl -O https://www.python.org/ftp/python/$PYTHON_VERSION/Python-$PYTHON_VERSION.tgz
     tar xzvf Python-$PYTHON_VERSION.tgz
     cd Python-$PYTHON_VERSION
-    ./configure --prefix=$PYTHON_BASEDIR
-    make && make install
+    setup_ccache{% if executor != 'local' %} yum install -y ccache{% endif %}
+    ./configure --prefix=$PYTHON_BUILD_PREFIX {{python_configure_flags}}
+    make -j$(compile_jobs) && make install
+    report_ccache
+    store_cached_python
+{% if python_configure_flags %}
+    # Interpreters restored from cache were benchmarked when compiled.
+    vdist_phase python_benchmark
+    benchmark_python $PYTHON_BUILD_PREFIX/bin/python$(echo $PYTHON_VERSION | cut -d. -f1,2)
+{% endif %}
+fi
+{% endif %}
+
+{% if bake_only %}
+# We are only baking a base image with compiled Python for further builds,
+# so compile leftovers are not welcome and the rest is up to those builds.
+rm -rf /var/tmp/Python-*
+{% if base_requirements %}
+vdist_phase base_requirements
+install_base_requirements
+{% endif %}
+exit 0
+{% endif %}
+
+{% if relocate_python %}
+vdist_phase python_relocate
+# Python was compiled, or baked, at a neutral prefix. Move it to where this
+# app wants it.
+{% if shared_runtime %}
+relocate_python $RUNTIME_BASEDIR
+# Before runtime is pruned, which might leave ensurepip out.
+create_app_environment
+vdist_phase runtime_package
+package_runtime {{package_formats|join(' ') if package_formats else 'rpm'}}
+{% else %}
+relocate_python
 {% endif %}
+{% endif %}
+
+vdist_phase source
 
 # Create temporary folder to place our application files.
 if [ ! -d {{package_tmp_root}} ]; then
@@ -38,11 +97,10 @@ fi
 cd {{package_tmp_root}}
 
 {% if source.type == 'git' %}
-    # Place application files inside temporary folder after dowloading it from
-    # git repository.
-    git clone {{source.uri}}
-    cd {{project_root}}
-    git checkout {{source.branch}}
+    # Place application files inside temporary folder. vdist has already
+    # exported requested branch from its host side mirror of git repository.
+    cp -ar {{shared_dir}}/{{scratch_folder_name}}/{{project_root}} .
+    cd {{package_tmp_root}}/{{project_root}}
 
 {% elif source.type in ['directory', 'git_directory'] %}
     # Place application files inside temporary folder after copying it from
@@ -94,12 +152,18 @@ else
     PIP_BIN="$PYTHON_BASEDIR/bin/pip3"
 fi
 
+vdist_phase pip_install
+
 # Install package python dependencies inside our portable python environment.
 if [ -f "$PWD{{requirements_path}}" ]; then
-    $PIP_BIN install -U pip setuptools
-    $PIP_BIN install {{pip_args}} -r $PWD{{requirements_path}}
+    prepare_wheelhouse
+    install_packaging_tools
+    wheelhouse_install -r $PWD{{requirements_path}}
+    report_wheelhouse
 fi
 
+vdist_phase setup_install
+
 # If we have an installer, install our application inside our portable python
 # environment.
 if [ -f "setup.py" ]; then
@@ -109,6 +173,13 @@ else
     setup=false
 fi
 
+{% if prune_patterns %}
+vdist_phase prune
+prune_package_tree python $PYTHON_BASEDIR
+{% endif %}
+
+vdist_phase fpm
+
 cd /
 
 # Get rid of VCS info.
@@ -127,12 +198,16 @@ find {{package_tmp_root}} -type d -name '.svn' -print0 | xargs -0 rm -rf
 # If setup==true then we have installed our application inside our portable python
 # environment, so we package that environment.
 if $setup; then
-    {% if custom_filename %}
-        fpm -s dir -t rpm -n {{app}} -p {{package_tmp_root}}/{{custom_filename}} -v {{version}} {% for dep in runtime_deps %} --depends {{dep}} {% endfor %} {{fpm_args}} $PYTHON_BASEDIR
+    {% if package_formats %}
+        fpm_package_formats $PYTHON_BASEDIR
+    {% elif custom_filename %}
+        fpm -s dir -t rpm -n {{app}} -p {{package_tmp_root}}/{{custom_filename}} -v {{version}} {% for dep in runtime_deps %} --depends '{{dep}}' {% endfor %} {{fpm_args}} $PYTHON_BASEDIR
     {% else %}
-        fpm -s dir -t rpm -n {{app}} -p {{package_tmp_root}} -v {{version}} {% for dep in runtime_deps %} --depends {{dep}} {% endfor %} {{fpm_args}} $PYTHON_BASEDIR
+        fpm -s dir -t rpm -n {{app}} -p {{package_tmp_root}} -v {{version}} {% for dep in runtime_deps %} --depends '{{dep}}' {% endfor %} {{fpm_args}} $PYTHON_BASEDIR
     {% endif %}
+    {% if not package_formats %}
     cp {{package_tmp_root}}/*rpm {{shared_dir}}
+    {% endif %}
 # If setup==false then our application is in a different folder than our
 # portable python environment. So we package both: our application folder and
 # the one with our python package environment. In this case packager should use
@@ -141,12 +216,20 @@ if $setup; then
 else
     mkdir -p {{package_install_root}}/{{app}}
     cp -r {{package_tmp_root}}/{{app}}/* {{package_install_root}}/{{app}}/.
-    {% if custom_filename %}
-        fpm -s dir -t rpm -n {{app}} -p {{package_tmp_root}}/{{custom_filename}} -v {{version}} {% for dep in runtime_deps %} --depends {{dep}} {% endfor %} {{fpm_args}} {{package_install_root}}/{{project_root}} $PYTHON_BASEDIR
+    {% if package_formats %}
+        fpm_package_formats {{package_install_root}}/{{project_root}} $PYTHON_BASEDIR
+    {% elif custom_filename %}
+        fpm -s dir -t rpm -n {{app}} -p {{package_tmp_root}}/{{custom_filename}} -v {{version}} {% for dep in runtime_deps %} --depends '{{dep}}' {% endfor %} {{fpm_args}} {{package_install_root}}/{{project_root}} $PYTHON_BASEDIR
     {% else %}
-        fpm -s dir -t rpm -n {{app}} -p {{package_tmp_root}} -v {{version}} {% for dep in runtime_deps %} --depends {{dep}} {% endfor %} {{fpm_args}} {{package_install_root}}/{{project_root}} $PYTHON_BASEDIR
+        fpm -s dir -t rpm -n {{app}} -p {{package_tmp_root}} -v {{version}} {% for dep in runtime_deps %} --depends '{{dep}}' {% endfor %} {{fpm_args}} {{package_install_root}}/{{project_root}} $PYTHON_BASEDIR
     {% endif %}
+    {% if not package_formats %}
     cp {{package_tmp_root}}/*rpm {{shared_dir}}
+    {% endif %}
 fi
 
-chown -R {{local_uid}}:{{local_gid}} {{shared_dir}}
+vdist_phase cleanup
+
+# Give generated files back to host user. Sources may be mounted read-only
+# inside scratch folder, so leave that one alone.
+find {{shared_dir}} -mindepth 1 -maxdepth 1 ! -name {{scratch_folder_name}} -exec chown -R {{local_uid}}:{{local_gid}} {} +
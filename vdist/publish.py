@@ -0,0 +1,149 @@
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Dict, Iterator, List, Union
+
+import vdist.defaults as defaults
+import vdist.fingerprint as fingerprint
+
+MANIFEST_LOCK_FILE = '.vdist_manifest.lock'
+
+
+@contextlib.contextmanager
+def _locked_manifest(output_folder: str) -> Iterator[Dict[str, dict]]:
+    # Builds running at once may publish into the same folder, so manifest
+    # is read, updated and written while holding its lock.
+    with open(os.path.join(output_folder, MANIFEST_LOCK_FILE), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            manifest = read_manifest(output_folder)
+            yield manifest
+            write_atomically(os.path.join(output_folder,
+                                          defaults.MANIFEST_FILENAME),
+                             json.dumps(manifest, indent=4, sort_keys=True))
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_manifest(output_folder: str) -> Dict[str, dict]:
+    """ Read manifest of artifacts published in a folder.
+
+    :param output_folder: Folder artifacts were published to.
+    :return: Dict with checksum, size, build name and publication time of
+        every artifact, by file name.
+    """
+    try:
+        with open(os.path.join(output_folder, defaults.MANIFEST_FILENAME)) as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return {}
+
+
+def _get_temporary_path(path: str) -> str:
+    # Hidden and in the same folder, so it can be renamed to path.
+    folder, filename = os.path.split(path)
+    return os.path.join(folder, f'.{filename}.{uuid.uuid4().hex}.tmp')
+
+
+def write_atomically(path: str, contents: Union[str, bytes]) -> None:
+    """ Write a file through a rename, so it's never found half written.
+
+    :param path: Path of file to write.
+    :param contents: File text or bytes.
+    """
+    temporary_path = _get_temporary_path(path)
+    with open(temporary_path, 'wb' if isinstance(contents, bytes) else 'w') as f:
+        f.write(contents)
+    os.replace(temporary_path, path)
+
+
+def _link(source: str, destination: str) -> bool:
+    # Same filesystem: nothing to copy at all.
+    try:
+        os.link(source, destination)
+        return True
+    except OSError:
+        return False
+
+
+def place_atomically(source: str, destination: str,
+                     link: bool=True) -> None:
+    """ Hardlink or copy a file through a rename.
+
+    Readers of destination find either the former file or the whole new one,
+    never a half written one.
+
+    :param source: Path of file to place.
+    :param destination: Path to place file at.
+    :param link: Whether file can be hardlinked instead of copied.
+    """
+    temporary_path = _get_temporary_path(destination)
+    try:
+        if not (link and _link(source, temporary_path)):
+            shutil.copy2(source, temporary_path)
+        os.replace(temporary_path, destination)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temporary_path)
+        raise
+
+
+def _find_duplicate(manifest: Dict[str, dict], output_folder: str,
+                    digest: str, size: int) -> str:
+    for filename, entry in manifest.items():
+        if entry["sha256"] != digest:
+            continue
+        path = os.path.join(output_folder, filename)
+        # Manifest may be stale if someone touched folder by hand.
+        if os.path.isfile(path) and os.path.getsize(path) == size:
+            return path
+    return ''
+
+
+def publish_artifacts(files: List[str], output_folder: str, build_name: str,
+                      digests: Dict[str, str]=None,
+                      link: bool=True) -> List[str]:
+    """ Place artifacts in output folder and list them in its manifest.
+
+    Every artifact is placed through a rename, so concurrent builds and
+    readers never see half written files. Artifacts already in folder, under
+    the same name or another one, are not copied again but hardlinked.
+
+    :param files: Paths of artifacts to publish.
+    :param output_folder: Folder to publish artifacts to.
+    :param build_name: Name of build that generated artifacts.
+    :param digests: Known sha256 digests of artifacts, by file name.
+    :param link: Whether artifacts can be hardlinked instead of copied into
+        output folder.
+    :return: Paths of published artifacts.
+    """
+    logger = logging.getLogger('Publisher')
+    digests = digests or {}
+    os.makedirs(output_folder, exist_ok=True)
+    published_files = []
+    with _locked_manifest(output_folder) as manifest:
+        for file in files:
+            filename = os.path.basename(file)
+            digest = digests.get(filename) or fingerprint.get_file_digest(file)
+            size = os.path.getsize(file)
+            destination = os.path.join(output_folder, filename)
+            duplicate = _find_duplicate(manifest, output_folder, digest, size)
+            if duplicate == destination:
+                logger.info(f'{filename} already published, keeping it.')
+            elif duplicate:
+                logger.info(f'{filename} has same content as '
+                            f'{os.path.basename(duplicate)}, linking it.')
+                place_atomically(duplicate, destination)
+            else:
+                place_atomically(file, destination, link)
+            manifest[filename] = {"sha256": digest,
+                                  "size": size,
+                                  "build": build_name,
+                                  "published_at": time.time()}
+            published_files.append(destination)
+    return published_files
@@ -0,0 +1,76 @@
+import collections
+import contextlib
+import json
+import os
+import time
+from typing import Dict, Iterator, List
+
+import vdist.defaults as defaults
+
+
+@contextlib.contextmanager
+def timed(timings: Dict[str, float], name: str) -> Iterator[None]:
+    """ Add to timings how long the enclosed block took.
+
+    :param timings: Dict of seconds spent, by name.
+    :param name: Name to account block duration to.
+    """
+    started_at = time.time()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + time.time() - started_at
+
+
+def write_report(path: str, report: dict) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(json.dumps(report, indent=4, sort_keys=True))
+
+
+def _get_means(samples: List[Dict[str, float]]) -> Dict[str, float]:
+    values = collections.defaultdict(list)
+    for sample in samples:
+        for name, value in sample.items():
+            values[name].append(value)
+    return {name: sum(name_values) / len(name_values)
+            for name, name_values in values.items()}
+
+
+def get_batch_report(build_reports: List[dict], started_at: float,
+                     finished_at: float) -> dict:
+    """ Aggregate reports of a batch builds.
+
+    :param build_reports: Dicts of every build result, with their reports.
+    :param started_at: Batch start time.
+    :param finished_at: Batch end time.
+    :return: Batch report, with mean host and phase timings per profile, so
+        slowest phase of every profile is easy to spot.
+    """
+    profile_timings = collections.defaultdict(list)
+    profile_phases = collections.defaultdict(list)
+    for build_report in build_reports:
+        report = build_report.get("report")
+        if not report:
+            continue
+        profile_timings[report["profile"]].append(report["timings"])
+        profile_phases[report["profile"]].append(
+            {phase["name"]: phase["duration"] for phase in report["phases"]})
+    profiles = {profile: {"builds": len(profile_timings[profile]),
+                          "timings": _get_means(profile_timings[profile]),
+                          "phases": _get_means(profile_phases[profile])}
+                for profile in profile_timings}
+    return {"started_at": started_at,
+            "duration": finished_at - started_at,
+            "builds": build_reports,
+            "profiles": profiles}
+
+
+def write_batch_report(output_folders: List[str], batch_report: dict) -> List[str]:
+    report_paths = []
+    for output_folder in sorted(set(output_folders)):
+        report_path = os.path.join(output_folder,
+                                   defaults.BATCH_REPORT_FILENAME)
+        write_report(report_path, batch_report)
+        report_paths.append(report_path)
+    return report_paths
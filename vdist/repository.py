@@ -0,0 +1,510 @@
+import contextlib
+import email.utils
+import fcntl
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import struct
+import subprocess
+import tarfile
+import time
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape, quoteattr
+
+import vdist.publish as publish
+
+FORMAT_DEB = 'deb'
+FORMAT_RPM = 'rpm'
+FORMAT_PACMAN = 'pacman'
+POOL_DIR = 'pool'
+INDEX_FILE = 'index.json'
+LOCK_FILE = '.repository.lock'
+
+AR_MAGIC = b'!<arch>\n'
+# Name, modification time, owner, group, mode, size and end marker.
+AR_HEADER = struct.Struct('16s12s6s6s8s10s2s')
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+RPM_LEAD_SIZE = 96
+RPM_HEADER_MAGIC = b'\x8e\xad\xe8\x01'
+# Magic, reserved bytes, number of index entries and size of data store.
+RPM_HEADER_INTRO = struct.Struct('>4s4xII')
+# Tag, type, offset in data store and count.
+RPM_INDEX_ENTRY = struct.Struct('>IIII')
+RPM_TYPE_INT16 = 3
+RPM_TYPE_INT32 = 4
+RPM_TYPE_INT64 = 5
+RPM_TYPE_STRING = 6
+RPM_TYPE_STRING_ARRAY = 8
+RPM_TYPE_I18NSTRING = 9
+RPM_TAGS = {1000: 'name', 1001: 'version', 1002: 'release', 1003: 'epoch',
+            1004: 'summary', 1005: 'description', 1006: 'buildtime',
+            1007: 'buildhost', 1009: 'size', 1011: 'vendor', 1014: 'license',
+            1015: 'packager', 1016: 'group', 1020: 'url', 1022: 'arch',
+            1044: 'sourcerpm', 1046: 'archivesize', 1047: 'providename',
+            1048: 'requireflags', 1049: 'requirename', 1050: 'requireversion',
+            1112: 'provideflags', 1113: 'provideversion'}
+RPM_SENSE_FLAGS = {2: 'LT', 4: 'GT', 8: 'EQ', 10: 'LE', 12: 'GE'}
+
+PACMAN_LISTS = {'license': 'LICENSE', 'group': 'GROUPS',
+                'depend': 'DEPENDS', 'optdepend': 'OPTDEPENDS',
+                'makedepend': 'MAKEDEPENDS', 'checkdepend': 'CHECKDEPENDS',
+                'provides': 'PROVIDES', 'conflict': 'CONFLICTS',
+                'replaces': 'REPLACES'}
+
+
+def get_artifact_format(path: str) -> Optional[str]:
+    """ Tell which repository format an artifact belongs to.
+
+    :param path: Artifact path.
+    :return: deb, rpm or pacman, or None if artifact can't go into
+        repositories.
+    """
+    filename = os.path.basename(path)
+    if filename.endswith('.deb'):
+        return FORMAT_DEB
+    if filename.endswith('.rpm'):
+        return FORMAT_RPM
+    if '.pkg.tar' in filename:
+        return FORMAT_PACMAN
+    return None
+
+
+def _get_digests(path: str) -> Dict[str, str]:
+    digests = {'md5': hashlib.md5(), 'sha1': hashlib.sha1(),
+               'sha256': hashlib.sha256()}
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            for digest in digests.values():
+                digest.update(chunk)
+    return {name: digest.hexdigest() for name, digest in digests.items()}
+
+
+def _decompress_zstd(data: bytes) -> bytes:
+    # tarfile can't decompress zstd archives, so zstd command does it.
+    try:
+        return subprocess.run(['zstd', '-dcq'], input=data,
+                              stdout=subprocess.PIPE, check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise ValueError(f'Could not decompress zstd archive: {e}')
+
+
+def _read_tar_member(fileobj: BinaryIO, member_name: str) -> str:
+    # Archive is read as a stream, so packages are not loaded whole.
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for member in archive:
+            if os.path.normpath(member.name) == member_name:
+                return archive.extractfile(member).read().decode('utf8')
+    raise ValueError(f'No {member_name} found in archive')
+
+
+def _read_deb_control(path: str) -> str:
+    with open(path, 'rb') as f:
+        if f.read(len(AR_MAGIC)) != AR_MAGIC:
+            raise ValueError(f'Not a deb package: {path}')
+        while True:
+            header = f.read(AR_HEADER.size)
+            if len(header) < AR_HEADER.size:
+                raise ValueError(f'No control archive in: {path}')
+            fields = AR_HEADER.unpack(header)
+            name = fields[0].decode('ascii').strip().rstrip('/')
+            size = int(fields[5])
+            if name.startswith('control.tar'):
+                data = f.read(size)
+                if data.startswith(ZSTD_MAGIC):
+                    data = _decompress_zstd(data)
+                return _read_tar_member(io.BytesIO(data), 'control')
+            # Members are aligned to even offsets.
+            f.seek(size + size % 2, io.SEEK_CUR)
+
+
+def _read_control_field(control: str, field: str) -> str:
+    for line in control.splitlines():
+        key, _, value = line.partition(':')
+        if key == field:
+            return value.strip()
+    return ''
+
+
+def _read_deb_entry(path: str, digests: Dict[str, str]) -> Dict[str, str]:
+    control = _read_deb_control(path).strip()
+    # Packages index is a flat one, placed along with packages.
+    stanza = '\n'.join([control,
+                        f'Filename: ./{os.path.basename(path)}',
+                        f'Size: {os.path.getsize(path)}',
+                        f'MD5sum: {digests["md5"]}',
+                        f'SHA1: {digests["sha1"]}',
+                        f'SHA256: {digests["sha256"]}'])
+    return {"name": _read_control_field(control, 'Package'),
+            "version": _read_control_field(control, 'Version'),
+            "arch": _read_control_field(control, 'Architecture'),
+            "entry": stanza}
+
+
+def _get_rpm_value(store: bytes, _type: int, offset: int, count: int):
+    if _type == RPM_TYPE_INT16:
+        return list(struct.unpack_from(f'>{count}H', store, offset))
+    if _type == RPM_TYPE_INT32:
+        return list(struct.unpack_from(f'>{count}I', store, offset))
+    if _type == RPM_TYPE_INT64:
+        return list(struct.unpack_from(f'>{count}Q', store, offset))
+    if _type in (RPM_TYPE_STRING, RPM_TYPE_STRING_ARRAY, RPM_TYPE_I18NSTRING):
+        strings = []
+        for _ in range(count if _type != RPM_TYPE_STRING else 1):
+            end = store.index(b'\0', offset)
+            strings.append(store[offset:end].decode('utf8', 'replace'))
+            offset = end + 1
+        return strings[0] if _type != RPM_TYPE_STRING_ARRAY else strings
+    return store[offset:offset + count]
+
+
+def _read_rpm_header(f: BinaryIO, tags: Dict[int, str]=None) -> Tuple[dict, int]:
+    magic, entries, store_size = RPM_HEADER_INTRO.unpack(
+        f.read(RPM_HEADER_INTRO.size))
+    if magic != RPM_HEADER_MAGIC:
+        raise ValueError('Bad rpm header magic')
+    index = f.read(entries * RPM_INDEX_ENTRY.size)
+    store = f.read(store_size)
+    values = {}
+    for entry in range(entries):
+        tag, _type, offset, count = RPM_INDEX_ENTRY.unpack_from(
+            index, entry * RPM_INDEX_ENTRY.size)
+        if tags is not None and tag in tags:
+            values[tags[tag]] = _get_rpm_value(store, _type, offset, count)
+    return values, RPM_HEADER_INTRO.size + len(index) + store_size
+
+
+def _read_rpm_header_range(path: str) -> Tuple[dict, int, int]:
+    with open(path, 'rb') as f:
+        f.seek(RPM_LEAD_SIZE)
+        _, signature_size = _read_rpm_header(f)
+        # Header begins at next 8 bytes boundary.
+        header_start = RPM_LEAD_SIZE + signature_size + \
+            (8 - signature_size % 8) % 8
+        f.seek(header_start)
+        header, header_size = _read_rpm_header(f, RPM_TAGS)
+    return header, header_start, header_start + header_size
+
+
+def _get_rpm_dependencies(names: List[str], flags: List[int],
+                          versions: List[str]) -> str:
+    entries = []
+    for name, flag, version in zip(names, flags or [0] * len(names),
+                                   versions or [''] * len(names)):
+        # Those are met by rpm itself.
+        if name.startswith('rpmlib('):
+            continue
+        attributes = f'name={quoteattr(name)}'
+        sense = RPM_SENSE_FLAGS.get(flag & 0x0e)
+        if sense and version:
+            epoch, _, version = version.rpartition(':')
+            version, _, release = version.partition('-')
+            attributes += f' flags="{sense}" epoch="{epoch or 0}" ' \
+                          f'ver={quoteattr(version)}'
+            if release:
+                attributes += f' rel={quoteattr(release)}'
+        entries.append(f'<rpm:entry {attributes}/>')
+    return ''.join(entries)
+
+
+def _read_rpm_entry(path: str, digests: Dict[str, str]) -> Dict[str, str]:
+    header, header_start, header_end = _read_rpm_header_range(path)
+
+    def text(name: str) -> str:
+        return escape(str(header.get(name, '')))
+
+    epoch = header.get('epoch', [0])[0]
+    provides = _get_rpm_dependencies(header.get('providename', []),
+                                     header.get('provideflags'),
+                                     header.get('provideversion'))
+    requires = _get_rpm_dependencies(header.get('requirename', []),
+                                     header.get('requireflags'),
+                                     header.get('requireversion'))
+    package = (
+        f'<package type="rpm">'
+        f'<name>{text("name")}</name>'
+        f'<arch>{text("arch")}</arch>'
+        f'<version epoch="{epoch}" ver={quoteattr(header["version"])} '
+        f'rel={quoteattr(header["release"])}/>'
+        f'<checksum type="sha256" pkgid="YES">{digests["sha256"]}</checksum>'
+        f'<summary>{text("summary")}</summary>'
+        f'<description>{text("description")}</description>'
+        f'<packager>{text("packager")}</packager>'
+        f'<url>{text("url")}</url>'
+        f'<time file="{int(os.path.getmtime(path))}" '
+        f'build="{header.get("buildtime", [0])[0]}"/>'
+        f'<size package="{os.path.getsize(path)}" '
+        f'installed="{header.get("size", [0])[0]}" '
+        f'archive="{header.get("archivesize", [0])[0]}"/>'
+        f'<location href={quoteattr(os.path.basename(path))}/>'
+        f'<format>'
+        f'<rpm:license>{text("license")}</rpm:license>'
+        f'<rpm:vendor>{text("vendor")}</rpm:vendor>'
+        f'<rpm:group>{text("group")}</rpm:group>'
+        f'<rpm:buildhost>{text("buildhost")}</rpm:buildhost>'
+        f'<rpm:sourcerpm>{text("sourcerpm")}</rpm:sourcerpm>'
+        f'<rpm:header-range start="{header_start}" end="{header_end}"/>'
+        f'<rpm:provides>{provides}</rpm:provides>'
+        f'<rpm:requires>{requires}</rpm:requires>'
+        f'</format>'
+        f'</package>')
+    return {"name": header["name"],
+            "version": f'{header["version"]}-{header["release"]}',
+            "arch": header.get('arch', ''),
+            "entry": package}
+
+
+def _read_pacman_info(path: str) -> Dict[str, List[str]]:
+    with open(path, 'rb') as f:
+        if f.read(len(ZSTD_MAGIC)) == ZSTD_MAGIC:
+            f.seek(0)
+            package_info = _read_tar_member(
+                io.BytesIO(_decompress_zstd(f.read())), '.PKGINFO')
+        else:
+            f.seek(0)
+            package_info = _read_tar_member(f, '.PKGINFO')
+    info = {}
+    for line in package_info.splitlines():
+        if line.startswith('#') or ' = ' not in line:
+            continue
+        key, value = line.split(' = ', 1)
+        info.setdefault(key, []).append(value)
+    return info
+
+
+def _read_pacman_entry(path: str, digests: Dict[str, str]) -> Dict[str, str]:
+    info = _read_pacman_info(path)
+
+    def field(key: str) -> str:
+        return info.get(key, [''])[0]
+
+    fields = [('FILENAME', [os.path.basename(path)]),
+              ('NAME', [field('pkgname')]),
+              ('BASE', [field('pkgbase') or field('pkgname')]),
+              ('VERSION', [field('pkgver')]),
+              ('DESC', [field('pkgdesc')]),
+              ('CSIZE', [str(os.path.getsize(path))]),
+              ('ISIZE', [field('size')]),
+              ('MD5SUM', [digests['md5']]),
+              ('SHA256SUM', [digests['sha256']]),
+              ('URL', [field('url')]),
+              ('ARCH', [field('arch')]),
+              ('BUILDDATE', [field('builddate')]),
+              ('PACKAGER', [field('packager')])]
+    fields.extend((name, info[key]) for key, name in PACMAN_LISTS.items()
+                  if key in info)
+    desc = ''.join(f'%{name}%\n' + ''.join(f'{value}\n' for value in values)
+                   + '\n' for name, values in fields if any(values))
+    return {"name": field('pkgname'), "version": field('pkgver'),
+            "arch": field('arch'), "entry": desc}
+
+
+ENTRY_READERS = {FORMAT_DEB: _read_deb_entry,
+                 FORMAT_RPM: _read_rpm_entry,
+                 FORMAT_PACMAN: _read_pacman_entry}
+
+
+def _gzip(data: bytes) -> bytes:
+    # No timestamp, so same index always compresses to same bytes.
+    return gzip.compress(data, mtime=0)
+
+
+def _write_deb_index(folder: str, entries: List[dict]) -> None:
+    packages = ''.join(f'{entry["entry"]}\n\n' for entry in entries)
+    packages_data = packages.encode('utf8')
+    packages_gz_data = _gzip(packages_data)
+    architectures = sorted({entry['arch'] for entry in entries})
+    release = [f'Date: {email.utils.formatdate(usegmt=True)}',
+               f'Architectures: {" ".join(architectures)}',
+               'SHA256:']
+    for name, data in (('Packages', packages_data),
+                       ('Packages.gz', packages_gz_data)):
+        release.append(f' {hashlib.sha256(data).hexdigest()} {len(data)} {name}')
+    publish.write_atomically(os.path.join(folder, 'Packages'), packages_data)
+    publish.write_atomically(os.path.join(folder, 'Packages.gz'),
+                            packages_gz_data)
+    # Release goes last, so it never lists indexes not written yet.
+    publish.write_atomically(os.path.join(folder, 'Release'),
+                             '\n'.join(release) + '\n')
+
+
+def _write_rpm_index(folder: str, entries: List[dict]) -> None:
+    repodata = os.path.join(folder, 'repodata')
+    os.makedirs(repodata, exist_ok=True)
+    primary = ''.join(
+        ['<?xml version="1.0" encoding="UTF-8"?>\n',
+         '<metadata xmlns="http://linux.duke.edu/metadata/common" '
+         'xmlns:rpm="http://linux.duke.edu/metadata/rpm" '
+         f'packages="{len(entries)}">\n'] +
+        [f'{entry["entry"]}\n' for entry in entries] +
+        ['</metadata>\n'])
+    primary_data = primary.encode('utf8')
+    primary_gz_data = _gzip(primary_data)
+    timestamp = int(time.time())
+    publish.write_atomically(os.path.join(repodata, 'primary.xml.gz'),
+                            primary_gz_data)
+    publish.write_atomically(os.path.join(repodata, 'repomd.xml'), ''.join([
+        '<?xml version="1.0" encoding="UTF-8"?>\n',
+        '<repomd xmlns="http://linux.duke.edu/metadata/repo" '
+        'xmlns:rpm="http://linux.duke.edu/metadata/rpm">\n',
+        f'<revision>{timestamp}</revision>\n',
+        '<data type="primary">',
+        f'<checksum type="sha256">'
+        f'{hashlib.sha256(primary_gz_data).hexdigest()}</checksum>',
+        f'<open-checksum type="sha256">'
+        f'{hashlib.sha256(primary_data).hexdigest()}</open-checksum>',
+        '<location href="repodata/primary.xml.gz"/>',
+        f'<timestamp>{timestamp}</timestamp>',
+        f'<size>{len(primary_gz_data)}</size>',
+        f'<open-size>{len(primary_data)}</open-size>',
+        '</data>\n',
+        '</repomd>\n']))
+
+
+def _write_pacman_index(folder: str, entries: List[dict]) -> None:
+    # Database is named after repository, that is, after profile.
+    repository_name = os.path.basename(os.path.dirname(folder))
+    database = io.BytesIO()
+    with tarfile.open(fileobj=database, mode='w:gz') as archive:
+        for entry in entries:
+            data = entry['entry'].encode('utf8')
+            member = tarfile.TarInfo(f'{entry["name"]}-{entry["version"]}/desc')
+            member.size = len(data)
+            member.mtime = int(entry['added_at'])
+            archive.addfile(member, io.BytesIO(data))
+    database_path = os.path.join(folder, f'{repository_name}.db.tar.gz')
+    publish.write_atomically(database_path, database.getvalue())
+    link_path = os.path.join(folder, f'{repository_name}.db')
+    if not os.path.islink(link_path):
+        os.symlink(os.path.basename(database_path), link_path)
+
+
+INDEX_WRITERS = {FORMAT_DEB: _write_deb_index,
+                 FORMAT_RPM: _write_rpm_index,
+                 FORMAT_PACMAN: _write_pacman_index}
+
+
+class Repository(object):
+    """ Local package repository, laid out per profile and architecture.
+
+    Every package is kept just once, named after its sha256, in repository
+    pool, and hardlinked from every profile and architecture folder it was
+    published to, along with apt (Packages), yum (repodata) or pacman (db)
+    indexes. Every folder keeps the index entry of each of its packages, so
+    publishing new packages only reads those new ones, however many packages
+    folder already had.
+    """
+
+    def __init__(self, root: str):
+        self.logger = logging.getLogger('Repository')
+        self.root = root
+
+    def get_folder(self, profile: str, arch: str) -> str:
+        return os.path.join(self.root, profile, arch or 'noarch')
+
+    def _get_pool_path(self, digest: str) -> str:
+        return os.path.join(self.root, POOL_DIR, digest[:2], digest)
+
+    @contextlib.contextmanager
+    def _lock(self) -> Iterator[None]:
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, LOCK_FILE), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def read_index(folder: str) -> Dict[str, dict]:
+        """ Read index entries of packages in a repository folder.
+
+        :param folder: Profile and architecture folder.
+        :return: Format, sha256, architecture and index entry of every
+            package, by file name.
+        """
+        try:
+            with open(os.path.join(folder, INDEX_FILE)) as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return {}
+
+    def _read_entry(self, path: str) -> dict:
+        artifact_format = get_artifact_format(path)
+        digests = _get_digests(path)
+        entry = ENTRY_READERS[artifact_format](path, digests)
+        entry.update({"format": artifact_format, "sha256": digests['sha256'],
+                      "added_at": time.time()})
+        return entry
+
+    def _place_package(self, path: str, folder: str, digest: str) -> str:
+        pool_path = self._get_pool_path(digest)
+        if not os.path.isfile(pool_path):
+            os.makedirs(os.path.dirname(pool_path), exist_ok=True)
+            # Copied, so nothing done to source can spoil pool.
+            publish.place_atomically(path, pool_path, link=False)
+        destination = os.path.join(folder, os.path.basename(path))
+        if not (os.path.isfile(destination) and
+                os.path.samefile(destination, pool_path)):
+            publish.place_atomically(pool_path, destination)
+        return destination
+
+    def _discard_unused(self, digest: str) -> None:
+        # Pool files no folder links anymore are not needed.
+        pool_path = self._get_pool_path(digest)
+        with contextlib.suppress(OSError):
+            if os.stat(pool_path).st_nlink == 1:
+                os.remove(pool_path)
+
+    def add_packages(self, profile: str, files: List[str]) -> List[str]:
+        """ Publish packages into repository and update its indexes.
+
+        :param profile: Build profile packages were built for.
+        :param files: Paths of built artifacts. Those that are not deb, rpm
+            nor pacman packages are ignored.
+        :return: Paths of packages in repository.
+        """
+        entries = {}
+        for file in files:
+            if get_artifact_format(file) is None:
+                self.logger.info(f'{os.path.basename(file)} is not a '
+                                 f'package, not adding it to repository.')
+                continue
+            # Packages are read before locking, so concurrent builds don't
+            # wait for each other to do so.
+            entries[file] = self._read_entry(file)
+        added_files = []
+        with self._lock():
+            updated_indexes = {}
+            for file, entry in entries.items():
+                folder = self.get_folder(profile, entry["arch"])
+                os.makedirs(folder, exist_ok=True)
+                if folder not in updated_indexes:
+                    updated_indexes[folder] = (self.read_index(folder), set())
+                index, formats = updated_indexes[folder]
+                added_files.append(self._place_package(file, folder,
+                                                       entry["sha256"]))
+                replaced_entry = index.get(os.path.basename(file))
+                index[os.path.basename(file)] = entry
+                if replaced_entry is not None and \
+                        replaced_entry["sha256"] != entry["sha256"]:
+                    self._discard_unused(replaced_entry["sha256"])
+                formats.add(entry["format"])
+            for folder, (index, formats) in updated_indexes.items():
+                self._write_indexes(folder, index, formats)
+        return added_files
+
+    def _write_indexes(self, folder: str, index: Dict[str, dict],
+                       formats: set) -> None:
+        # Only indexes of formats just published are written again.
+        for artifact_format in sorted(formats):
+            format_entries = [index[filename] for filename in sorted(index)
+                              if index[filename]["format"] == artifact_format]
+            self.logger.info(f'Updating {artifact_format} index of {folder} '
+                             f'({len(format_entries)} packages)')
+            INDEX_WRITERS[artifact_format](folder, format_entries)
+        publish.write_atomically(os.path.join(folder, INDEX_FILE),
+                                 json.dumps(index, indent=4, sort_keys=True))
@@ -0,0 +1,209 @@
+import concurrent.futures as futures
+import json
+import logging
+import multiprocessing
+import os
+import time
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import vdist.configuration as configuration
+import vdist.defaults as defaults
+
+
+class BuildResources(object):
+
+    def __init__(self, cpus: float, memory: int):
+        self.cpus = cpus
+        self.memory = memory
+
+    def __str__(self):
+        return f'{self.cpus} cpus, {self.memory // 1024 ** 2} MB'
+
+
+class BuildJob(object):
+
+    def __init__(self, name: str, _configuration: configuration.Configuration,
+                 resources: BuildResources, duration: float, compiles: bool,
+                 cost_key: str):
+        self.name = name
+        self.configuration = _configuration
+        self.resources = resources
+        # Expected duration in seconds, only used to sort jobs.
+        self.duration = duration
+        self.compiles = compiles
+        self.cost_key = cost_key
+        self.started_at = None
+        self.finished_at = None
+
+    def __str__(self):
+        return str(self.__dict__)
+
+
+class BuildCostModel(object):
+    """ Estimates resources and duration of builds.
+
+    Resources depend on whether a build compiles Python or only packages.
+    Durations are learnt from previous batches, per profile and compile mode,
+    and fall back to static estimates for builds never seen before.
+    """
+
+    # Weight of last observed duration in learnt duration moving average.
+    LEARNING_RATE = 0.5
+
+    def __init__(self, history_file: str=defaults.BUILD_TIMES_FILE):
+        self.logger = logging.getLogger('BuildCostModel')
+        self.history_file = history_file
+        self.history = self._load_history()
+
+    def _load_history(self) -> Dict[str, float]:
+        try:
+            with open(self.history_file) as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return {}
+
+    def save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.history_file), exist_ok=True)
+            with open(self.history_file, 'w') as f:
+                f.write(json.dumps(self.history, indent=4, sort_keys=True))
+        except OSError as e:
+            self.logger.warning(f'Could not save build times: {e}')
+
+    @staticmethod
+    def get_cost_key(_configuration: configuration.Configuration) -> str:
+        parameters = _configuration.builder_parameters
+        mode = "compile" if parameters.get("compile_python", True) else "package"
+        return f'{parameters.get("profile")}:{mode}'
+
+    def estimate(self, name: str,
+                 _configuration: configuration.Configuration) -> BuildJob:
+        compiles = _configuration.builder_parameters.get("compile_python", True)
+        cost_key = self.get_cost_key(_configuration)
+        if compiles:
+            resources = BuildResources(defaults.COMPILE_JOB_CPUS,
+                                       defaults.COMPILE_JOB_MEMORY)
+            duration = defaults.COMPILE_JOB_DURATION
+        else:
+            resources = BuildResources(defaults.PACKAGING_JOB_CPUS,
+                                       defaults.PACKAGING_JOB_MEMORY)
+            duration = defaults.PACKAGING_JOB_DURATION
+        duration = self.history.get(cost_key, duration)
+        return BuildJob(name, _configuration, resources, duration, compiles,
+                        cost_key)
+
+    def record(self, job: BuildJob) -> None:
+        observed_duration = job.finished_at - job.started_at
+        previous_duration = self.history.get(job.cost_key, observed_duration)
+        self.history[job.cost_key] = \
+            self.LEARNING_RATE * observed_duration + \
+            (1 - self.LEARNING_RATE) * previous_duration
+
+
+def get_host_memory() -> int:
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        # Not every platform offers those sysconf names.
+        return defaults.COMPILE_JOB_MEMORY * multiprocessing.cpu_count()
+
+
+class BuildScheduler(object):
+    """ Runs build jobs longest first, while their summed resources fit in
+    host budget.
+
+    Compiling jobs are capped apart because they are the ones that saturate
+    CPUs and memory. When a job does not fit, shorter ones behind it are tried
+    so that free resources are not wasted.
+    """
+
+    def __init__(self, max_cpus: float=None, max_memory: int=None,
+                 max_compiles: int=None, cost_model: BuildCostModel=None):
+        self.logger = logging.getLogger('BuildScheduler')
+        self.max_cpus = max_cpus or multiprocessing.cpu_count()
+        self.max_memory = max_memory or \
+            int(get_host_memory() * defaults.HOST_MEMORY_SHARE)
+        self.max_compiles = max_compiles or \
+            max(1, int(self.max_cpus // defaults.COMPILE_JOB_CPUS))
+        self.cost_model = cost_model or BuildCostModel()
+        self.jobs = []
+        self.cancelled = False
+
+    @property
+    def max_jobs(self) -> int:
+        return max(1, int(self.max_cpus // defaults.PACKAGING_JOB_CPUS))
+
+    def add(self, name: str, _configuration: configuration.Configuration) -> BuildJob:
+        job = self.cost_model.estimate(name, _configuration)
+        # No container should be granted more than the whole budget.
+        job.resources.cpus = min(job.resources.cpus, self.max_cpus)
+        job.resources.memory = min(job.resources.memory, self.max_memory)
+        self.jobs.append(job)
+        return job
+
+    def _fits(self, job: BuildJob, running: List[BuildJob]) -> bool:
+        if not running:
+            return True
+        used_cpus = sum(running_job.resources.cpus for running_job in running)
+        used_memory = sum(running_job.resources.memory for running_job in running)
+        running_compiles = len([running_job for running_job in running
+                                if running_job.compiles])
+        if job.compiles and running_compiles >= self.max_compiles:
+            return False
+        return used_cpus + job.resources.cpus <= self.max_cpus and \
+            used_memory + job.resources.memory <= self.max_memory and \
+            len(running) < self.max_jobs
+
+    def next_jobs(self, pending: List[BuildJob],
+                  running: List[BuildJob]) -> List[BuildJob]:
+        """ Pick pending jobs that can be started right now.
+
+        :param pending: Jobs not started yet, longest first.
+        :param running: Jobs already started.
+        :return: Jobs to start, in the order they should be started.
+        """
+        admitted = []
+        for job in pending:
+            if self._fits(job, running + admitted):
+                admitted.append(job)
+        return admitted
+
+    def cancel(self) -> None:
+        """ Stop submitting jobs. Jobs not started yet are yielded with
+        cancelled futures. """
+        self.cancelled = True
+
+    def run(self, submit: Callable[[BuildJob], futures.Future]) -> Iterator[Tuple[BuildJob, futures.Future]]:
+        """ Submit jobs as resources get freed and yield them as they finish.
+
+        :param submit: Callable that starts given job and returns its future.
+        :return: Iterator of (job, future) tuples for finished jobs.
+        """
+        pending = sorted(self.jobs, key=lambda job: job.duration, reverse=True)
+        running = {}
+        while pending or running:
+            if self.cancelled:
+                for job in pending:
+                    future = futures.Future()
+                    future.cancel()
+                    yield job, future
+                pending = []
+                # Futures executors did not start yet can still be cancelled.
+                for future in running:
+                    future.cancel()
+                if not running:
+                    break
+            for job in self.next_jobs(pending, list(running.values())):
+                pending.remove(job)
+                self.logger.info(f'Starting {job.name} with {job.resources}')
+                job.started_at = time.time()
+                running[submit(job)] = job
+            finished, _ = futures.wait(running,
+                                       return_when=futures.FIRST_COMPLETED)
+            for future in finished:
+                job = running.pop(future)
+                job.finished_at = time.time()
+                if not future.cancelled() and future.exception() is None:
+                    self.cost_model.record(job)
+                yield job, future
+        self.cost_model.save()
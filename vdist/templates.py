@@ -0,0 +1,115 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, meta
+
+import vdist.defaults as defaults
+
+INTERNAL_TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'profiles')
+
+_lock = threading.Lock()
+# Environments by local profiles folder. Every environment keeps the
+# templates it compiled, so each template is compiled once per process.
+_environments = {}
+# Rendered scripts, least recently used first.
+_rendered_scripts = collections.OrderedDict()
+
+
+def _get_bytecode_cache() -> Optional[FileSystemBytecodeCache]:
+    # Shared by every vdist process, so not even a first build compiles
+    # templates from scratch.
+    try:
+        os.makedirs(defaults.TEMPLATE_CACHE_DIR, exist_ok=True)
+    except OSError as e:
+        logging.getLogger('Templates').warning(
+            f'Templates bytecode cache disabled: {e}')
+        return None
+    return FileSystemBytecodeCache(defaults.TEMPLATE_CACHE_DIR)
+
+
+def get_environment(profiles_dir: str) -> Environment:
+    """ Get template environment of a local profiles folder.
+
+    :param profiles_dir: Folder where local profiles and templates are.
+    :return: Environment loading templates from internal profiles folder and
+        from given one. Same folder always gets same environment.
+    """
+    local_template_dir = os.path.abspath(profiles_dir)
+    with _lock:
+        if local_template_dir not in _environments:
+            _environments[local_template_dir] = Environment(
+                loader=FileSystemLoader([INTERNAL_TEMPLATE_DIR,
+                                         local_template_dir]),
+                bytecode_cache=_get_bytecode_cache())
+        return _environments[local_template_dir]
+
+
+def get_source_digest(environment: Environment, template_name: str) -> str:
+    """ Get digest of a template source and of every template it includes.
+
+    :param environment: Environment to load templates from.
+    :param template_name: Name of template to digest.
+    :return: sha256 hex digest. Local overrides of included partials change
+        it too.
+    """
+    digest = hashlib.sha256()
+    pending_names = [template_name]
+    seen_names = set()
+    while pending_names:
+        name = pending_names.pop(0)
+        if name in seen_names:
+            continue
+        seen_names.add(name)
+        source, _, _ = environment.loader.get_source(environment, name)
+        digest.update(f"{name}\0{source}\0".encode("utf8"))
+        # Templates included through expressions can't be found this way,
+        # but ours only include literal names.
+        pending_names.extend(sorted(
+            referenced_name for referenced_name
+            in meta.find_referenced_templates(environment.parse(source))
+            if referenced_name is not None))
+    return digest.hexdigest()
+
+
+def _get_templates_state(environment: Environment) -> int:
+    # Changing any template, or any partial it includes, changes this, so
+    # scripts rendered before are not used anymore.
+    state = []
+    for folder in environment.loader.searchpath:
+        try:
+            entries = list(os.scandir(folder))
+        except OSError:
+            continue
+        state.extend((entry.path, entry.stat().st_mtime_ns,
+                      entry.stat().st_size)
+                     for entry in entries if entry.is_file())
+    return hash(tuple(sorted(state)))
+
+
+def render(environment: Environment, template_name: str,
+           parameters: Dict[str, object]) -> str:
+    """ Render a template, reusing scripts already rendered with the same
+    parameters.
+
+    :param environment: Environment to load template from.
+    :param template_name: Name of template to render.
+    :param parameters: Template variables. They must be JSON serializable.
+    :return: Rendered template.
+    """
+    key = (id(environment), template_name, _get_templates_state(environment),
+           json.dumps(parameters, sort_keys=True, default=str))
+    with _lock:
+        if key in _rendered_scripts:
+            _rendered_scripts.move_to_end(key)
+            return _rendered_scripts[key]
+    script = environment.get_template(template_name).render(**parameters)
+    with _lock:
+        _rendered_scripts[key] = script
+        while len(_rendered_scripts) > defaults.RENDER_CACHE_SIZE:
+            _rendered_scripts.popitem(last=False)
+    return script
@@ -5,18 +5,34 @@
 # after installing vdist package. If you try to run vdist_launcher.py directly
 # you are going to get ImportError unless you add vdist main folder (the
 # one with setup.py) to PYTHONPATH.
+import collections
+import copy
 import concurrent.futures as futures
 import contextlib
-import multiprocessing
+import logging
+import os
+import subprocess
 import sys
+import threading
 import time
 import traceback
-from typing import Dict, List
+import uuid
+from typing import Dict, List, Optional, Set
 
+import vdist.cache as cache
 import vdist.console_parser as console_parser
 import vdist.configuration as configuration
 import vdist.defaults as defaults
 import vdist.builder as builder
+import vdist.buildmachine as buildmachine
+import vdist.engine as engine
+import vdist.grouping as grouping
+import vdist.localmachine as localmachine
+import vdist.mirror as mirror
+import vdist.podmanmachine as podmanmachine
+import vdist.pool as pool
+import vdist.report as report
+import vdist.scheduler as scheduler
 
 
 def _get_build_configurations(arguments: Dict[str, str]) -> Dict[str, configuration.Configuration]:
@@ -27,6 +43,11 @@ def _get_build_configurations(arguments: Dict[str, str]) -> Dict[str, configurat
             configurations = configuration.read(arguments["configuration_file"])
     except KeyError:
         configurations = _load_default_configuration(arguments)
+    # Console overrides whatever configuration file said.
+    for argument in ("log_dir", "executor", "repository_dir"):
+        if arguments.get(argument) is not None:
+            for _configuration in configurations.values():
+                setattr(_configuration, argument, arguments[argument])
     return configurations
 
 
@@ -37,24 +58,369 @@ def _load_default_configuration(arguments: Dict[str, str]) -> Dict[str, configur
     return configurations
 
 
-def run_builds(configurations: Dict[str, configuration.Configuration]) -> None:
-    with futures.ProcessPoolExecutor(max_workers=multiprocessing.cpu_count()) as executor:
-        workers = []
-        for _configuration in configurations:
-            print(f"Starting building process for {_configuration}")
-            worker = executor.submit(builder.build_package, configurations[_configuration])
-            workers.append(worker)
-            print(f"Started building process for {_configuration}")
-        print_results(workers)
+def run_builds(configurations: Dict[str, configuration.Configuration],
+               pool_size: int=defaults.MACHINE_POOL_SIZE,
+               build_scheduler: scheduler.BuildScheduler=None,
+               force: bool=False,
+               fail_fast: bool=False,
+               engine_type: str=defaults.BUILD_ENGINE,
+               build_timeout: float=None,
+               group_builds: bool=True) -> List[builder.BuildResult]:
+    started_at = time.time()
+    if build_scheduler is None:
+        build_scheduler = scheduler.BuildScheduler()
+    for _configuration in configurations:
+        build_scheduler.add(_configuration, configurations[_configuration])
+    _pin_git_sources(configurations)
+    profiles = builder.load_profiles()
+    if group_builds:
+        _bake_group_base_images(configurations, profiles)
+    # Every container of this batch gets this label, so we can kill them
+    # whatever process started them.
+    batch_labels = {defaults.BATCH_LABEL: uuid.uuid4().hex}
+    machine_pool = _start_machine_pool(configurations, profiles, pool_size,
+                                       batch_labels)
+    executors = {_get_executor(_configuration, profiles)
+                 for _configuration in configurations.values()}
+    # Local and podman machines enforce timeouts themselves, so only docker
+    # ones need an engine able to.
+    build_engine = _start_build_engine(
+        engine_type,
+        build_timeout if builder.EXECUTOR_DOCKER in executors else None)
+    results = []
+    try:
+        with _get_build_executor(build_engine, build_scheduler.max_jobs) as executor:
+            def submit(job: scheduler.BuildJob) -> futures.Future:
+                print(f"Starting building process for {job.name} "
+                      f"({job.resources})")
+                if build_engine is not None:
+                    return executor.submit(_build_package_in_thread,
+                                           job.name,
+                                           job.configuration,
+                                           _get_machine_pool_for(job.configuration,
+                                                                 profiles,
+                                                                 machine_pool),
+                                           job.resources,
+                                           force,
+                                           batch_labels,
+                                           build_engine,
+                                           build_timeout)
+                return executor.submit(builder.build_package,
+                                       job.configuration,
+                                       _get_machine_pool_for(job.configuration,
+                                                             profiles,
+                                                             machine_pool),
+                                       job.resources,
+                                       force,
+                                       batch_labels,
+                                       None,
+                                       build_timeout)
+            for job, future in build_scheduler.run(submit):
+                result = _get_build_result(job, future,
+                                           build_scheduler.cancelled)
+                print_result(result)
+                results.append(result)
+                if fail_fast and result.status == builder.BuildResult.FAILED \
+                        and not build_scheduler.cancelled:
+                    print(f"{job.name} failed. Cancelling remaining builds.")
+                    build_scheduler.cancel()
+                    _kill_build_machines(executors, batch_labels,
+                                         build_engine)
+    finally:
+        if machine_pool is not None:
+            machine_pool.shutdown()
+        if build_engine is not None:
+            build_engine.close()
+    print_summary(results)
+    batch_report = report.get_batch_report(
+        [result.to_dict() for result in results], started_at, time.time())
+    for report_path in report.write_batch_report(
+            [_configuration.output_folder
+             for _configuration in configurations.values()],
+            batch_report):
+        print(f"Build report written to {report_path}")
+    return results
+
+
+def _start_build_engine(engine_type: str,
+                        build_timeout: float=None) -> Optional[engine.BuildEngine]:
+    if engine_type not in defaults.BUILD_ENGINES:
+        raise ValueError(f'unknown build engine: {engine_type}')
+    unsupported_setup = engine.get_unsupported_setup() \
+        if engine_type == "asyncio" else None
+    if unsupported_setup is not None:
+        if build_timeout is not None:
+            raise ValueError(f'docker build timeouts need asyncio build '
+                             f'engine, but {unsupported_setup} by it')
+        print(f"Using process build engine, because {unsupported_setup} "
+              f"by asyncio one")
+        engine_type = "process"
+    if engine_type == "process":
+        if build_timeout is not None:
+            raise ValueError('docker build timeouts need asyncio build engine')
+        return None
+    # Every build runs in a thread of this process, so they can't have a
+    # logging format of their own. Thread names tell their lines apart.
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s [%(threadName)s] %(name)s %(message)s',
+        level=logging.INFO)
+    build_engine = engine.BuildEngine(build_timeout=build_timeout)
+    build_engine.start()
+    return build_engine
+
+
+def _get_build_executor(build_engine: Optional[engine.BuildEngine],
+                        max_jobs: int) -> futures.Executor:
+    # Builds driven by engine only wait for its loop, so threads are enough.
+    if build_engine is not None:
+        return futures.ThreadPoolExecutor(max_workers=max_jobs)
+    return futures.ProcessPoolExecutor(max_workers=max_jobs)
+
+
+def _kill_build_machines(executors: Set[str], batch_labels: Dict[str, str],
+                         build_engine: Optional[engine.BuildEngine]) -> None:
+    if build_engine is not None:
+        build_engine.cancel()
+    elif builder.EXECUTOR_DOCKER in executors:
+        buildmachine.kill_containers(batch_labels)
+    # Neither kind of machine is driven by engine, so they are killed by
+    # labels whatever engine is used.
+    if builder.EXECUTOR_PODMAN in executors:
+        podmanmachine.kill_containers(batch_labels)
+    if builder.EXECUTOR_LOCAL in executors:
+        localmachine.kill_machines(batch_labels)
+
+
+def _build_package_in_thread(name: str, *args) -> builder.BuildResult:
+    threading.current_thread().name = name
+    return builder.build_package(*args)
+
+
+def _get_build_result(job: scheduler.BuildJob, future: futures.Future,
+                      cancelling: bool) -> builder.BuildResult:
+    if future.cancelled():
+        return builder.BuildResult(job.name, builder.BuildResult.CANCELLED, 0)
+    duration = job.finished_at - job.started_at
+    error = future.exception()
+    if error is None:
+        return future.result()
+    # Once batch is cancelled, builds fail because we killed them.
+    status = builder.BuildResult.CANCELLED if cancelling \
+        else builder.BuildResult.FAILED
+    return builder.BuildResult(job.name, status, duration, error=str(error))
+
+
+def _pin_git_sources(configurations: Dict[str, configuration.Configuration]) -> None:
+    # Fetch every repository once and resolve branches before builds start,
+    # so builds of the same repository share that fetch and package the same
+    # commit.
+    fetched_uris = set()
+    for _configuration in configurations.values():
+        source = _configuration.builder_parameters.get("source")
+        if source is None or source["type"] != "git":
+            continue
+        try:
+            if source["uri"] not in fetched_uris:
+                mirror.GitMirror(source["uri"]).update()
+                fetched_uris.add(source["uri"])
+            mirror.pin_git_source(source, fetch=False)
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            # Leave it to its build, which will report the error.
+            print(f"Could not fetch {source['uri']}: {e}")
+
+
+def _bake_group_base_images(configurations: Dict[str, configuration.Configuration],
+                            profiles: Dict[str, builder.BuildProfile]) -> None:
+    # Builds compiling the same Python get a base image with it, and with
+    # requirements all of them have, baked once before they start. So they
+    # only install their own requirements.
+    groups = grouping.plan_groups(configurations, profiles)
+    if not groups:
+        return
+    bake_configurations = {}
+    for group in groups:
+        print(f"Baking shared base image for {group}")
+        bake_configuration = copy.deepcopy(configurations[group.names[0]])
+        bake_configuration.builder_parameters["base_requirements"] = \
+            group.common_requirements
+        bake_configurations[group.key] = bake_configuration
+    with futures.ThreadPoolExecutor(max_workers=len(groups)) as executor:
+        bakes = {executor.submit(builder.bake_base_image,
+                                 bake_configurations[group.key]): group
+                 for group in groups}
+        for future in futures.as_completed(bakes):
+            group = bakes[future]
+            try:
+                print(f"Base image {future.result()} ready for "
+                      f"{', '.join(group.names)}")
+            except Exception as e:
+                # Its builds won't find a base image, so they are left as
+                # they were: they compile Python by themselves, on pooled
+                # machines if they can.
+                print(f"Could not bake shared base image for "
+                      f"{', '.join(group.names)}: {e}")
+                continue
+            for name in group.names:
+                configurations[name].builder_parameters["base_requirements"] = \
+                    group.common_requirements
+
+
+def _is_poolable(_configuration: configuration.Configuration,
+                 profiles: Dict[str, builder.BuildProfile]) -> bool:
+    # Builds that don't compile Python install their dependencies in the
+    # interpreter that comes with the image, and build_deps are installed
+    # system wide, so those builds can't share a machine. Only docker builds
+    # can be run by pooled machines. Builds of a group whose base image was
+    # baked run on that image instead, so for them grouping takes the place
+    # of pooling. Pools are left to builds of an image that compile other
+    # Pythons, or whose group could not be baked.
+    parameters = _configuration.builder_parameters
+    if parameters.get("profile") not in profiles or \
+            "base_requirements" in parameters or \
+            parameters.get("build_deps"):
+        return False
+    return _get_executor(_configuration, profiles) == builder.EXECUTOR_DOCKER \
+        and parameters.get("compile_python", True)
+
+
+def _get_executor(_configuration: configuration.Configuration,
+                  profiles: Dict[str, builder.BuildProfile]) -> str:
+    if _configuration.executor is not None:
+        return _configuration.executor
+    profile = profiles.get(_configuration.builder_parameters.get("profile"))
+    return profile.executor if profile is not None else builder.EXECUTOR_DOCKER
+
+
+def _start_machine_pool(configurations: Dict[str, configuration.Configuration],
+                        profiles: Dict[str, builder.BuildProfile],
+                        pool_size: int,
+                        labels: Dict[str, str]=None) -> Optional[pool.MachinePool]:
+    if pool_size <= 0:
+        return None
+    images = collections.Counter(
+        profiles[_configuration.builder_parameters["profile"]].docker_image
+        for _configuration in configurations.values()
+        if _is_poolable(_configuration, profiles))
+    # A machine would be started for nothing if only one build uses it.
+    images = {image: builds for image, builds in images.items() if builds > 1}
+    if not images:
+        return None
+    machine_pool = pool.MachinePool(max_size=pool_size,
+                                    binds=builder.get_machine_binds(),
+                                    labels=labels)
+    for image, builds in images.items():
+        machine_pool.add_image(image, builds)
+    print(f"Starting machine pool for: {', '.join(images)}")
+    try:
+        machine_pool.start()
+    except Exception:
+        machine_pool.shutdown()
+        raise
+    return machine_pool
+
+
+def _get_machine_pool_for(_configuration: configuration.Configuration,
+                          profiles: Dict[str, builder.BuildProfile],
+                          machine_pool: Optional[pool.MachinePool]) -> Optional[pool.MachinePool]:
+    if machine_pool is None:
+        return None
+    if not _is_poolable(_configuration, profiles):
+        return None
+    image = profiles[_configuration.builder_parameters["profile"]].docker_image
+    return machine_pool if machine_pool.accepts(image) else None
+
+
+def print_result(result: builder.BuildResult) -> None:
+    if result.succeeded:
+        print(f"Files created by {result.name} ({result.status} in "
+              f"{result.duration:.0f} seconds):")
+        for file in result.artifacts:
+            print(file)
+    elif result.status == builder.BuildResult.FAILED:
+        print(f"{result.name} failed after {result.duration:.0f} seconds: "
+              f"{result.error}")
+    else:
+        print(f"{result.name} was cancelled.")
+
+
+def print_summary(results: List[builder.BuildResult]) -> None:
+    statuses = collections.Counter(result.status for result in results)
+    print(", ".join(f"{statuses[status]} {status}"
+                    for status in (builder.BuildResult.BUILT,
+                                   builder.BuildResult.REUSED,
+                                   builder.BuildResult.FAILED,
+                                   builder.BuildResult.CANCELLED)))
+
+
+def _create_build_scheduler(arguments: Dict[str, str]) -> scheduler.BuildScheduler:
+    return scheduler.BuildScheduler(max_cpus=arguments.get("max_cpus"),
+                                    max_memory=arguments.get("max_memory"),
+                                    max_compiles=arguments.get("max_compiles"))
+
+
+def run_cache_command(arguments: Dict[str, str]) -> None:
+    for cache_name, _cache in cache.get_caches().items():
+        print(f"{cache_name} cache ({_cache.root}):")
+        if arguments["cache_action"] == "list":
+            print_cache_entries(_cache.entries())
+        elif arguments["cache_action"] == "prune":
+            max_size = 0 if arguments["all"] else arguments.get("max_size")
+            evicted_entries = _cache.prune(max_size)
+            print(f"Evicted {len(evicted_entries)} cache entries.")
+            print_cache_entries(evicted_entries)
+
+
+def run_images_command(arguments: Dict[str, str]) -> None:
+    if arguments["images_action"] == "list":
+        print_base_images()
+        return
+    for name, _configuration in _get_bake_configurations(arguments).items():
+        if not _configuration.builder_parameters.get("compile_python", True):
+            print(f"{name} does not compile Python, skipping it.")
+            continue
+        base_image = builder.bake_base_image(_configuration,
+                                             arguments.get("force", False))
+        print(f"Base image for {name}: {base_image}")
+
+
+def _get_bake_configurations(arguments: Dict[str, str]) -> Dict[str, configuration.Configuration]:
+    if arguments.get("configuration_file") is not None:
+        return configuration.read(arguments["configuration_file"])
+    missing_arguments = [argument for argument in ("profile", "python_version")
+                         if argument not in arguments]
+    if missing_arguments:
+        raise ValueError("Baking a base image without a configuration file "
+                         f"needs: {', '.join(missing_arguments)}")
+    name = f"{arguments['profile']}-{arguments['python_version']}"
+    # Base images don't depend on application, but builds need one.
+    return {name: configuration.Configuration(
+        {"name": name,
+         "app": defaults.BASE_IMAGE_REPOSITORY,
+         "version": arguments["python_version"],
+         "source_directory": os.getcwd(),
+         "profile": arguments["profile"],
+         "python_version": arguments["python_version"]})}
+
+
+def print_base_images() -> None:
+    for image in buildmachine.list_images(defaults.BASE_IMAGE_REPOSITORY):
+        labels = image.labels or {}
+        print(f"{', '.join(image.tags)}: "
+              f"profile={labels.get('vdist.profile')} "
+              f"python_version={labels.get('vdist.python_version')}")
 
 
-def print_results(workers: List[futures.Executor]) -> None:
-    for future in futures.as_completed(workers):
-        files_created = future.result()
-        for worker_name, files in files_created.items():
-            print(f"Files created by {worker_name}:")
-            for file in files:
-                print(file)
+def print_cache_entries(entries: List[cache.CacheEntry]) -> None:
+    for entry in sorted(entries, key=lambda entry: entry.last_used,
+                        reverse=True):
+        # Every cache keeps different metadata, but all of them are flat.
+        description = "  ".join(f"{key}: {value}"
+                                for key, value in entry.metadata.items()
+                                if not isinstance(value, (dict, list)))
+        last_used = time.strftime("%Y-%m-%d %H:%M:%S",
+                                  time.localtime(entry.last_used))
+        print(f"{entry.key[:12]}  {entry.size / 1024 ** 2:10.1f} MB  "
+              f"{last_used}  {description}")
 
 
 @contextlib.contextmanager
@@ -69,13 +435,29 @@ def main(args: List=sys.argv[1:]) -> None:
     try:
         with time_execution():
             console_arguments = console_parser.parse_arguments(args)
-            configurations = _get_build_configurations(console_arguments)
-            run_builds(configurations)
+            if console_arguments["mode"] == "cache":
+                run_cache_command(console_arguments)
+                succeeded = True
+            elif console_arguments["mode"] == "images":
+                run_images_command(console_arguments)
+                succeeded = True
+            else:
+                configurations = _get_build_configurations(console_arguments)
+                results = run_builds(configurations,
+                                     pool_size=console_arguments.get("pool_size",
+                                                                     defaults.MACHINE_POOL_SIZE),
+                                     build_scheduler=_create_build_scheduler(console_arguments),
+                                     force=console_arguments.get("force", False),
+                                     fail_fast=console_arguments.get("fail_fast", False),
+                                     engine_type=console_arguments.get("engine",
+                                                                       defaults.BUILD_ENGINE),
+                                     build_timeout=console_arguments.get("build_timeout"))
+                succeeded = all(result.succeeded for result in results)
     except Exception:
         traceback.print_exc(file=sys.stdout)
         sys.exit(1)
     else:
-        sys.exit(0)
+        sys.exit(0 if succeeded else 1)
 
 
 if __name__ == "__main__":
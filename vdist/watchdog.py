@@ -0,0 +1,42 @@
+import threading
+from typing import Callable
+
+
+class BuildTimeoutException(Exception):
+    pass
+
+
+class Watchdog(object):
+    """ Kills a build script once it runs longer than a timeout.
+
+    Build machines that run their scripts as processes of their own use it
+    around waiting for those processes, and check() afterwards to tell a
+    killed script from a failed one.
+    """
+
+    def __init__(self, timeout: float=None, kill: Callable[[], None]=None):
+        self.timeout = timeout
+        self.kill = kill
+        self.expired = False
+        self._timer = None
+
+    def _expire(self) -> None:
+        self.expired = True
+        self.kill()
+
+    def __enter__(self) -> 'Watchdog':
+        if self.timeout is not None:
+            self._timer = threading.Timer(self.timeout, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def check(self) -> None:
+        """ Raise BuildTimeoutException if script was killed for timing out. """
+        if self.expired:
+            raise BuildTimeoutException(
+                f'Build script did not end within {self.timeout} seconds.')